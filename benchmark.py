@@ -0,0 +1,458 @@
+import sys
+import os
+import csv
+import time
+import argparse
+import subprocess
+import tempfile
+import contextlib
+import io
+import xml.etree.ElementTree as ET
+
+import genPLC
+import mapSimIO
+from varMap import VarMap, MemoryVarMap
+
+try:
+    import resource
+except ImportError: # not available on windows
+    resource = None
+
+
+
+# columns of the synthetic device info sheet, includes columns the generator doesn't use
+sheetColumns = ["Area", "PLC prog unit", "Device Name", "Device", "PLC Tag",
+                "PLC dep gauge1", "PLC dep gauge2", "PLC dep pump1", "PLC dep valve1",
+                "Volume", "sim dep vol1", "sim dep vol2", "Notes", "Location"]
+
+
+
+def peakRss():
+    # peak resident set size of this process in MB
+    if not resource:
+        return float('nan')
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxRss / (1024 * 1024) # bytes on macOS
+    return maxRss / 1024 # kilobytes on linux
+
+
+
+def writeDeviceSheet(fileName, rowCount, unitCount):
+
+    # write a synthetic device info sheet of device groups, each a pirani gauge, a cold cathode gauge
+    # and a valve between them, group i belongs to program unit i % unitCount
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(sheetColumns)
+        for ind in range(rowCount):
+            group = ind // 3
+            unit = "UNIT%d" % (group % unitCount)
+            kind = ind % 3
+            prefix = "TV%dK0-%s" % (group % 10, unit)
+            if kind == 0:
+                row = ["FEE", unit, "%s-GPI-%d" % (prefix, group), "Gauge", "MKS275",
+                       "", "", "", "", "VOL-%d" % group, "", ""]
+            elif kind == 1:
+                row = ["FEE", unit, "%s-GCC-%d" % (prefix, group), "Gauge", "MKS500",
+                       "%s-GPI-%d" % (prefix, group), "", "", "", "VOL-%d" % group, "", ""]
+            else:
+                row = ["FEE", unit, "%s-VGC-%d" % (prefix, group), "Valve", "VGC",
+                       "%s-GCC-%d" % (prefix, group), "?blank#X", "", "", "",
+                       "VOL-%d" % group, "VOL-%d" % (group + 1)]
+            row.extend(["synthetic device", "building 999"])
+            writer.writerow(row)
+
+
+
+def ingestDict(fileName, progUnits):
+
+    # original ingestion: a csv.DictReader dict for every row, scope checked afterwards
+    created = 0
+    with open(fileName, newline='') as f:
+        for row in csv.DictReader(f):
+            if row["PLC prog unit"] in progUnits:
+                genPLC.DeviceInfo(row["Device Name"], row["PLC Tag"].upper(),
+                                  row["PLC dep gauge1"], row["PLC dep gauge2"],
+                                  row["PLC dep pump1"], row["PLC dep valve1"], row["Volume"],
+                                  row["sim dep vol1"], row["sim dep vol2"], row["PLC prog unit"])
+                created = created + 1
+    return created
+
+
+
+def ingestStream(fileName, progUnits):
+
+    # streaming ingestion: projected columns, out of scope rows rejected before allocation
+    created = 0
+    with open(fileName, newline='') as f:
+        reader = genPLC.DeviceInfoReader(f)
+        for rowCount, info in reader.rows(lambda name, unit: unit in progUnits):
+            (iName, iTag, iDepGauge1, iDepGauge2, iDepPump1, iDepValve1,
+             iVolume, iDepVol1, iDepVol2, iProgUnit) = info
+            genPLC.DeviceInfo(iName, iTag.upper(), iDepGauge1, iDepGauge2, iDepPump1,
+                              iDepValve1, iVolume, iDepVol1, iDepVol2, iProgUnit)
+            created = created + 1
+    return created
+
+
+
+ingestModes = {"dict": ingestDict, "stream": ingestStream}
+
+
+
+def runIngest(args):
+
+    # child process, runs a single ingestion mode so peak rss isn't shared between modes
+    if args.child:
+        progUnits = set(["UNIT0"])
+        start = time.perf_counter()
+        created = ingestModes[args.child](args.sheetFile, progUnits)
+        elapsed = time.perf_counter() - start
+        print("%s %d %f %f" % (args.child, created, elapsed, peakRss()))
+        return
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+
+        sheetFile = args.sheetFile
+        if not sheetFile:
+            sheetFile = os.path.join(tmpDir, "device-info.bench.csv")
+            print("writing synthetic device sheet with %d rows, %d program units" %
+                  (args.rows, args.units))
+            writeDeviceSheet(sheetFile, args.rows, args.units)
+        with open(sheetFile, newline='') as f:
+            rowCount = sum(1 for line in f) - 1
+
+        print()
+        print("%-8s %10s %10s %12s %12s" % ("mode", "rows", "in scope", "rows/sec", "peak MB"))
+        for mode in ingestModes:
+            result = subprocess.run([sys.executable, __file__, "ingest", "--child", mode,
+                                     "--sheetFile", sheetFile],
+                                    check=True, capture_output=True, text=True)
+            name, created, elapsed, rss = result.stdout.split()
+            print("%-8s %10d %10s %12.0f %12.1f" %
+                  (name, rowCount, created, rowCount / float(elapsed), float(rss)))
+
+
+
+def legacyWriteToFile(document, fobj, devOrdering):
+
+    # original generator, lines generated up front and written by PlcDocument/VariableDocument
+    # writeToFile with three writes per line, grows devOrdering
+    contentMap = {}
+    for otype, objs in document.contentMap.items():
+        contentMap[otype] = []
+        for obj in objs:
+            contentMap[otype].extend([obj.pragma(), obj.declaration()])
+
+    fobj.write("VAR_GLOBAL\n\n")
+    specifiedKeys = [s["type"] for s in devOrdering]
+    unspecifiedKeys = [value for value in contentMap.keys() if value not in specifiedKeys]
+    for k in unspecifiedKeys:
+        devOrdering.append({"type":k, "label":k})
+    for orderSpec in devOrdering:
+        fbtype = orderSpec["type"]
+        if (fbtype in contentMap.keys()):
+            fobj.write("\n")
+            fobj.write("// " + orderSpec["label"])
+            fobj.write("\n\n")
+            for fbd in contentMap[fbtype]:
+                fobj.write(fbd)
+                fobj.write("\n")
+    fobj.write("\nEND_VAR\n")
+
+
+
+def runRender(args):
+
+    # plc variables document with pragma and declaration lines for each function block
+    fbClasses = [genPLC.Mks275GaugeFB, genPLC.Mks317GaugeFB, genPLC.VrcValveFB,
+                 genPLC.VccValveFB, genPLC.EbaraEvaPumpFB, genPLC.PtmTwisTorrPumpFB]
+    document = genPLC.VariableDocument("BENCH", pragmas=True)
+    for ind in range(args.declarations // 2):
+        name = "TV%dK0-BENCH-DEV-%d" % (ind % 10, ind)
+        info = genPLC.DeviceInfo(name, "", "", "", "", "", "", "", "", "BENCH")
+        fb = fbClasses[ind % len(fbClasses)](info)
+        document.addContent(fb.oType(), [fb])
+    deviceOrdering = [{"type":"FB_MKS275", "label":"MKS275 Gauges"},
+                      {"type":"FB_VRC", "label":"VRC Valves"}]
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+
+        results = {}
+        for mode in ["legacy", "buffered"]:
+            fileName = os.path.join(tmpDir, "gen.bench." + mode)
+            elapsed = []
+            for iteration in range(args.iterations):
+                start = time.perf_counter()
+                with open(fileName, 'w') as f:
+                    if mode == "legacy":
+                        legacyWriteToFile(document, f, list(deviceOrdering))
+                    else:
+                        sectionOrder = genPLC.PlcGenerator.sectionOrder(deviceOrdering, [document])
+                        document.writeToFile(f, sectionOrder)
+                elapsed.append(time.perf_counter() - start)
+            with open(fileName, 'rb') as f:
+                results[mode] = (min(elapsed), f.read())
+
+        size = len(results["legacy"][1])
+        print("%-10s %14s %12s %10s" % ("mode", "decls/sec", "MB/sec", "ms"))
+        for mode, (elapsed, content) in results.items():
+            print("%-10s %14.0f %12.1f %10.1f" % (mode, args.declarations / elapsed,
+                                                  size / elapsed / (1024 * 1024), elapsed * 1000))
+        if results["legacy"][1] != results["buffered"][1]:
+            sys.exit("rendered documents differ")
+        print("output identical: %d bytes" % size)
+
+
+
+def legacyParseLink(plcVar, simTaskPrefix):
+
+    # original mapSimIO link path parsing, done separately for every link
+    ind = plcVar.find('^')
+    if ind == -1:
+        sys.exit("unexpected plc variable format: %s" % plcVar)
+    inoutSpec = plcVar[0:ind]
+    if "Inputs" in inoutSpec:
+        inoutSpec = "Outputs"
+    elif "Outputs" in inoutSpec:
+        inoutSpec = "Inputs"
+    else:
+        sys.exit("unexpected plc task prefix format: %s" % inoutSpec)
+    plcVar = plcVar[ind+1:]
+    simTaskInoutPrefix = simTaskPrefix + " " + inoutSpec
+    varTokens = plcVar.split('.')
+    if len(varTokens) == 3:
+        docName = varTokens[0]
+        varName = varTokens[1]
+        sigName = varTokens[2]
+    else:
+        sys.exit("unexpected plc variable format: %s" % plcVar)
+    return simTaskInoutPrefix, docName, varName, sigName
+
+
+
+def runLinks(args):
+
+    # synthetic plc mappings with 8 links per device, parsed from xml so each path is a separate string,
+    # each link's path is parsed and its variable looked up in the variable map, as mapSimIO does
+    signals = ["i_iPRESS_R", "i_xHV_ON", "i_xDisc_Active", "q_xHV_DIS",
+               "q_xOPN_DO", "i_xOpnLS", "i_xClsLS", "q_RunDO"]
+    lines = ['<OwnerA Name="TIPC^Plc^Plc Instance">']
+    for ind in range(args.links // len(signals)):
+        docName = "GVL_UNIT%d" % (ind % args.docs)
+        lines.append('<OwnerB Name="TIID^Device 1 (EtherCAT)^Term %d">' % ind)
+        for sigInd, sigName in enumerate(signals):
+            taskPrefix = "PlcTask Inputs" if sigName.startswith("i_") else "PlcTask Outputs"
+            lines.append('<Link VarA="%s^%s.fb_TV%dK0_DEV_%d.%s" VarB="Channel %d^Value"/>' %
+                         (taskPrefix, docName, ind % 10, ind, sigName, sigInd + 1))
+        lines.append('</OwnerB>')
+    lines.append('</OwnerA>')
+    plcVars = [link.attrib['VarA'] for link in ET.fromstring("\n".join(lines)).iter('Link')]
+    variableMap = {}
+    for ind in range(args.links // len(signals)):
+        variableMap["fb_TV%dK0_DEV_%d" % (ind % 10, ind)] = {'type': "FB_MKS500",
+                                                           'simVar': "st_TV%dK0_DEV_%d" % (ind % 10, ind)}
+
+    simTaskPrefix = "SimTask"
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpDir:
+
+        varMapFile = os.path.join(tmpDir, "gen.varMap")
+        VarMap.write(varMapFile, variableMap)
+
+        with VarMap.open(varMapFile) as varMap:
+            for mode in ["legacy", "parser"]:
+                elapsed = []
+                for iteration in range(args.iterations):
+                    start = time.perf_counter()
+                    parsed = []
+                    if mode == "legacy":
+                        # path parsed and variable looked up for every link
+                        for plcVar in plcVars:
+                            simTaskInoutPrefix, docName, varName, sigName = legacyParseLink(plcVar, simTaskPrefix)
+                            parsed.append((simTaskInoutPrefix, docName, varName, sigName,
+                                           varMap.get(varName)['simVar']))
+                    else:
+                        # path parsed by LinkPathParser, variable looked up once, as in mapSimulation()
+                        parser = mapSimIO.LinkPathParser(simTaskPrefix)
+                        variables = {}
+                        for plcVar in plcVars:
+                            simTaskInoutPrefix, docName, varName, sigName = parser.parse(plcVar)
+                            variableData = variables.get(varName)
+                            if not variableData:
+                                variableData = varMap.get(varName)
+                                variables[varName] = variableData
+                            parsed.append((simTaskInoutPrefix, docName, varName, sigName,
+                                           variableData['simVar']))
+                    elapsed.append(time.perf_counter() - start)
+                results[mode] = (min(elapsed), parsed)
+
+    print("%-10s %10s %14s %10s" % ("mode", "links", "links/sec", "ms"))
+    for mode, (elapsed, parsed) in results.items():
+        print("%-10s %10d %14.0f %10.1f" % (mode, len(plcVars), len(plcVars) / elapsed, elapsed * 1000))
+    if results["legacy"][1] != results["parser"][1]:
+        sys.exit("parsed link paths differ")
+    print("parsed link paths identical, speedup %.2fx" % (results["legacy"][0] / results["parser"][0]))
+
+
+
+def writeProject(fileName, variableMap, signalMaps):
+
+    # synthetic tsproj with a plc mappings section linking every mapped signal of each device to a terminal
+    # channel, and no sim mappings, written with crlf line ends like twincat
+    lines = ['<?xml version="1.0"?>', '<TcSmProject TcSmVersion="1.0" TcVersion="3.1.4024.12">',
+             '\t<Project ProjectGUID="{00000000-0000-0000-0000-000000000000}">', '\t</Project>',
+             '\t<Mappings>', '\t\t<OwnerA Name="TIPC^Plc^Plc Instance">']
+    term = 0
+    for varName, variableData in variableMap.items():
+        signalMap = signalMaps.get(variableData['type'])
+        if not signalMap:
+            continue
+        term = term + 1
+        lines.append('\t\t\t<OwnerB Name="TIID^Device 1 (EtherCAT)^Term %d">' % term)
+        for sigInd, sigName in enumerate(signalMap):
+            taskPrefix = "PlcTask Inputs" if sigName.startswith("i_") else "PlcTask Outputs"
+            lines.append('\t\t\t\t<Link VarA="%s^GVL_BENCH.%s.%s" VarB="Channel %d^Value"/>' %
+                         (taskPrefix, varName, sigName, sigInd + 1))
+        lines.append('\t\t\t</OwnerB>')
+    lines.extend(['\t\t</OwnerA>', '\t</Mappings>', '</TcSmProject>'])
+    with open(fileName, 'w', newline='') as f:
+        f.write("\r\n".join(lines) + "\r\n")
+
+
+
+def runPipeline(args):
+
+    # time each stage of the fused pipeline in this process, then compare separate genPLC.py and
+    # mapSimIO.py runs with a pipeline.py run, each in a new process and working directory
+    mapperNames = ["TIPC^Plc^Plc Instance", "TIPC^Sim^Sim Instance", "SimTask",
+                   "TIID^Device 2 (EtherCAT Simulation)^"]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpDir:
+
+        sheetFile = os.path.join(tmpDir, "device-info.bench.csv")
+        print("writing synthetic device sheet with %d rows, %d program units" % (args.rows, args.units))
+        writeDeviceSheet(sheetFile, args.rows, args.units)
+
+        stagesDir = os.path.join(tmpDir, "stages")
+        os.mkdir(stagesDir)
+        os.chdir(stagesDir)
+        try:
+            stages = {}
+            def stage(name, function, *functionArgs):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = function(*functionArgs)
+                stages[name] = time.perf_counter() - start
+                return result
+
+            stageArgs = argparse.Namespace(deviceInfoFile=sheetFile, tags=False, plc=False, sim=False,
+                                           deviceFile=None, progUnitsFile=None, jobs=1, closure=None)
+            options, handler = stage("options", genPLC.readOptions, stageArgs)
+            deviceContainer, plcContainer, simContainer = stage("ingest", genPLC.readDevices, sheetFile,
+                                                                handler, options)
+            graph = stage("resolve", genPLC.resolveDependencies, deviceContainer, plcContainer,
+                          simContainer, options)
+            output, rowCache = stage("generate", genPLC.generateCode, deviceContainer, plcContainer,
+                                     simContainer, graph, options)
+            variableMap, signalMaps = stage("variable map", genPLC.PlcGenerator.variableMap,
+                                            deviceContainer, plcContainer, simContainer)
+
+            # hand off to the mapper through gen.varMap, as separate runs do, the file is read back
+            # by looking up every variable
+            def handOff():
+                VarMap.write("gen.varMap", variableMap, signalMaps)
+                with VarMap.open("gen.varMap") as varMap:
+                    for varName in variableMap:
+                        varMap.get(varName)
+            stage("varMap file", handOff)
+
+            writeProject("bench.tsproj", variableMap, signalMaps)
+            pairing = mapSimIO.Options()
+            (pairing.plcName, pairing.simName, pairing.simTaskPrefix, pairing.simDevicePrefix) = mapperNames
+            pairing.variableMap = MemoryVarMap(variableMap, signalMaps)
+            summary = mapSimIO.RunSummary("bench.tsproj")
+            mapperArgs = argparse.Namespace(check=False, dump=False, report=None, backupKeep=1, backupBudget=0)
+            stage("mapper", mapSimIO.mapProject, "bench.tsproj", [pairing], mapperArgs, summary)
+        finally:
+            os.chdir(cwd)
+
+        print()
+        print("%-14s %10s" % ("stage", "ms"))
+        for name, elapsed in stages.items():
+            print("%-14s %10.1f" % (name, elapsed * 1000))
+        for name, elapsed in summary.phases.items():
+            print("  %-12s %10.1f" % (name, elapsed * 1000))
+        print("links: %d" % summary.report.links)
+
+        # end to end, each mode from a fresh working directory
+        projFile = os.path.join(stagesDir, "bench.tsproj")
+        genPLCFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "genPLC.py")
+        mapSimIOFile = os.path.join(os.path.dirname(genPLCFile), "mapSimIO.py")
+        pipelineFile = os.path.join(os.path.dirname(genPLCFile), "pipeline.py")
+        commands = {"separate": [[sys.executable, genPLCFile, sheetFile],
+                                 [sys.executable, mapSimIOFile, "test.tsproj"] + mapperNames + ["gen.varMap"]],
+                    "fused": [[sys.executable, pipelineFile, sheetFile, "test.tsproj"] + mapperNames]}
+        results = {}
+        for mode, modeCommands in commands.items():
+            modeDir = os.path.join(tmpDir, mode)
+            os.mkdir(modeDir)
+            with open(projFile, 'rb') as src:
+                with open(os.path.join(modeDir, "test.tsproj"), 'wb') as dst:
+                    dst.write(src.read())
+            start = time.perf_counter()
+            for command in modeCommands:
+                subprocess.run(command, cwd=modeDir, check=True, stdout=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            with open(os.path.join(modeDir, "test.tsproj"), 'rb') as f:
+                results[mode] = (elapsed, f.read())
+
+        print()
+        print("%-10s %10s" % ("mode", "ms"))
+        for mode, (elapsed, content) in results.items():
+            print("%-10s %10.1f" % (mode, elapsed * 1000))
+        if results["separate"][1] != results["fused"][1]:
+            sys.exit("mapped project files differ")
+        print("mapped project files identical, speedup %.2fx" %
+              (results["separate"][0] / results["fused"][0]))
+
+
+
+def main():
+
+    # process command line
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    ingestParser = subparsers.add_parser("ingest", help="device info ingestion rows/sec and peak rss")
+    ingestParser.add_argument("--rows", help="rows in synthetic sheet", type=int, default=1000000)
+    ingestParser.add_argument("--units", help="program units in synthetic sheet", type=int, default=100)
+    ingestParser.add_argument("--sheetFile", help="use existing device info file instead of synthetic sheet")
+    ingestParser.add_argument("--child", help=argparse.SUPPRESS, choices=list(ingestModes))
+    ingestParser.set_defaults(run=runIngest)
+
+    renderParser = subparsers.add_parser("render", help="document rendering and write throughput")
+    renderParser.add_argument("--declarations", help="declaration lines in document", type=int, default=100000)
+    renderParser.add_argument("--iterations", help="best of n iterations", type=int, default=5)
+    renderParser.set_defaults(run=runRender)
+
+    linksParser = subparsers.add_parser("links", help="mapSimIO link path parsing throughput")
+    linksParser.add_argument("--links", help="links in synthetic project", type=int, default=200000)
+    linksParser.add_argument("--docs", help="plc documents in synthetic project", type=int, default=50)
+    linksParser.add_argument("--iterations", help="best of n iterations", type=int, default=5)
+    linksParser.set_defaults(run=runLinks)
+
+    pipelineParser = subparsers.add_parser("pipeline", help="generator and mapper stage times, and separate " +
+                                           "runs compared with pipeline.py")
+    pipelineParser.add_argument("--rows", help="rows in synthetic sheet", type=int, default=30000)
+    pipelineParser.add_argument("--units", help="program units in synthetic sheet", type=int, default=10)
+    pipelineParser.set_defaults(run=runPipeline)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+
+if __name__ == '__main__':
+    main()
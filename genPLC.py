@@ -1,9 +1,19 @@
 import sys
 from abc import ABC, abstractmethod
+import inspect
 import csv
 import re
+import fnmatch
 import argparse
-import pickle
+import operator
+import concurrent.futures
+import multiprocessing
+import varMap
+import functools
+import hashlib
+import json
+import os
+import copy
 
 class DeviceInfo:
     
@@ -25,7 +35,23 @@ class DeviceInfo:
 # registers device class types with PlcDevice class for look up by tag
 def register(deviceClass):
     
-    PlcDevice.register(deviceClass.tag(), deviceClass)
+    PlcDevice.register(deviceClass)
+    return deviceClass
+
+
+
+# compiled registry entry with the classes used to create a device and its plc and sim objects
+class DeviceClasses:
+
+
+
+    def __init__(self, tag, deviceClass, plcFBClass, simFBClass, simStructClass, signalMap):
+        self.tag = tag
+        self.deviceClass = deviceClass
+        self.plcFBClass = plcFBClass
+        self.simFBClass = simFBClass
+        self.simStructClass = simStructClass
+        self.signalMap = signalMap
 
 
     
@@ -34,20 +60,98 @@ class PlcDevice(ABC):
 
 
 
-    deviceTypes = {}
+    deviceClasses = [] # concrete classes in order of registration
+    deviceTypes = {} # compiled registry, tag to DeviceClasses
+    signalMaps = {} # compiled registry, plc function block type to signal map
+
+    # plc function block signal to sim struct field, used by mapSimIO.py to link the sim to the
+    # plc's io, a "?unmapped" field means the signal isn't linked, devices without a signal map
+    # aren't supported by mapSimIO.py
+    signalMap = {}
 
 
 
-    # register PlcDevice concrete classes for look up by tag
+    # register PlcDevice concrete classes for look up by tag, the registry is compiled and
+    # validated by compileRegistry()
     @classmethod
-    def register(cls, tag, theClass):
-        cls.deviceTypes[tag] = theClass
-        
+    def register(cls, theClass):
+        cls.deviceClasses.append(theClass)
+
+
+
+    # resolve the plc and sim object class names of each registered device class, so that
+    # missing or mistyped classes are reported at startup instead of when a device is created,
+    # and compile the signal maps of the device classes into a table by plc function block type
+    @classmethod
+    def compileRegistry(cls):
+
+        errors = []
+        deviceTypes = {}
+        signalMaps = {}
+        signalMapClasses = {} # plc function block type to device class declaring its signal map
+
+        def resolve(deviceClass, className, baseClass):
+            objClass = globals().get(className)
+            if ((not isinstance(objClass, type)) or (not issubclass(objClass, baseClass))):
+                errors.append("device class %s: %s is not a %s class" %
+                              (deviceClass.__name__, className, baseClass.__name__))
+                return None
+            if inspect.isabstract(objClass):
+                errors.append("device class %s: %s is abstract" %
+                              (deviceClass.__name__, className))
+                return None
+            return objClass
+
+        for deviceClass in cls.deviceClasses:
+            tag = deviceClass.tag()
+            if tag in deviceTypes:
+                errors.append("device class %s: tag %s already registered by %s" %
+                              (deviceClass.__name__, tag, deviceTypes[tag].deviceClass.__name__))
+                continue
+            classes = DeviceClasses(
+                tag, deviceClass,
+                resolve(deviceClass, deviceClass.plcFunctionBlockType(), PlcFunctionBlock),
+                resolve(deviceClass, deviceClass.simFunctionBlockType(), PlcFunctionBlock),
+                resolve(deviceClass, deviceClass.simStructType(), PlcStruct),
+                deviceClass.signalMap)
+            deviceTypes[tag] = classes
+
+            if classes.plcFBClass is not None and not classes.plcFBClass.fbType:
+                errors.append("device class %s: %s doesn't set fbType" %
+                              (deviceClass.__name__, classes.plcFBClass.__name__))
+                continue
+
+            signalMap = deviceClass.signalMap
+            if ((not isinstance(signalMap, dict)) or
+                (not all([isinstance(sig, str) and isinstance(simSig, str) and sig and simSig
+                          for sig, simSig in signalMap.items()]))):
+                errors.append("device class %s: signalMap must map signal names to sim struct field names" %
+                              deviceClass.__name__)
+                continue
+            if len(signalMap) == 0 or classes.plcFBClass is None:
+                continue
+
+            # devices can share a function block type, then their signal maps must be the same
+            fbType = classes.plcFBClass.fbType
+            if fbType in signalMaps and signalMaps[fbType] != signalMap:
+                errors.append("device class %s: signalMap for %s differs from the one in %s" %
+                              (deviceClass.__name__, fbType, signalMapClasses[fbType].__name__))
+                continue
+            signalMaps[fbType] = signalMap
+            signalMapClasses[fbType] = deviceClass
+
+        if len(errors):
+            sys.exit("invalid device class registry:\n" + "\n".join(errors))
+
+        cls.deviceTypes = deviceTypes
+        cls.signalMaps = signalMaps
+
+
 
     # return the class for the specified tag
     @classmethod
     def deviceType(cls, tag):
-        return cls.deviceTypes[tag]
+        return cls.deviceTypes[tag].deviceClass
     
 
 
@@ -61,8 +165,9 @@ class PlcDevice(ABC):
     # create instance of class with specified tag
     @classmethod
     def createDevice(cls, tag, deviceInfo):
-        deviceClass = cls.deviceType(tag)
-        deviceInstance = deviceClass(deviceInfo)
+        classes = cls.deviceTypes[tag]
+        deviceInstance = classes.deviceClass(deviceInfo)
+        deviceInstance.classes = classes
         return deviceInstance
 
 
@@ -76,6 +181,7 @@ class PlcDevice(ABC):
 
     def __init__(self, deviceInfo):
         self.deviceInfo = deviceInfo
+        self.classes = None # compiled registry entry, set by createDevice()
 
 
 
@@ -96,42 +202,42 @@ class PlcDevice(ABC):
 
     # return function block for plc code
     def plcFunctionBlock(self):
-        className = self.plcFunctionBlockType()
-        cls = globals()[className]
-        return cls(self.deviceInfo)
+        return self.classes.plcFBClass(self.deviceInfo)
 
 
 
+    # return name of plc function block class, resolved by compileRegistry()
+    @staticmethod
     @abstractmethod
-    def plcFunctionBlockType(self):
+    def plcFunctionBlockType():
         pass
 
 
 
     # return function block for sim code
     def simFunctionBlock(self):
-        className = self.simFunctionBlockType()
-        cls = globals()[className]
-        return cls(self.deviceInfo)
+        return self.classes.simFBClass(self.deviceInfo)
 
 
 
+    # return name of sim function block class, resolved by compileRegistry()
+    @staticmethod
     @abstractmethod
-    def simFunctionBlockType(self):
+    def simFunctionBlockType():
         pass
 
 
 
     # return struct for sim code
     def simStruct(self):
-        className = self.simStructType()
-        cls = globals()[className]
-        return cls(self.deviceInfo)
+        return self.classes.simStructClass(self.deviceInfo)
 
 
 
+    # return name of sim struct class, resolved by compileRegistry()
+    @staticmethod
     @abstractmethod
-    def simStructType(self):
+    def simStructType():
         pass
 
 
@@ -167,17 +273,20 @@ class VcnValveDevice(ValveDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "VcnValveFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimVacuumValveFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimVacuumValveStruct"
 
 
@@ -186,6 +295,14 @@ class VcnValveDevice(ValveDevice):
 class VgcValveDevice(ValveDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_VacuumValve
+    signalMap = {
+        "q_xOPN_DO" : "i_xSol",
+        "i_xOpnLS" : "q_xOpnLS",
+        "i_xClsLS" : "q_xClsLS"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -198,17 +315,20 @@ class VgcValveDevice(ValveDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "VgcValveFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimVacuumValveFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimVacuumValveStruct"
 
 
@@ -217,6 +337,14 @@ class VgcValveDevice(ValveDevice):
 class VrcValveDevice(ValveDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_VacuumValve
+    signalMap = {
+        "q_xOPN_DO" : "i_xSol",
+        "i_xOpnLS" : "q_xOpnLS",
+        "i_xClsLS" : "q_xClsLS"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -229,17 +357,20 @@ class VrcValveDevice(ValveDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "VrcValveFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimVacuumValveFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimVacuumValveStruct"
 
 
@@ -260,17 +391,20 @@ class VccValveDevice(ValveDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "VccValveFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimVacuumValveFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimVacuumValveStruct"
 
 
@@ -284,6 +418,13 @@ class ColdCathodeGaugeDevice(GaugeDevice):
 class Mks422GaugeDevice(ColdCathodeGaugeDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MKS_422
+    signalMap = {
+        "i_iPRESS_R" : "q_iRawPress",
+        "q_xHV_DIS" : "i_xHvOn"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -296,17 +437,20 @@ class Mks422GaugeDevice(ColdCathodeGaugeDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "Mks422GaugeFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimMks422GaugeFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimMks422GaugeStruct"
 
 
@@ -315,6 +459,15 @@ class Mks422GaugeDevice(ColdCathodeGaugeDevice):
 class Mks500GaugeDevice(ColdCathodeGaugeDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MKS_500
+    signalMap = {
+        "i_iPRESS_R" : "q_iRawPress",
+        "i_xHV_ON" : "q_xHVOn",
+        "i_xDisc_Active" : "q_DisActive",
+        "q_xHV_DIS" : "i_xHvOn"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -327,17 +480,20 @@ class Mks500GaugeDevice(ColdCathodeGaugeDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "Mks500GaugeFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimMks500GaugeFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimMks500GaugeStruct"
 
 
@@ -346,6 +502,15 @@ class Mks500GaugeDevice(ColdCathodeGaugeDevice):
 class Mks500EPGaugeDevice(ColdCathodeGaugeDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MKS_500
+    signalMap = {
+        "i_iPRESS_R" : "q_iRawPress",
+        "i_xHV_ON" : "q_xHVOn",
+        "i_xDisc_Active" : "q_DisActive",
+        "q_xHV_DIS" : "i_xHvOn"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -358,17 +523,20 @@ class Mks500EPGaugeDevice(ColdCathodeGaugeDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "Mks500EPGaugeFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimMks500GaugeFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimMks500GaugeStruct"
 
 
@@ -377,6 +545,12 @@ class Mks500EPGaugeDevice(ColdCathodeGaugeDevice):
 class Mks275GaugeDevice(GaugeDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MKS_275
+    signalMap = {
+        "i_iPRESS_R" : "q_iRawPress"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -389,17 +563,20 @@ class Mks275GaugeDevice(GaugeDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "Mks275GaugeFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimMks275GaugeFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimMks275GaugeStruct"
 
 
@@ -408,6 +585,12 @@ class Mks275GaugeDevice(GaugeDevice):
 class Mks317GaugeDevice(GaugeDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MKS_275, since there is not a sim function block for 317
+    signalMap = {
+        "i_iPRESS_R" : "q_iRawPress"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -420,17 +603,20 @@ class Mks317GaugeDevice(GaugeDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "Mks317GaugeFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimMks275GaugeFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimMks275GaugeStruct"
 
 
@@ -439,6 +625,14 @@ class Mks317GaugeDevice(GaugeDevice):
 class PipGammaPumpDevice(PumpDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_GAM_PIP
+    signalMap = {
+        "q_xHVEna_DO" : "xOn",
+        "i_iPRESS" : "?unmapped",
+        "i_xSP_DI" : "?unmapped"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -451,17 +645,20 @@ class PipGammaPumpDevice(PumpDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "PipGammaPumpFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
          return "SimGamPipPumpFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimGamPipPumpStruct"
 
 
@@ -470,6 +667,18 @@ class PipGammaPumpDevice(PumpDevice):
 class EbaraDryPumpDevice(PumpDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MechPump
+    signalMap = {
+        "q_xMPStart" : "i_xRun",
+        "q_xBPStart" : "?unmapped",
+        "i_xMPStatus" : "?unmapped",
+        "i_xBPStatus" : "?unmapped",
+        "i_xWarning" : "?unmapped",
+        "i_xAlarm" : "?unmapped",
+        "i_xRemote" : "?unmapped"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -482,17 +691,20 @@ class EbaraDryPumpDevice(PumpDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "EbaraDryPumpFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
          return "SimRoughPumpFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimRoughMechPumpStruct"
 
 
@@ -501,6 +713,15 @@ class EbaraDryPumpDevice(PumpDevice):
 class EbaraEvaPumpDevice(PumpDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MechPump
+    signalMap = {
+        "q_xRunDo" : "i_xRun",
+        "q_xRemote" : "?unmapped",
+        "i_xAlarmOK" : "?unmapped",
+        "i_xIsRun" : "?unmapped"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -513,17 +734,20 @@ class EbaraEvaPumpDevice(PumpDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "EbaraEvaPumpFB"
 
 
 
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
          return "SimRoughPumpFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimRoughMechPumpStruct"
 
 
@@ -532,6 +756,26 @@ class EbaraEvaPumpDevice(PumpDevice):
 class PtmEbara010mPumpDevice(PumpDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MechPump
+    signalMap = {
+        "q_xStart" : "i_xRun",
+        "q_xStop" : "?unmapped",
+        "q_xReset" : "?unmapped",
+        "q_xProtection" : "?unmapped",
+        "q_xSetSpeed" : "?unmapped",
+        "q_iSpeedSet" : "?unmapped",
+        "i_xDecel" : "?unmapped",
+        "i_xAccel" : "?unmapped",
+        "i_xRotate" : "?unmapped",
+        "i_xNCFault" : "?unmapped",
+        "i_xAtSpd" : "?unmapped",
+        "i_iRawSpeed" : "?unmapped",
+        "i_xAlarm" : "?unmapped",
+        "i_iTempMon" : "?unmapped",
+        "i_iCurrentMon" : "?unmapped"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -544,17 +788,20 @@ class PtmEbara010mPumpDevice(PumpDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "PtmEbara010mPumpFB"
 
 
     
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimTurboPumpFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimTurboMechPumpStruct"
 
 
@@ -563,6 +810,23 @@ class PtmEbara010mPumpDevice(PumpDevice):
 class PtmEbara011mPumpDevice(PumpDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MechPump
+    signalMap = {
+        "q_xStart" : "i_xRun",
+        "q_xStop" : "?unmapped",
+        "q_xReset" : "?unmapped",
+        "q_xProtection" : "?unmapped",
+        "q_xSetSpeed" : "?unmapped",
+        "q_iSpeedSet" : "?unmapped",
+        "i_xDecel" : "?unmapped",
+        "i_xAccel" : "?unmapped",
+        "i_xRotate" : "?unmapped",
+        "i_xFaultNC" : "?unmapped",
+        "i_xAtSpd" : "?unmapped",
+        "i_iRawSpeed" : "?unmapped"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -575,17 +839,20 @@ class PtmEbara011mPumpDevice(PumpDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "PtmEbara011mPumpFB"
 
 
     
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimTurboPumpFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimTurboMechPumpStruct"
 
 
@@ -594,6 +861,14 @@ class PtmEbara011mPumpDevice(PumpDevice):
 class PtmTwisTorrPumpDevice(PumpDevice):
 
 
+
+    # plc function block signal to sim struct field, ST_MechPump
+    signalMap = {
+        "q_RunDO" : "i_xRun",
+        "i_xAtSpd" : "q_xAtSpd",
+        "i_xFault" : "q_xErr"}
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
@@ -606,17 +881,20 @@ class PtmTwisTorrPumpDevice(PumpDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "PtmTwisTorrPumpFB"
 
 
     
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimTurboPumpFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimTurboMechPumpStruct"
 
 
@@ -637,30 +915,62 @@ class PtmAgilentPumpDevice(PumpDevice):
 
 
 
-    def plcFunctionBlockType(self):
+    @staticmethod
+    def plcFunctionBlockType():
         return "PtmAgilentPumpFB"
 
 
     
-    def simFunctionBlockType(self):
+    @staticmethod
+    def simFunctionBlockType():
         return "SimTurboPumpFB"
 
 
 
-    def simStructType(self):
+    @staticmethod
+    def simStructType():
         return "SimTurboMechPumpStruct"
 
 
     
+# declares a link from the code of a plc object to another plc object, resolved by DependencyGraph
+class Dependency:
+
+
+
+    # plc object types that can be linked to, same values as the PlcContainer object types
+    otypeFB = "fb"
+    otypeStruct = "st"
+    otypeVolume = "vol"
+
+
+
+    def __init__(self, name, infoAttr, otype, blankOk=False):
+        self.name = name # key of the resolved plc object in PlcObject.refs
+        self.infoAttr = infoAttr # DeviceInfo attribute containing the name of the target
+        self.otype = otype # plc object type of the target
+        self.blankOk = blankOk # target may be a ?blank placeholder
+
+
+
 # abstract base class for plc code objects
 class PlcObject(ABC):
 
 
+
+    # list of Dependency, plc objects that this object's code links to
+    dependencies = []
+
+
     
     def __init__(self, deviceInfo):
-        self.container = None
+        self.deviceInfo = deviceInfo
         self.pragmaName = deviceInfo.name.replace("-", ":")
 
+        # map of Dependency name to plc object, resolved by DependencyGraph before code generation,
+        # value is None for ?blank placeholder dependencies
+        self.refs = {}
+
 
         
     @abstractmethod
@@ -690,14 +1000,17 @@ class PlcFunctionBlock(PlcObject):
 
     prefixFb = "fb_"
 
+    # function block type, set by each function block class
+    fbType = None
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
         self.fbName = self.prefixFb + deviceInfo.name.replace("-", "_")
 
 
-    @abstractmethod
+
     def oType(self):
-        pass
+        return self.fbType
 
 
 
@@ -721,6 +1034,8 @@ class VcnValveFB(PlcFunctionBlock):
 
 
     
+    fbType = "FB_VCN"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
@@ -732,49 +1047,32 @@ class VcnValveFB(PlcFunctionBlock):
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
 
-    
 
-    def oType(self):
-        return "FB_VCN";
+
+class VgcValveFB(PlcFunctionBlock):
 
 
 
-class VgcValveFB(PlcFunctionBlock):
+    fbType = "FB_VGC"
+
+    # gauge dependencies may be ?blank placeholders for devices at section boundary
+    dependencies = [Dependency("upGauge", "depGauge1", Dependency.otypeFB, blankOk=True),
+                    Dependency("downGauge", "depGauge2", Dependency.otypeFB, blankOk=True)]
 
 
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
-        self.upstreamGauge = deviceInfo.depGauge1
-        self.downstreamGauge = deviceInfo.depGauge2
 
 
 
     def code(self):
 
-        # check upstream gauge dependency for placeholder
-        if self.upstreamGauge.startswith("?blank"):
-            # replace placeholder with empty dependency, used for devices at boundary
-            upstr = ""
-        else:
-            upGauge = self.container.getFB(self.upstreamGauge)
-            if upGauge:
-                upstr = upGauge.fbName + ".IG"
-            else:
-                sys.exit("device %s: unable to find upGauge: %s" %
-                         (self.objectName(), self.upstreamGauge))
-            
-        # check downstream gauge dependency for placeholder
-        if self.downstreamGauge.startswith("?blank"):
-            # replace placeholder with empty dependency, used for devices at boundary
-            downstr = ""
-        else:
-            downGauge = self.container.getFB(self.downstreamGauge)
-            if downGauge:
-                downstr = downGauge.fbName + ".IG"
-            else:
-                sys.exit("device %s: unable to find downGauge: %s" %
-                         (self.objectName(), self.downstreamGauge))
+        # replace placeholder with empty dependency, used for devices at boundary
+        upGauge = self.refs["upGauge"]
+        upstr = upGauge.fbName + ".IG" if upGauge else ""
+        downGauge = self.refs["downGauge"]
+        downstr = downGauge.fbName + ".IG" if downGauge else ""
             
         return (self.fbName +
                 PlcGenerator.openParen +
@@ -787,17 +1085,14 @@ class VgcValveFB(PlcFunctionBlock):
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
 
-    
-
-    def oType(self):
-        return "FB_VGC";
-
 
 
 class VrcValveFB(PlcFunctionBlock):
 
 
     
+    fbType = "FB_VRC"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
@@ -810,17 +1105,14 @@ class VrcValveFB(PlcFunctionBlock):
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
 
-    
-
-    def oType(self):
-        return "FB_VRC";
-
 
 
 class VccValveFB(PlcFunctionBlock):
 
 
     
+    fbType = "FB_VCC"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
@@ -833,28 +1125,23 @@ class VccValveFB(PlcFunctionBlock):
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
 
-    
 
-    def oType(self):
-        return "FB_VCC";
 
+class ColdCathodeGaugeFB(PlcFunctionBlock):
 
 
-class ColdCathodeGaugeFB(PlcFunctionBlock):
+
+    dependencies = [Dependency("ionGauge", "depGauge1", Dependency.otypeFB)]
 
 
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
-        self.ionGauge = deviceInfo.depGauge1
 
 
 
     def code(self):
-        ionGauge = self.container.getFB(self.ionGauge)
-        if ((not ionGauge)):
-            sys.exit("device %s: unable to find ion gauge: %s" %
-                     (self.objectName(), self.ionGauge))
+        ionGauge = self.refs["ionGauge"]
         return (self.fbName +
                 PlcGenerator.openParen +
                 "PG := " +
@@ -868,48 +1155,41 @@ class Mks422GaugeFB(ColdCathodeGaugeFB):
 
 
     
+    fbType = "FB_MKS422"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
 
 
-    def oType(self):
-        return "FB_MKS422";
-
-
-
 class Mks500GaugeFB(ColdCathodeGaugeFB):
 
 
     
+    fbType = "FB_MKS500"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
 
 
-    def oType(self):
-        return "FB_MKS500";
-
-
-
 class Mks500EPGaugeFB(ColdCathodeGaugeFB):
 
 
     
+    fbType = "FB_MKS500_EP"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
 
 
-    def oType(self):
-        return "FB_MKS500_EP";
-
-
-
 class Mks275GaugeFB(PlcFunctionBlock):
 
 
     
+    fbType = "FB_MKS275"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
@@ -921,10 +1201,6 @@ class Mks275GaugeFB(PlcFunctionBlock):
                 "PG=>" +
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
-    
-
-    def oType(self):
-        return "FB_MKS275";
 
 
 
@@ -932,6 +1208,8 @@ class Mks317GaugeFB(PlcFunctionBlock):
 
 
     
+    fbType = "FB_MKS317"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
@@ -943,57 +1221,52 @@ class Mks317GaugeFB(PlcFunctionBlock):
                 "PG=>" +
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
-    
-
-    def oType(self):
-        return "FB_MKS317";
 
 
 
 class PipGammaPumpFB(PlcFunctionBlock):
 
 
+
+    fbType = "FB_PIP_GAMMA"
+
+    dependencies = [Dependency("ccGauge", "depGauge1", Dependency.otypeFB)]
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
-        self.ccGauge = deviceInfo.depGauge1
 
 
 
     def code(self):
-        ccGauge = self.container.getFB(self.ccGauge)
-        if ((not ccGauge)):
-            # TODO: exit if dependencies don't exist?
-            sys.exit("device %s: unable to find cold cathode gauge: %s" %
-                     (self.objectName(), self.ccGauge))
+        ccGauge = self.refs["ccGauge"]
         return (self.fbName +
                 PlcGenerator.openParen +
                 "i_stGauge := " +
                 ccGauge.fbName + ".PG" +
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
-    
-
-    def oType(self):
-        return "FB_PIP_GAMMA";
 
 
 
 class EbaraDryPumpFB(PlcFunctionBlock):
 
 
+
+    fbType = "FB_EbaraDryPump"
+
+    dependencies = [Dependency("bpGauge", "depGauge1", Dependency.otypeFB)] # adjacent pirani gauge
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
-        self.bpGauge = deviceInfo.depGauge1 # adjacent pirani gauge
 
 
 
     def code(self):
-        bpGauge = self.container.getFB(self.bpGauge)
-        if ((not bpGauge)):
-            sys.exit("device %s: unable to find pirani gauge: %s" %
-                     (self.objectName(), self.bpGauge))
+        bpGauge = self.refs["bpGauge"]
         return (self.fbName +
                 PlcGenerator.openParen +
                 "i_stBPGauge := " +
@@ -1001,10 +1274,6 @@ class EbaraDryPumpFB(PlcFunctionBlock):
                 ", i_xVlvOpn := TRUE, i_xExtIlkOK := TRUE" + 
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
-    
-
-    def oType(self):
-        return "FB_EbaraDryPump";
 
 
 
@@ -1012,6 +1281,8 @@ class EbaraEvaPumpFB(PlcFunctionBlock):
 
 
     
+    fbType = "FB_EbaraEVA"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
@@ -1023,10 +1294,6 @@ class EbaraEvaPumpFB(PlcFunctionBlock):
                 "i_xExtIlkOK := TRUE" + 
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
-    
-
-    def oType(self):
-        return "FB_EbaraEVA";
 
 
 
@@ -1034,6 +1301,8 @@ class PtmEbara010mPumpFB(PlcFunctionBlock):
 
 
     
+    fbType = "FB_PTM_Ebara_010M"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
@@ -1045,10 +1314,6 @@ class PtmEbara010mPumpFB(PlcFunctionBlock):
                 "i_xExtILKOk := TRUE" +
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
-    
-
-    def oType(self):
-        return "FB_PTM_Ebara_010M";
 
 
 
@@ -1056,6 +1321,8 @@ class PtmEbara011mPumpFB(PlcFunctionBlock):
 
 
     
+    fbType = "FB_PTM_Ebara_011M"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
@@ -1067,10 +1334,6 @@ class PtmEbara011mPumpFB(PlcFunctionBlock):
                 "i_xExtILKOk := TRUE" +
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
-    
-
-    def oType(self):
-        return "FB_PTM_Ebara_011M";
 
 
 
@@ -1078,6 +1341,8 @@ class PtmTwisTorrPumpFB(PlcFunctionBlock):
 
 
     
+    fbType = "FB_PTM_TwisTorr"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
@@ -1089,28 +1354,26 @@ class PtmTwisTorrPumpFB(PlcFunctionBlock):
                 "i_xExtILKOk := TRUE" +
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
-    
-
-    def oType(self):
-        return "FB_PTM_TwisTorr";
 
 
 
 class PtmAgilentPumpFB(PlcFunctionBlock):
 
 
+
+    fbType = "FB_PTM_Agilent"
+
+    dependencies = [Dependency("bpGauge", "depGauge1", Dependency.otypeFB)] # adjacent pirani gauge
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
-        self.bpGauge = deviceInfo.depGauge1 # adjacent pirani gauge
         
 
 
     def code(self):
-        bpGauge = self.container.getFB(self.bpGauge)
-        if ((not bpGauge)):
-            sys.exit("device %s: unable to find pirani gauge: %s" %
-                     (self.objectName(), self.bpGauge))
+        bpGauge = self.refs["bpGauge"]
         return (self.fbName +
                 PlcGenerator.openParen +
                 "i_stGauge := " +
@@ -1118,95 +1381,186 @@ class PtmAgilentPumpFB(PlcFunctionBlock):
                 ", i_rMaxBackingPressure := 0.1, i_xExtILKOk := TRUE" +
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
-    
 
-    def oType(self):
-        return "FB_PTM_Agilent";
 
 
+# reference to a plc function block in generated code, used in place of a resolved dependency when
+# generating the call of an array element in a FOR loop
+class FunctionBlockReference:
 
-class SimVacuumValveFB(PlcFunctionBlock):
 
 
-    
-    def __init__(self, deviceInfo):
-        super().__init__(deviceInfo)
-        self.upstreamVolume = deviceInfo.depVol1
-        self.downstreamVolume = deviceInfo.depVol2
-        self.valve = deviceInfo.name
+    def __init__(self, fbName):
+        self.fbName = fbName
 
 
 
-    def code(self):
-        upVol = self.container.getVolumeStruct(self.upstreamVolume)
-        downVol = self.container.getVolumeStruct(self.downstreamVolume)
-        valve = self.container.getStruct(self.valve)
-        if ((not upVol) or (not downVol) or (not valve)):
-            sys.exit("device %s: unable to find upVol: %s downVol: %s or valve: %s" %
-                     (self.objectName(), self.upstreamVolume, self.downstreamVolume, self.valve))
-        return (self.fbName +
-                PlcGenerator.openParen +
-                "stAVol := " +
-                upVol.structName +
-                ", stBvol := " +
-                downVol.structName +
-                ", stValve := " +
-                valve.structName +
-                PlcGenerator.closeParen +
-                PlcGenerator.terminator)
+# plc function blocks of one type in a program unit, declared as an array and called in FOR loops,
+# used instead of the function blocks with --fbArrays, the elements are ordered so that elements whose
+# dependencies have the same function block types are contiguous and called in the same loop, and each
+# dependency is passed through a parallel array of pointers to the dependency function blocks
+class FunctionBlockArray:
 
-    
+    prefixArray = "afb_"
 
-    def oType(self):
-        return "FB_VacuumValve";
 
 
+    def __init__(self, docName, otype, members):
 
-class SimGaugeFB(PlcFunctionBlock):
+        unit = docName.upper().replace("-", "_")
+        typeName = otype[3:] if otype.startswith("FB_") else otype
+        self.arrayName = self.prefixArray + unit + "_" + typeName
+        self.indexName = self.arrayName + "_ind"
+        self.pragmaName = unit + ":" + typeName
+        self.otype = otype
 
+        # order members by the types of their dependencies, keeping device order otherwise
+        def signature(fb):
+            return tuple([fb.refs[dep.name].oType() if fb.refs.get(dep.name) else ""
+                          for dep in fb.dependencies])
+        self.members = sorted(members, key=signature)
 
-    
-    def __init__(self, deviceInfo):
-        super().__init__(deviceInfo)
-        self.volume = deviceInfo.volume
-        self.gauge = deviceInfo.name
+        # elements are numbered from 1, the function block name is the array element
+        self.runs = [] # list of (first index, last index) of members with the same dependency types
+        for ind, fb in enumerate(self.members, start=1):
+            fb.fbName = self.arrayName + "[%d]" % ind
+            if len(self.runs) and signature(self.members[self.runs[-1][0] - 1]) == signature(fb):
+                self.runs[-1] = (self.runs[-1][0], ind)
+            else:
+                self.runs.append((ind, ind))
 
 
 
-    def code(self):
-        volume = self.container.getVolumeStruct(self.volume)
-        gauge = self.container.getStruct(self.gauge)
-        if ((not volume) or (not gauge)):
-            sys.exit("device %s: unable to find volume: %s or gauge: %s" %
-                     (self.objectName(), self.volume, self.gauge))
-        return (self.fbName +
-                PlcGenerator.openParen +
-                "stVolume := " +
-                volume.structName +
-                ", stGauge := " +
-                gauge.structName +
-                PlcGenerator.closeParen +
-                PlcGenerator.terminator)
+    def oType(self):
+        return self.otype
 
-    
 
-class SimMks422GaugeFB(SimGaugeFB):
-    
 
-    
-    def __init__(self, deviceInfo):
-        super().__init__(deviceInfo)
+    def objectName(self):
+        return self.arrayName
 
 
 
-    def oType(self):
-        return "FB_MKS_422";
+    def pragma(self):
+        return "{attribute 'pytmc' := ' pv: " + self.pragmaName + " '}"
 
 
 
+    def pointerArrayName(self, first, dep):
+        return self.arrayName + "_" + dep.name + "_%d" % first
+
+
+
+    def declaration(self):
+
+        lines = [self.arrayName + " : ARRAY [1..%d] OF %s" % (len(self.members), self.otype) +
+                 PlcGenerator.terminator]
+
+        # pointers are initialized again after an online change, since the elements may move
+        for first, last in self.runs:
+            fb = self.members[first - 1]
+            for dep in fb.dependencies:
+                if not fb.refs.get(dep.name):
+                    continue
+                targets = ["ADR(" + self.members[ind - 1].refs[dep.name].fbName + ")"
+                           for ind in range(first, last + 1)]
+                lines.append("{attribute 'init_on_onlchange'}")
+                lines.append(self.pointerArrayName(first, dep) + " : ARRAY [%d..%d] OF POINTER TO %s := [%s]" %
+                             (first, last, fb.refs[dep.name].oType(), ", ".join(targets)) +
+                             PlcGenerator.terminator)
+        return "\n".join(lines)
+
+
+
+    def code(self):
+
+        lines = []
+        for first, last in self.runs:
+
+            # call of the first member of the run, with the element and its dependencies indexed by the
+            # loop variable
+            fb = copy.copy(self.members[first - 1])
+            fb.fbName = self.arrayName + "[" + self.indexName + "]"
+            fb.refs = {}
+            for dep in fb.dependencies:
+                if self.members[first - 1].refs.get(dep.name):
+                    fb.refs[dep.name] = FunctionBlockReference(self.pointerArrayName(first, dep) +
+                                                               "[" + self.indexName + "]^")
+                else:
+                    fb.refs[dep.name] = None
+
+            lines.append("FOR " + self.indexName + " := %d TO %d DO" % (first, last))
+            lines.append("    " + fb.code())
+            lines.append("END_FOR" + PlcGenerator.terminator)
+        return "\n".join(lines)
+
+
+
+    # return list of (device name, pv, plc variable, array pv, index) for the members
+    def indexRows(self, gvlName):
+        return [(fb.deviceInfo.name, fb.pragmaName, gvlName + "." + fb.fbName, self.pragmaName, ind)
+                for ind, fb in enumerate(self.members, start=1)]
+
+
+
+# sim function blocks of one type in a program unit that run at a reduced rate, each member is called
+# in one of divisor phases, every divisor'th cycle of the cycle counter of the task running the program,
+# used instead of the function blocks with --simRates
+class DecimatedGroup:
+
+    cycleCounter = "nSimCycle"
+
+
+
+    def __init__(self, docName, otype, divisor, phases):
+        self.docName = docName
+        self.otype = otype
+        self.divisor = divisor
+        self.phases = phases # list of lists of function blocks, for each phase of the cycle counter
+        self.members = [fb for phase in phases for fb in phase]
+        self.counter = self.cycleCounter # counter of the task, set by SimRates.assignCounters()
+
+
+
+    def oType(self):
+        return self.otype
+
+
+
+    def objectName(self):
+        return "%s:%s/%d@%s" % (self.docName, self.otype, self.divisor, self.counter)
+
+
+
+    # number of function blocks called in the busiest cycle
+    def callCount(self):
+        return max([len(phase) for phase in self.phases])
+
+
+
+    def code(self):
+
+        lines = ["CASE " + self.counter + " MOD %d OF" % self.divisor]
+        for ind, phase in enumerate(self.phases):
+            if not len(phase):
+                continue
+            lines.append("%d:" % ind)
+            lines.extend(["    " + fb.code() for fb in phase])
+        lines.append("END_CASE" + PlcGenerator.terminator)
+        return "\n".join(lines)
+
+
+
+class SimVacuumValveFB(PlcFunctionBlock):
+
+
+
+    fbType = "FB_VacuumValve"
+
+    dependencies = [Dependency("upVol", "depVol1", Dependency.otypeVolume),
+                    Dependency("downVol", "depVol2", Dependency.otypeVolume),
+                    Dependency("valve", "name", Dependency.otypeStruct)]
 
-class SimMks500GaugeFB(SimGaugeFB):
-    
 
     
     def __init__(self, deviceInfo):
@@ -1214,23 +1568,83 @@ class SimMks500GaugeFB(SimGaugeFB):
 
 
 
-    def oType(self):
-        return "FB_MKS_500";
+    def code(self):
+        upVol = self.refs["upVol"]
+        downVol = self.refs["downVol"]
+        valve = self.refs["valve"]
+        return (self.fbName +
+                PlcGenerator.openParen +
+                "stAVol := " +
+                upVol.structName +
+                ", stBvol := " +
+                downVol.structName +
+                ", stValve := " +
+                valve.structName +
+                PlcGenerator.closeParen +
+                PlcGenerator.terminator)
+
 
 
+class SimGaugeFB(PlcFunctionBlock):
 
 
-class SimMks275GaugeFB(SimGaugeFB):
+
+    dependencies = [Dependency("volume", "volume", Dependency.otypeVolume),
+                    Dependency("gauge", "name", Dependency.otypeStruct)]
+
+
+    
+    def __init__(self, deviceInfo):
+        super().__init__(deviceInfo)
+
+
+
+    def code(self):
+        volume = self.refs["volume"]
+        gauge = self.refs["gauge"]
+        return (self.fbName +
+                PlcGenerator.openParen +
+                "stVolume := " +
+                volume.structName +
+                ", stGauge := " +
+                gauge.structName +
+                PlcGenerator.closeParen +
+                PlcGenerator.terminator)
+
+    
+
+class SimMks422GaugeFB(SimGaugeFB):
     
 
     
+    fbType = "FB_MKS_422"
+
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
 
 
 
-    def oType(self):
-        return "FB_MKS_275";
+
+class SimMks500GaugeFB(SimGaugeFB):
+    
+
+    
+    fbType = "FB_MKS_500"
+
+    def __init__(self, deviceInfo):
+        super().__init__(deviceInfo)
+
+
+
+
+class SimMks275GaugeFB(SimGaugeFB):
+    
+
+    
+    fbType = "FB_MKS_275"
+
+    def __init__(self, deviceInfo):
+        super().__init__(deviceInfo)
 
 
 
@@ -1254,20 +1668,22 @@ class SimMks317GaugeFB(SimGaugeFB):
 class SimGamPipPumpFB(PlcFunctionBlock):
 
 
+
+    fbType = "FB_GAM_PIP"
+
+    dependencies = [Dependency("volume", "volume", Dependency.otypeVolume),
+                    Dependency("pip", "name", Dependency.otypeStruct)]
+
+
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
-        self.volume = deviceInfo.volume
-        self.pip = deviceInfo.name
 
 
 
     def code(self):
-        volume = self.container.getVolumeStruct(self.volume)
-        pip = self.container.getStruct(self.pip)
-        if ((not volume) or (not pip)):
-            sys.exit("device %s: unable to find volume: %s or pip: %s" %
-                     (self.objectName(), self.volume, self.pip))
+        volume = self.refs["volume"]
+        pip = self.refs["pip"]
         return (self.fbName +
                 PlcGenerator.openParen +
                 "stVolume := " +
@@ -1277,30 +1693,27 @@ class SimGamPipPumpFB(PlcFunctionBlock):
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
 
-    
 
-    def oType(self):
-        return "FB_GAM_PIP";
+
+class SimRoughPumpFB(PlcFunctionBlock):
 
 
 
-class SimRoughPumpFB(PlcFunctionBlock):
+    fbType = "FB_RoughPump"
+
+    dependencies = [Dependency("inVol", "depVol1", Dependency.otypeVolume),
+                    Dependency("pump", "name", Dependency.otypeStruct)]
 
 
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
-        self.inVol = deviceInfo.depVol1
-        self.pump = deviceInfo.name
 
 
 
     def code(self):
-        inVol = self.container.getVolumeStruct(self.inVol)
-        pump = self.container.getStruct(self.pump)
-        if ((not inVol) or (not pump)):
-            sys.exit("device %s: unable to find inlet volume: %s or pump: %s" %
-                     (self.objectName(), self.inVol, self.pump))
+        inVol = self.refs["inVol"]
+        pump = self.refs["pump"]
         return (self.fbName +
                 PlcGenerator.openParen +
                 "stVolInlet := " +
@@ -1310,32 +1723,29 @@ class SimRoughPumpFB(PlcFunctionBlock):
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
 
-    
 
-    def oType(self):
-        return "FB_RoughPump";
+
+class SimTurboPumpFB(PlcFunctionBlock):
 
 
 
-class SimTurboPumpFB(PlcFunctionBlock):
+    fbType = "FB_TurboPump"
+
+    dependencies = [Dependency("inVol", "depVol1", Dependency.otypeVolume),
+                    Dependency("outVol", "depVol2", Dependency.otypeVolume),
+                    Dependency("pump", "name", Dependency.otypeStruct)]
 
 
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
-        self.inVol = deviceInfo.depVol1
-        self.outVol = deviceInfo.depVol2
-        self.pump = deviceInfo.name
 
 
 
     def code(self):
-        inVol = self.container.getVolumeStruct(self.inVol)
-        outVol = self.container.getVolumeStruct(self.outVol)
-        pump = self.container.getStruct(self.pump)
-        if ((not inVol) or (not outVol) or (not pump)):
-            sys.exit("device %s: unable to find inVol: %s outVol: %s or pump: %s" %
-                     (self.objectName(), self.inVol, self.outVol, self.pump))
+        inVol = self.refs["inVol"]
+        outVol = self.refs["outVol"]
+        pump = self.refs["pump"]
         return (self.fbName +
                 PlcGenerator.openParen +
                 "stVlInlet := " +
@@ -1347,11 +1757,6 @@ class SimTurboPumpFB(PlcFunctionBlock):
                 PlcGenerator.closeParen +
                 PlcGenerator.terminator)
 
-    
-
-    def oType(self):
-        return "FB_TurboPump";
-
 
 
 # abstract base class for structs
@@ -1375,16 +1780,22 @@ class SimVolumeStruct(PlcStruct):
     
     def __init__(self, deviceInfo):
         super().__init__(deviceInfo)
+        self.merged = [] # names of volumes merged into this one by VolumeCoarsening
 
 
 
     def declaration(self):
+        volume = "1E3"
+        comment = ""
+        if len(self.merged):
+            volume = "%dE3" % (len(self.merged) + 1)
+            comment = " // merged " + ", ".join(self.merged)
         return (self.objectName() + " : " +
                 self.oType() + " := " +
                 PlcGenerator.openParen +
-                "rVolume := 1E3, rPressure := Global_Pressure, rVLeak := Global_Leak" +
+                "rVolume := " + volume + ", rPressure := Global_Pressure, rVLeak := Global_Leak" +
                 PlcGenerator.closeParen +
-                PlcGenerator.terminator)
+                PlcGenerator.terminator + comment)
 
 
 
@@ -1565,18 +1976,71 @@ class DeviceContainer:
 
 
 
-    deviceList = [] # list of device names as encountered in input for sequential access
-    deviceMap = {} # map of device name to device object for indexed access
+    def __init__(self):
 
+        # map of device name to device object for indexed access, insertion ordered so it also
+        # provides sequential access to devices as encountered in input
+        self.deviceMap = {}
 
+        # maps of program unit and plc tag to list of device objects, in input order
+        self.progUnitMap = {}
+        self.tagMap = {}
+
+
+
+    def addDevice(self, deviceName, device):
 
-    @classmethod
-    def addDevice(cls, deviceName, device):
         # device name must be unique
-        if (deviceName in cls.deviceList):
+        if (deviceName in self.deviceMap):
             sys.exit("duplicate device name: " + deviceName)
-        cls.deviceList.append(deviceName)
-        cls.deviceMap[deviceName] = device
+        self.deviceMap[deviceName] = device
+
+        progUnit = device.progUnit()
+        if (not progUnit in self.progUnitMap):
+            self.progUnitMap[progUnit] = []
+        self.progUnitMap[progUnit].append(device)
+
+        tag = device.deviceInfo.tag
+        if (not tag in self.tagMap):
+            self.tagMap[tag] = []
+        self.tagMap[tag].append(device)
+
+
+
+    # iterate device objects in input order
+    def __iter__(self):
+        return iter(self.deviceMap.values())
+
+
+
+    def __len__(self):
+        return len(self.deviceMap)
+
+
+
+    def hasDevice(self, deviceName):
+        return deviceName in self.deviceMap
+
+
+
+    def getDevice(self, deviceName):
+        return self.deviceMap.get(deviceName)
+
+
+
+    # return program units in order of first appearance in input
+    def progUnits(self):
+        return list(self.progUnitMap.keys())
+
+
+
+    def getProgUnitDevices(self, progUnit):
+        return self.progUnitMap.get(progUnit, [])
+
+
+
+    def getTagDevices(self, tag):
+        return self.tagMap.get(tag, [])
 
 
     
@@ -1587,51 +2051,101 @@ class PlcDocument:
     def __init__(self, docName):
         #super().__init__(docName)
         self.name = docName
-        self.contentMap = {} # map of object type string keys to list of lines values
+        self.contentMap = {} # map of object type string keys to list of plc object values
 
 
 
-    def addContent(self, otype, lines):
+    def addContent(self, otype, objs):
         if (not otype in self.contentMap):
             self.contentMap[otype] = []
-        self.contentMap[otype].extend(lines)
+        self.contentMap[otype].extend(objs)
 
 
 
-    def writeToFile(self, fobj, devOrdering):
-        
-        specifiedKeys = [s["type"] for s in devOrdering]
-        unspecifiedKeys = [value for value in self.contentMap.keys() if value not in specifiedKeys]
-        for k in unspecifiedKeys:
-            devOrdering.append({"type":k, "label":k})
-            
-        for orderSpec in devOrdering:
-            fbtype = orderSpec["type"]
-            if (fbtype in self.contentMap.keys()):
-                fobj.write("\n")
-                fobj.write("// " + orderSpec["label"])
-                fobj.write("\n\n")
-                for fbd in self.contentMap[fbtype]:
-                    fobj.write(fbd)
-                    fobj.write("\n")                
+    # return lines of code for the plc objects of a section of the document
+    def sectionLines(self, objs):
+        return []
+
+
+
+    # return list of string parts of the document, sections are emitted in the order of
+    # sectionOrder, which must contain every object type in the document (see PlcGenerator.sectionOrder),
+    # code for the plc objects is generated here so that documents can be rendered in worker processes
+    def renderParts(self, sectionOrder):
+
+        parts = []
+        contentMap = self.contentMap
+        for orderSpec in sectionOrder:
+            objs = contentMap.get(orderSpec["type"])
+            if objs is not None:
+                parts.append("\n// " + orderSpec["label"] + "\n\n")
+                lines = self.sectionLines(objs)
+                if len(lines):
+                    parts.append("\n".join(lines))
+                    parts.append("\n")
+        return parts
+
+
+
+    def render(self, sectionOrder):
+        return "".join(self.renderParts(sectionOrder))
+
+
+
+    # write the rendered document with a single write call
+    def writeToFile(self, fobj, sectionOrder):
+        fobj.write(self.render(sectionOrder))
 
 
 
 class VariableDocument(PlcDocument):
 
 
+
+    def __init__(self, docName, pragmas=False):
+        super().__init__(docName)
+        self.pragmas = pragmas # precede declarations with pytmc pragmas
+
+
+
+    def sectionLines(self, objs):
+        if self.pragmas:
+            lines = []
+            for obj in objs:
+                lines.append(obj.pragma())
+                lines.append(obj.declaration())
+            return lines
+        else:
+            return [obj.declaration() for obj in objs]
+
+
     
-    def writeToFile(self, fobj, devOrdering):
+    def renderParts(self, sectionOrder):
 
-        fobj.write("VAR_GLOBAL\n\n")
-        super().writeToFile(fobj, devOrdering)                
-        fobj.write("\nEND_VAR\n")
+        parts = super().renderParts(sectionOrder)
+        parts.insert(0, "VAR_GLOBAL\n\n")
+        parts.append("\nEND_VAR\n")
+        return parts
                 
 
 
 
 class ProgramDocument(PlcDocument):
-    pass
+
+
+
+    def __init__(self, docName):
+        super().__init__(docName)
+        self.timers = {} # object type to the cycle timer wrapped around its section, see CycleTimers
+
+
+
+    def sectionLines(self, objs):
+        lines = [obj.code() for obj in objs]
+        timer = self.timers.get(objs[0].oType())
+        if timer:
+            lines = [timer + "(bStart := TRUE);"] + lines + [timer + "(bStart := FALSE);"]
+        return lines
 
 
     
@@ -1643,6 +2157,8 @@ class PlcContainer:
     otypeStruct = "st"
     otypeVolume = "vol"
 
+    pragmas = True # plc variable declarations have pytmc pragmas
+
 
     
     def __init__(self):
@@ -1658,19 +2174,19 @@ class PlcContainer:
 
     
 
-    def addToVariablesDocument(self, docName, otype, lines):
+    def addToVariablesDocument(self, docName, otype, objs):
         if (not docName in self.varDocs):
-            self.varDocs[docName] = VariableDocument(docName)
+            self.varDocs[docName] = VariableDocument(docName, self.pragmas)
         document = self.varDocs[docName]
-        document.addContent(otype, lines)
+        document.addContent(otype, objs)
 
 
 
-    def addToProgramDocument(self, docName, otype, lines):
+    def addToProgramDocument(self, docName, otype, objs):
         if (not docName in self.progDocs):
             self.progDocs[docName] = ProgramDocument(docName)
         document = self.progDocs[docName]
-        document.addContent(otype, lines)
+        document.addContent(otype, objs)
 
 
 
@@ -1691,7 +2207,6 @@ class PlcContainer:
         else:          
             devObjMap = self.plcDeviceMap[deviceName]
             devObjMap[plcType] = plcObj
-            plcObj.container = self
             return True
 
 
@@ -1743,10 +2258,15 @@ class PlcContainer:
 class SimContainer(PlcContainer):
 
 
+
+    pragmas = False
+
+
     
     def __init__(self):
         super().__init__()
         self.volumes = []
+        self.staticDevices = set() # always open devices inside merged volumes, only their structs are declared
 
 
 
@@ -1779,6 +2299,18 @@ class SimContainer(PlcContainer):
 
 
 
+    # merge volumes into the volume volName, the merged volume names refer to its struct, and their
+    # structs are no longer declared
+    def mergeVolumes(self, volName, mergedNames):
+
+        volumeStruct = self.getVolumeStruct(volName)
+        for mergedName in mergedNames:
+            self.plcDeviceMap[mergedName][self.otypeVolume] = volumeStruct
+            volumeStruct.merged.append(mergedName)
+        self.volumes = [volumeInfo for volumeInfo in self.volumes if not volumeInfo.name in mergedNames]
+
+
+
     # add simulation objects for this device
     def addDevice(self, deviceName, device):
 
@@ -1798,291 +2330,2009 @@ class SimContainer(PlcContainer):
 
 
 
-class PlcGenerator:
+# dependency edge from a device's plc or sim function block to the target named in a device info column
+class DependencyEdge:
 
 
-    
-    openParen = "("
-    closeParen = ")"
-    terminator = ";"
 
+    def __init__(self, source, tree, dependency, target):
+        self.source = source # device name
+        self.tree = tree # DependencyGraph.treePlc or DependencyGraph.treeSim
+        self.dependency = dependency
+        self.target = target # device or volume name from device info column
+        self.targetName = target # name of the resolved target, differs for merged volumes
+        self.resolved = False
 
 
-    @classmethod
-    def generatePlc(cls, container):
 
-        # iterate through devices and create plc objects organized into files
-        for devName in DeviceContainer.deviceList:
-            device = DeviceContainer.deviceMap[devName]
-            docName = device.progUnit()
+# graph of devices and volumes, with the dependency columns of the device info file as typed edges,
+# built once after ingestion so that all broken links are reported in a single pass
+class DependencyGraph:
 
-            plcFB = container.getFB(devName)
-            
-            decs = []
-            decs.append(plcFB.pragma())
-            decs.append(plcFB.declaration())
-            container.addToVariablesDocument(docName, plcFB.oType(), decs)
 
-            code = []
-            code.append(plcFB.code())
-            container.addToProgramDocument(docName, plcFB.oType(), code)
 
-        # set up ordering of devices by type
-        deviceOrdering = []
-        deviceOrdering.append({"type":"FB_MKS275", "label":"MKS275 Gauges"})
-        deviceOrdering.append({"type":"FB_MKS500", "label":"MKS500 Gauges"})
-        deviceOrdering.append({"type":"FB_MKS500_EP", "label":"MKS500_EP Gauges"})
-        deviceOrdering.append({"type":"FB_VGC", "label":"VGC Valves"})
-        deviceOrdering.append({"type":"FB_PIP_GAMMA", "label":"PIP_Gamma Pumps"})
-        
-        # write variables documents
-        for docName, document in container.varDocs.items():
-            with open('gen.plc.GVL_' + docName.upper().replace("-", "_"), 'w') as f:
-                document.writeToFile(f, deviceOrdering)
-
-        # write program documents
-        with open('gen.plc.PRG_MAIN', 'w') as fm:
-            fm.write("PRG_DIAGNOSTIC();\n")
-            for docName, document in container.progDocs.items():
-                progName = 'PRG_' + docName.upper().replace("-", "_")
-                with open('gen.plc.' + progName, 'w') as f:
-                    document.writeToFile(f, deviceOrdering)
-                    fm.write(progName + '();\n')
+    treePlc = "plc"
+    treeSim = "sim"
 
-        # write non-PLC variables that are used in the PLC code created by the generator
-        with open('gen.plc.GVL_VARIABLES', 'w') as f:
-            f.write("VAR_GLOBAL\n\n")
-            f.write("xSystemOverrideMode : BOOL; (* Global system override for the prototype section*)\n\n")
-            f.write("END_VAR\n")
+    blankPrefix = "?blank"
 
-        # write files for diagnostic code
-        with open('gen.plc.PRG_DIAGNOSTIC.var', 'w') as f:
-            f.write("VAR\n\n")
-            f.write("   fbTime : FB_LocalSystemTime := ( bEnable := TRUE, dwCycle := 1 );\n" +
-	            "   logTimer : TON := ( IN := TRUE, PT := T#1000ms );\n\n" +
-	            "   plcName : STRING[15];\n\n" +	
-	            "   {attribute 'pytmc' := ' pv: simHeartbeat '}\n" +
-	            "   simHeartbeat AT %I* : UINT := 0;\n" +
-	            "   {attribute 'pytmc' := ' pv: plcHeartbeat '}\n" +
-	            "   plcHeartbeat : UDINT := 0;\n" +
-	            "   {attribute 'pytmc' := ' pv: plcInfo '}\n" +
-	            "   plcInfo : STRING[40];\n" +
-	            "   {attribute 'pytmc' := ' pv: plcLocalTime '}\n" +
-	            "   plcLocalTime : STRING[25];\n\n")
-            f.write("END_VAR\n")
+    # device info column names for DeviceInfo attributes, for reporting
+    columnNames = {"name": "Device Name",
+                   "depGauge1": "PLC dep gauge1",
+                   "depGauge2": "PLC dep gauge2",
+                   "depPump1": "PLC dep pump1",
+                   "depValve1": "PLC dep valve1",
+                   "volume": "Volume",
+                   "depVol1": "sim dep vol1",
+                   "depVol2": "sim dep vol2"}
 
-        with open('gen.plc.PRG_DIAGNOSTIC', 'w') as f:
-            f.write("plcHeartbeat := plcHeartbeat + 1;\n" +
-                    "IF plcHeartbeat > 4294967000\n" +
-	            "   THEN plcHeartbeat := 0;\n" +
-                    "END_IF\n\n" +
-                    "// get timestamp as string every second\n" +
-                    "fbTime();\n" +
-                    "logTimer( IN := fbTime.bValid );\n" +
-                    "IF logTimer.Q THEN\n" +
-                    "   logTimer( IN := FALSE ); logTimer( IN := fbTime.bValid );\n" +
-                    "   plcLocalTime := SYSTEMTIME_TO_STRING(fbTime.systemTime);\n" +
-                    "END_IF\n\n" +
-                    "// make an info string\n" +
-                    "plcName := 'Prototype PLC: ';\n" +
-                    "plcInfo := CONCAT(plcName, plcLocalTime);\n")
 
 
-                
-    @classmethod
-    def generateSim(cls, container):
+    def __init__(self, deviceContainer):
 
-        # iterate through volumes and add declarations for volume structs
-        for volInfo in container.volumes:
+        self.edges = [] # all edges in input order
+        self.deviceEdges = {} # map of device name to list of edges from the device
+        self.errors = []
+        self.blanks = [] # ?blank placeholder edges, for devices at the section boundary
+        self.cycles = []
 
-            volName = volInfo.name
-            volStruct = container.getVolumeStruct(volName)
-            
-            decs = []
-            decs.append(volStruct.declaration())
-            progUnit = volInfo.progUnit
-            container.addToVariablesDocument(progUnit, volStruct.oType(), decs)
+        # add edges for the dependencies declared by the plc and sim function block classes
+        for device in deviceContainer:
+            edges = []
+            for tree, fbClass in [(self.treePlc, device.classes.plcFBClass),
+                                  (self.treeSim, device.classes.simFBClass)]:
+                for dependency in fbClass.dependencies:
+                    target = getattr(device.deviceInfo, dependency.infoAttr)
+                    edges.append(DependencyEdge(device.name(), tree, dependency, target))
+            self.deviceEdges[device.name()] = edges
+            self.edges.extend(edges)
 
-        # iterate through devices and create plc objects organized into files
-        for devName in DeviceContainer.deviceList:
-            
-            device = DeviceContainer.deviceMap[devName]
-            docName = device.progUnit()
 
-            # add declarations for structs
-            
-            struct = container.getStruct(devName)
 
-            decs = []
-            decs.append(struct.declaration())
-            container.addToVariablesDocument(docName, struct.oType(), decs)
+    # resolve each edge to the target plc object in the container for its tree, and store the
+    # reference in the source function block for code generation, containers is a map of tree to
+    # container, trees that aren't generated are omitted
+    def resolve(self, containers):
 
-            # add declarations and code for function blocks
-            
-            fb = container.getFB(devName)
-            
-            decs = []
-            decs.append(fb.declaration())
-            container.addToVariablesDocument(docName, fb.oType(), decs)
+        for edge in self.edges:
 
-            code = []
-            code.append(fb.code())
-            container.addToProgramDocument(docName, fb.oType(), code)
+            container = containers.get(edge.tree)
+            if not container:
+                continue
 
-        # # set up ordering of devices by type
-        deviceOrdering = []
-        # deviceOrdering.append({"type":"FB_MKS275", "label":"MKS275 Gauges"})
-        # deviceOrdering.append({"type":"FB_MKS500", "label":"MKS500 Gauges"})
-        # deviceOrdering.append({"type":"FB_MKS500_EP", "label":"MKS500_EP Gauges"})
-        # deviceOrdering.append({"type":"FB_VGC", "label":"VGC Valves"})
-        # deviceOrdering.append({"type":"FB_PIP_GAMMA", "label":"PIP_Gamma Pumps"})
-        
-        # write variables documents
-        for docName, document in container.varDocs.items():
-            with open('gen.sim.GVL_' + docName.upper().replace("-", "_"), 'w') as f:
-                document.writeToFile(f, deviceOrdering)
-
-        # write program documents
-        with open('gen.sim.PRG_MAIN', 'w') as fm:
-            fm.write("PRG_DIAGNOSTIC();\n")
-            for docName, document in container.progDocs.items():
-                progName = 'PRG_' + docName.upper().replace("-", "_")
-                with open('gen.sim.' + progName, 'w') as f:
-                    document.writeToFile(f, deviceOrdering)
-                    fm.write(progName + '();\n')
+            fb = container.getFB(edge.source)
+            dependency = edge.dependency
+            column = self.columnNames[dependency.infoAttr]
 
-        # write non-PLC variables that are used in the PLC code created by the generator
-        with open('gen.sim.GVL_VARIABLES', 'w') as f:
-            f.write("{attribute 'global_init_slot' := '40500'} // make sure variables are initialized before other GVLs\n")
-            f.write("VAR_GLOBAL\n\n")
-            f.write("Global_Leak : REAL := 0;\n")
-            f.write("Global_Pressure : REAL := 0.0079;\n")
-            f.write("New_Pressure : REAL := 22.0; //Torr\n")
-            f.write("Global_OverridePressure : BOOL := FALSE;\n\n")
-            f.write("END_VAR\n")
+            if not edge.target:
+                self.errors.append("device %s: no dependency specified in column '%s'" %
+                                   (edge.source, column))
 
-        # write files for diagnostic code
-        with open('gen.sim.PRG_DIAGNOSTIC.var', 'w') as f:
-            f.write("   heartbeat AT %Q* : UINT := 0;\n")
+            elif edge.target.startswith(self.blankPrefix):
+                if dependency.blankOk:
+                    # placeholder for dependency outside the scope of the generator
+                    fb.refs[dependency.name] = None
+                    self.blanks.append(edge)
+                else:
+                    self.errors.append("device %s: placeholder not supported in column '%s': %s" %
+                                       (edge.source, column, edge.target))
+
+            else:
+                target = container.getPlcObj(edge.target, dependency.otype)
+                if target:
+                    fb.refs[dependency.name] = target
+                    edge.targetName = target.deviceInfo.name
+                    edge.resolved = True
+                else:
+                    self.errors.append("device %s: unable to find %s dependency in column '%s': %s" %
+                                       (edge.source, edge.tree, column, edge.target))
+
+        self.cycles = self.findCycles()
+
+
+
+    # return list of cycles in device to device dependencies, each a list of device names
+    def findCycles(self):
+
+        adjacency = {}
+        for edge in self.edges:
+            if edge.resolved and edge.dependency.otype == Dependency.otypeFB:
+                if (not edge.source in adjacency):
+                    adjacency[edge.source] = []
+                adjacency[edge.source].append(edge.target)
+
+        # iterative depth first search, a target on the current path closes a cycle
+        cycles = []
+        visiting = 1
+        visited = 2
+        state = {}
+        for root in adjacency:
+            if root in state:
+                continue
+            state[root] = visiting
+            path = [root]
+            stack = [iter(adjacency[root])]
+            while len(stack):
+                for target in stack[-1]:
+                    targetState = state.get(target)
+                    if targetState is None:
+                        state[target] = visiting
+                        path.append(target)
+                        stack.append(iter(adjacency.get(target, [])))
+                        break
+                    elif targetState == visiting:
+                        cycles.append(path[path.index(target):] + [target])
+                else:
+                    state[path.pop()] = visited
+                    stack.pop()
+
+        return cycles
+
+
+
+    # print all problems found by resolve() and exit if any dependency is broken
+    def printResult(self):
+
+        if len(self.blanks):
+            print()
+            print("placeholder dependencies for devices at section boundary: %d" % len(self.blanks))
+            for edge in self.blanks:
+                print("   %s %s: %s" % (edge.source, self.columnNames[edge.dependency.infoAttr], edge.target))
+
+        if len(self.cycles):
+            print()
+            print("WARNING: dependency cycles: %d" % len(self.cycles))
+            for cycle in self.cycles:
+                print("   " + " -> ".join(cycle))
+
+        if len(self.errors):
+            print()
+            print("dependency errors: %d" % len(self.errors))
+            for error in self.errors:
+                print("   " + error)
+            sys.exit("unable to resolve %d dependencies" % len(self.errors))
+
+
+
+# transitive closure of the device dependencies of the devices in scope, either includes the out of
+# scope devices needed to satisfy the dependencies, or replaces the dependencies that cross the scope
+# boundary with ?blank placeholders
+class DependencyClosure:
+
+
+
+    modeInclude = "include"
+    modeBlank = "blank"
+
+
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.outOfScope = {} # index of device name to (row number, projected row) for rows out of scope
+        self.boundary = [] # list of (device name, column name, target device name) crossing the boundary
+        self.included = [] # names of out of scope devices added to satisfy dependencies
+        self.cannotBlank = [] # boundary dependencies included in blank mode, since they can't be blanked
+
+
+
+    # DeviceInfoReader.rows() callback for rows out of scope
+    def addOutOfScopeRow(self, rowCount, info):
+        self.outOfScope[info[0]] = (rowCount, info)
+
+
+
+    # walk device dependencies breadth first from the devices in scope, each device is visited once
+    def apply(self, handler, deviceContainer, plcContainer, simContainer, options):
+
+        queue = list(deviceContainer)
+        ind = 0
+        while ind < len(queue):
+
+            device = queue[ind]
+            ind = ind + 1
+
+            for fbClass in [device.classes.plcFBClass, device.classes.simFBClass]:
+                for dependency in fbClass.dependencies:
+
+                    if dependency.otype != Dependency.otypeFB:
+                        continue
+                    target = getattr(device.deviceInfo, dependency.infoAttr)
+                    if ((not target) or
+                        target.startswith(DependencyGraph.blankPrefix) or
+                        deviceContainer.hasDevice(target) or
+                        (not target in self.outOfScope)):
+                        # satisfied, placeholder, or dangling (reported by DependencyGraph)
+                        continue
+
+                    column = DependencyGraph.columnNames[dependency.infoAttr]
+                    self.boundary.append((device.name(), column, target))
+
+                    # in blank mode, dependencies that don't allow a placeholder are included
+                    if self.mode == self.modeInclude or not dependency.blankOk:
+                        rowCount, info = self.outOfScope.pop(target)
+                        handler.handleDevice(rowCount, info, deviceContainer,
+                                             plcContainer, simContainer, options)
+                        targetDevice = deviceContainer.getDevice(target)
+                        if targetDevice:
+                            self.included.append(target)
+                            queue.append(targetDevice)
+                            if self.mode == self.modeBlank:
+                                self.cannotBlank.append((device.name(), column, target))
+                    else:
+                        setattr(device.deviceInfo, dependency.infoAttr,
+                                DependencyGraph.blankPrefix + "#" + target)
+
+        # release the index of out of scope rows
+        self.outOfScope = {}
+
+
+
+    def printResult(self):
+
+        print()
+        print("dependency closure (%s): %d boundary dependencies" % (self.mode, len(self.boundary)))
+        for source, column, target in self.boundary:
+            print("   %s %s: %s" % (source, column, target))
+        if self.mode == self.modeInclude:
+            print("devices included to satisfy dependencies: %d" % len(self.included))
+            for name in self.included:
+                print("   " + name)
+        elif len(self.cannotBlank):
+            print("cannot blank, devices included to satisfy dependencies: %d" % len(self.cannotBlank))
+            for source, column, target in self.cannotBlank:
+                print("   %s %s: %s" % (source, column, target))
+
+
+
+# coarsening of the sim volume graph, the volumes are the nodes and the sim function blocks with two
+# volume dependencies (valves, turbo pumps) are the edges, volumes joined only by devices that are always
+# open in the simulation, or joined directly without a device, are merged into a single volume struct,
+# the first of them in device order, and the merged names refer to that struct when the dependencies of
+# the gauges, valves, and pumps are resolved
+class VolumeCoarsening:
+
+
+
+    def __init__(self):
+        self.openDevices = ScopeSelector("always open device") # devices always open in sim
+        self.joins = [] # list of (volume name, volume name) joined without a device
+        self.volumesBefore = 0
+        self.groups = [] # list of (representative volume name, list of merged volume names)
+        self.joiningDevices = {} # representative volume name to always open devices inside the merged volume
+        self.callsBefore = 0
+        self.unknownVolumes = []
+
+
+
+    # read a csv file with lines of "open" and a device name (exact, glob, or regex like --deviceFile)
+    # for devices that are always open in the simulation, and "join" and two volume names for volumes
+    # joined without a device
+    def load(self, fileName):
+
+        try:
+            with open(fileName, newline='') as f:
+                for lineCount, row in enumerate(csv.reader(f), start=1):
+                    row = [value.strip() for value in row]
+                    if not len(row) or row[0].startswith("#") or (lineCount == 1 and row[0] == "Kind"):
+                        continue
+                    if row[0] == "open" and len(row) > 1 and row[1]:
+                        self.openDevices.addEntry(row[1])
+                    elif row[0] == "join" and len(row) > 2 and row[1] and row[2]:
+                        self.joins.append((row[1], row[2]))
+                    else:
+                        sys.exit("volume coarsening file %s line %d: expected 'open' and device name, " %
+                                 (fileName, lineCount) + "or 'join' and two volume names")
+        except OSError as ex:
+            sys.exit("error reading volume coarsening file: %s" % ex)
+
+
+
+    # merge the volumes of simContainer
+    def apply(self, deviceContainer, simContainer):
+
+        volumeNames = [volumeInfo.name for volumeInfo in simContainer.volumes]
+        self.volumesBefore = len(volumeNames)
+        self.callsBefore = len(deviceContainer) - len(simContainer.staticDevices)
+        order = dict([(volName, ind) for ind, volName in enumerate(volumeNames)])
+
+        # devices joining each pair of volumes, and whether all of them are always open
+        pairs = {} # (volume name, volume name) in volume order to list of (device name, open)
+        for device in deviceContainer:
+            volumes = []
+            for dependency in device.classes.simFBClass.dependencies:
+                volName = getattr(device.deviceInfo, dependency.infoAttr)
+                if dependency.otype == Dependency.otypeVolume and volName in order and not volName in volumes:
+                    volumes.append(volName)
+            if len(volumes) == 2:
+                pair = tuple(sorted(volumes, key=lambda v: order[v]))
+                pairs.setdefault(pair, []).append((device.name(), self.openDevices.matches(device.name())))
+
+        # union find, the representative of a set is its first volume
+        parents = dict([(volName, volName) for volName in volumeNames])
+        def find(volName):
+            while parents[volName] != volName:
+                parents[volName] = parents[parents[volName]]
+                volName = parents[volName]
+            return volName
+        def union(first, second):
+            first, second = find(first), find(second)
+            if first != second:
+                if order[second] < order[first]:
+                    first, second = second, first
+                parents[second] = first
+
+        for first, second in self.joins:
+            for volName in (first, second):
+                if not volName in order and not volName in self.unknownVolumes:
+                    self.unknownVolumes.append(volName)
+            if first in order and second in order:
+                union(first, second)
+        for (first, second), devices in pairs.items():
+            if all([isOpen for devName, isOpen in devices]):
+                union(first, second)
+
+        # devices inside a merged volume must be always open, their function blocks are no longer called
+        # since they would connect the volume to itself, a device that isn't would e.g. pump the volume
+        # into itself, so such a merge is rejected
+        closed = []
+        for (first, second), devices in pairs.items():
+            if find(first) == find(second):
+                self.joiningDevices.setdefault(find(first), []).extend([devName for devName, isOpen in devices])
+                closed.extend(["%s (%s, %s)" % (devName, first, second) for devName, isOpen in devices if not isOpen])
+        if len(closed):
+            sys.exit("volume coarsening would merge the volumes on both sides of devices that aren't always " +
+                     "open, add them as 'open' or remove the 'join' lines merging their volumes: " + ", ".join(closed))
+
+        # the merged volumes refer to the struct of their representative
+        merged = {}
+        for volName in volumeNames:
+            if find(volName) != volName:
+                merged.setdefault(find(volName), []).append(volName)
+        for volName in volumeNames:
+            if volName in merged:
+                self.groups.append((volName, merged[volName]))
+                simContainer.mergeVolumes(volName, merged[volName])
+        for devNames in self.joiningDevices.values():
+            simContainer.staticDevices.update(devNames)
+
+
+
+    def printResult(self, simContainer):
+
+        print()
+        print("==================================================")
+        print("VOLUME COARSENING")
+        print("==================================================")
+        print()
+        print("volumes before: %d after: %d merged: %d" %
+              (self.volumesBefore, len(simContainer.volumes), self.volumesBefore - len(simContainer.volumes)))
+        print("sim function block calls per cycle before: %d after: %d removed: %d" %
+              (self.callsBefore, self.callsBefore - len(simContainer.staticDevices), len(simContainer.staticDevices)))
+        for volName, mergedNames in self.groups:
+            print("   %s <- %s" % (volName, ", ".join(mergedNames)))
+            if volName in self.joiningDevices:
+                print("      always open devices inside merged volume, function block not called: %s" %
+                      ", ".join(self.joiningDevices[volName]))
+        for entry in self.openDevices.unmatchedEntries():
+            print("open device entry %s didn't match any device" % entry)
+        for volName in self.unknownVolumes:
+            print("join volume %s not found" % volName)
+
+
+
+# writes generated files, skipping files whose content is unchanged since the previous run according to
+# a manifest of content hashes, so that unchanged files keep their modification times
+class OutputWriter:
+
+
+
+    manifestFile = "gen.manifest"
+
+
+
+    def __init__(self):
+        self.previous = {} # manifest of previous run, file name to entry
+        self.entries = {} # manifest of this run
+        self.changed = []
+        self.unchanged = []
+        self.trees = set() # trees generated by this run, "plc" and/or "sim"
+        self.removed = [] # stale files removed
+        self.modified = [] # stale files not removed since they were modified after the previous run
+
+
+
+    def loadManifest(self):
+        try:
+            with open(self.manifestFile) as f:
+                self.previous = json.load(f)
+        except FileNotFoundError:
+            self.previous = {}
+        except Exception as ex:
+            print("ignoring unreadable manifest file %s: %s" % (self.manifestFile, ex))
+            self.previous = {}
+
+
+
+    # check if a file of the previous run that wasn't written by this run would have been, e.g.
+    # gen.plc.PRG_MAIN after partitioning into tasks, files of a tree are stale if the tree was
+    # generated, other files (e.g., gen.fbIndex) if both trees were generated
+    def isStale(self, fileName):
+        parts = fileName.split(".")
+        if len(parts) > 2 and parts[1] in ("plc", "sim"):
+            return parts[1] in self.trees
+        return self.trees == set(["plc", "sim"])
+
+
+
+    # remove stale files of the previous run, unless they were modified since
+    def removeStaleFiles(self):
+
+        for fileName in sorted(self.previous.keys()):
+            if fileName in self.entries or not self.isStale(fileName):
+                continue
+            if self.reuseFile(fileName):
+                os.remove(fileName)
+                self.removed.append(fileName)
+            elif not os.path.exists(fileName):
+                self.removed.append(fileName)
+            else:
+                self.modified.append(fileName)
+
+
+
+    # entries of the previous run for files not generated by this run (e.g., sim files for --plc) are
+    # kept, so those files are still recognized as unchanged when they are generated again, except for
+    # removed stale files
+    def saveManifest(self):
+        manifest = dict([(fileName, entry) for fileName, entry in self.previous.items()
+                         if not fileName in self.removed])
+        manifest.update(self.entries)
+        content = json.dumps(manifest, indent=1, sort_keys=True) + "\n"
+        self.replaceFile(self.manifestFile, content)
+
+
+
+    # write content to a temporary file and rename it over the target, so that the target is never
+    # left partially written
+    @staticmethod
+    def replaceFile(fileName, content):
+        tmpName = fileName + ".tmp"
+        with open(tmpName, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+        os.replace(tmpName, fileName)
+
+
+
+    # write file if its content hash differs from the previous run or the file on disk doesn't match
+    # the previous run, returns (file name, manifest entry, changed flag), safe to call in a worker
+    # process since it only reads the previous manifest
+    def writeFile(self, fileName, content):
+
+        data = content if isinstance(content, bytes) else content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+
+        entry = self.previous.get(fileName)
+        if entry and entry["digest"] == digest:
+            result = self.reuseFile(fileName)
+            if result:
+                return result
+
+        self.replaceFile(fileName, content)
+        stat = os.stat(fileName)
+        return fileName, {"digest": digest, "size": stat.st_size, "mtime": stat.st_mtime_ns}, True
+
+
+
+    # return writeFile() result for a file that is unchanged on disk since the previous run, or None
+    def reuseFile(self, fileName):
+        entry = self.previous.get(fileName)
+        if not entry:
+            return None
+        try:
+            stat = os.stat(fileName)
+        except OSError:
+            return None
+        if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime"]:
+            return fileName, entry, False
+        return None
+
+
+
+    # add result of writeFile() to the manifest of this run
+    def record(self, result):
+        fileName, entry, changed = result
+        self.entries[fileName] = entry
+        if changed:
+            self.changed.append(fileName)
+        else:
+            self.unchanged.append(fileName)
+
+
+
+    def write(self, fileName, content):
+        self.record(self.writeFile(fileName, content))
+
+
+
+    def printResult(self):
+
+        print("==================================================")
+        print("OUTPUT FILES")
+        print("==================================================")
+        for fileName in sorted(self.entries.keys()):
+            print("%-9s %s" % ("changed" if fileName in self.changed else "unchanged", fileName))
+        print("files changed: %d unchanged: %d" % (len(self.changed), len(self.unchanged)))
+        for fileName in self.removed:
+            print("%-9s %s" % ("removed", fileName))
+        if len(self.removed):
+            print("stale files from previous run removed: %d" % len(self.removed))
+        if len(self.modified):
+            print("WARNING: stale files from previous run not removed, modified since: %s" %
+                  ", ".join(self.modified))
+        notGenerated = [f for f in self.previous.keys()
+                        if not (f in self.entries or f in self.removed or f in self.modified)]
+        if len(notGenerated):
+            print("files from previous run not generated by this run: %d" % len(notGenerated))
+
+
+
+# cache of device info row fingerprints from the previous run, keyed by device name, with the program
+# unit and dependency edges of each device, used to render only the program unit documents whose
+# devices or dependency targets changed, the other documents are reused from the previous run
+class RowCache:
+
+
+
+    cacheFile = "gen.rowcache"
+
+    # DeviceInfo attributes included in a device's fingerprint
+    infoAttrs = ["name", "tag", "depGauge1", "depGauge2", "depPump1", "depValve1",
+                 "volume", "depVol1", "depVol2", "progUnit"]
+
+
+
+    def __init__(self):
+        self.version = self.generatorVersion()
+        self.previous = {"version": None, "devices": {}, "documents": {}}
+        self.devices = {} # device name to entry of this run
+        self.documents = {} # document file name to key of this run
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.rebuilt = []
+        self.reused = []
+
+
+
+    # documents rendered by a different version of the generator are never reused
+    @staticmethod
+    def generatorVersion():
+        with open(os.path.abspath(__file__), 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+
+
+    @classmethod
+    def fingerprint(cls, deviceInfo):
+        fields = [getattr(deviceInfo, attr) or "" for attr in cls.infoAttrs]
+        return hashlib.sha256("\x1f".join(fields).encode("utf-8")).hexdigest()
+
+
+
+    def load(self):
+        try:
+            with open(self.cacheFile) as f:
+                self.previous = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as ex:
+            print("ignoring unreadable row cache file %s: %s" % (self.cacheFile, ex))
+
+
+
+    def save(self):
+        # keys of documents not generated by this run are kept if they were made by this version
+        documents = {}
+        if self.previous["version"] == self.version:
+            documents.update(self.previous["documents"])
+        documents.update(self.documents)
+        cache = {"version": self.version, "devices": self.devices, "documents": documents}
+        OutputWriter.replaceFile(self.cacheFile, json.dumps(cache, sort_keys=True) + "\n")
+
+
+
+    # fingerprint the devices of this run and diff them against the previous run
+    def update(self, deviceContainer, graph):
+
+        previousDevices = self.previous["devices"]
+        for device in deviceContainer:
+            devName = device.name()
+            entry = {"fingerprint": self.fingerprint(device.deviceInfo),
+                     "progUnit": device.progUnit(),
+                     "edges": [[edge.tree, edge.targetName] for edge in graph.deviceEdges[devName]]}
+            self.devices[devName] = entry
+            previousEntry = previousDevices.get(devName)
+            if not previousEntry:
+                self.added.append(devName)
+            elif previousEntry["fingerprint"] != entry["fingerprint"]:
+                self.changed.append(devName)
+        self.removed = [devName for devName in previousDevices.keys() if not devName in self.devices]
+
+
+
+    # key for a document's content, derived from the ordered objects it contains, the fingerprints of
+    # their devices and of their dependency targets, and the section order, without rendering it
+    def documentKey(self, document, sectionOrder):
+
+        digest = hashlib.sha256()
+        digest.update(self.version.encode("utf-8"))
+        for orderSpec in sectionOrder:
+            digest.update(("\x1e%s\x1f%s" % (orderSpec["type"], orderSpec["label"])).encode("utf-8"))
+        for otype, objs in document.contentMap.items():
+            digest.update(("\x1d" + otype).encode("utf-8"))
+            if otype in getattr(document, "timers", {}):
+                digest.update(("\x1b" + document.timers[otype]).encode("utf-8"))
+            for obj in objs:
+
+                # function block array, content also depends on the names of the elements and of the
+                # elements they depend on, which depend on the other devices in the arrays
+                members = [obj]
+                if isinstance(obj, FunctionBlockArray):
+                    digest.update(("\x1c" + obj.objectName()).encode("utf-8"))
+                    members = obj.members
+                elif isinstance(obj, DecimatedGroup):
+                    # decimated group, content also depends on the phase of each member
+                    digest.update(("\x1c" + obj.objectName()).encode("utf-8"))
+                    for phase in obj.phases:
+                        digest.update(("\x1c" + "\x1f".join([fb.deviceInfo.name for fb in phase])).encode("utf-8"))
+                    members = obj.members
+
+                for member in members:
+                    objName = member.deviceInfo.name
+                    entry = self.devices.get(objName)
+                    if not entry:
+                        # volume, content depends only on its name and the volumes merged into it
+                        digest.update(("\x1e" + "\x1f".join([objName] + getattr(member, "merged", [])))
+                                      .encode("utf-8"))
+                        continue
+                    parts = [objName, entry["fingerprint"]]
+                    for tree, target in entry["edges"]:
+                        targetEntry = self.devices.get(target)
+                        parts.extend([tree, target or "", targetEntry["fingerprint"] if targetEntry else ""])
+                    if isinstance(obj, FunctionBlockArray):
+                        parts.append(member.fbName)
+                        parts.extend([ref.fbName for ref in member.refs.values() if ref])
+                    digest.update(("\x1e" + "\x1f".join(parts)).encode("utf-8"))
+        return digest.hexdigest()
+
+
+
+    # return the documents that must be rendered, documents whose key matches the previous run and
+    # whose file is unchanged on disk are recorded as unchanged output without rendering them
+    def selectDocuments(self, documents, output):
+
+        previousDocuments = {}
+        if self.previous["version"] == self.version:
+            previousDocuments = self.previous["documents"]
+
+        selected = []
+        for task in documents:
+            fileName, document, sectionOrder = task
+            key = self.documentKey(document, sectionOrder)
+            self.documents[fileName] = key
+            result = None
+            if previousDocuments.get(fileName) == key:
+                result = output.reuseFile(fileName)
+            if result:
+                output.record(result)
+                self.reused.append(fileName)
+            else:
+                selected.append(task)
+                self.rebuilt.append(fileName)
+        return selected
+
+
+
+    def printResult(self):
+
+        print()
+        print("row cache: devices added: %d changed: %d removed: %d" %
+              (len(self.added), len(self.changed), len(self.removed)))
+        for label, devNames in [("changed", self.changed), ("removed", self.removed)]:
+            for devName in devNames:
+                print("   %-7s %s" % (label, devName))
+        print("row cache: documents rebuilt: %d reused: %d" % (len(self.rebuilt), len(self.reused)))
+
+
+
+# estimated execution cost in microseconds of each plc and sim function block type, used to partition
+# program units across tasks, the defaults are rough estimates that can be replaced by a cost file, or
+# calibrated from measured program execution times
+class CostModel:
+
+
+
+    defaultCost = 2.0 # types not in the table
+    defaultCosts = {
+        # plc function blocks
+        "FB_VCN" : 1.0,
+        "FB_VGC" : 2.5,
+        "FB_VRC" : 1.5,
+        "FB_VCC" : 1.5,
+        "FB_MKS422" : 2.0,
+        "FB_MKS500" : 2.0,
+        "FB_MKS500_EP" : 2.0,
+        "FB_MKS275" : 1.5,
+        "FB_MKS317" : 1.5,
+        "FB_PIP_GAMMA" : 2.0,
+        "FB_EbaraDryPump" : 2.0,
+        "FB_EbaraEVA" : 1.5,
+        "FB_PTM_Ebara_010M" : 3.0,
+        "FB_PTM_Ebara_011M" : 3.0,
+        "FB_PTM_TwisTorr" : 3.0,
+        "FB_PTM_Agilent" : 3.0,
+        # sim function blocks
+        "FB_VacuumValve" : 2.0,
+        "FB_MKS_422" : 1.5,
+        "FB_MKS_500" : 1.5,
+        "FB_MKS_275" : 1.5,
+        "FB_MKS_317" : 1.5,
+        "FB_GAM_PIP" : 2.0,
+        "FB_RoughPump" : 2.0,
+        "FB_TurboPump" : 2.5}
+
+
+
+    def __init__(self):
+        self.costs = dict(self.defaultCosts)
+
+
+
+    # read a csv file with lines of function block type and cost in microseconds, e.g. as written to
+    # gen.costs by calibrate(), an optional header line, blank lines, and lines starting with "#" are skipped
+    def load(self, fileName):
+
+        try:
+            with open(fileName, newline='') as f:
+                for lineCount, row in enumerate(csv.reader(f), start=1):
+                    if not len(row) or row[0].startswith("#") or (lineCount == 1 and row[0] == "Type"):
+                        continue
+                    try:
+                        cost = float(row[1])
+                        if cost < 0:
+                            raise ValueError()
+                    except (IndexError, ValueError):
+                        sys.exit("cost file %s line %d: expected function block type and cost" %
+                                 (fileName, lineCount))
+                    self.costs[row[0]] = cost
+        except OSError as ex:
+            sys.exit("error reading cost file: %s" % ex)
+
+
+
+    # read a csv file with lines of tree (plc or sim), program name, and measured execution time in
+    # microseconds, returns map of (tree, program name) to time
+    @staticmethod
+    def loadMeasurements(fileName):
+
+        measurements = {}
+        try:
+            with open(fileName, newline='') as f:
+                for lineCount, row in enumerate(csv.reader(f), start=1):
+                    if not len(row) or row[0].startswith("#") or (lineCount == 1 and row[0] == "Tree"):
+                        continue
+                    try:
+                        measurements[(row[0], row[1])] = float(row[2])
+                    except (IndexError, ValueError):
+                        sys.exit("measurements file %s line %d: expected tree, program, and time" %
+                                 (fileName, lineCount))
+        except OSError as ex:
+            sys.exit("error reading measurements file: %s" % ex)
+        return measurements
+
+
+
+    # return number of function blocks called in a cycle for a program document object
+    @staticmethod
+    def callCount(obj):
+        if isinstance(obj, FunctionBlockArray):
+            return len(obj.members)
+        if isinstance(obj, DecimatedGroup):
+            return obj.callCount()
+        return 1
+
+
+
+    # return map of function block type to number of function blocks called in a cycle of program document
+    @classmethod
+    def typeCounts(cls, document):
+        counts = {}
+        for otype, objs in document.contentMap.items():
+            for obj in objs:
+                counts[otype] = counts.get(otype, 0) + cls.callCount(obj)
+        return counts
+
+
+
+    def cost(self, otype):
+        return self.costs.get(otype, self.defaultCost)
+
+
+
+    def objectCost(self, obj):
+        return self.callCount(obj) * self.cost(obj.oType())
+
+
+
+    def documentCost(self, document):
+        return sum([count * self.cost(otype) for otype, count in self.typeCounts(document).items()])
+
+
+
+    # fit the costs of the function block types in the measured programs, by least squares of the
+    # estimated and measured program times, regularized towards the current costs since there are
+    # usually fewer programs than types, returns list of (program, measured, estimate before, after)
+    def calibrate(self, programs):
+
+        types = sorted(set([otype for counts, measured in programs.values() for otype in counts]))
+        if not len(types):
+            return []
+        before = dict([(progName, sum([count * self.cost(otype) for otype, count in counts.items()]))
+                       for progName, (counts, measured) in programs.items()])
+
+        # normal equations (AtA + lambda I) c = Atm + lambda c0, A rows are type counts of a program
+        size = len(types)
+        matrix = [[0.0] * size for ind in range(size)]
+        vector = [0.0] * size
+        for counts, measured in programs.values():
+            row = [counts.get(otype, 0) for otype in types]
+            for i in range(size):
+                vector[i] = vector[i] + row[i] * measured
+                for j in range(size):
+                    matrix[i][j] = matrix[i][j] + row[i] * row[j]
+        weight = 0.01 * max([matrix[i][i] for i in range(size)])
+        for i in range(size):
+            matrix[i][i] = matrix[i][i] + weight
+            vector[i] = vector[i] + weight * self.cost(types[i])
+
+        # gaussian elimination with partial pivoting, the matrix is positive definite
+        for col in range(size):
+            pivot = max(range(col, size), key=lambda r: abs(matrix[r][col]))
+            matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+            vector[col], vector[pivot] = vector[pivot], vector[col]
+            for r in range(col + 1, size):
+                factor = matrix[r][col] / matrix[col][col]
+                for c in range(col, size):
+                    matrix[r][c] = matrix[r][c] - factor * matrix[col][c]
+                vector[r] = vector[r] - factor * vector[col]
+        solution = [0.0] * size
+        for r in reversed(range(size)):
+            total = vector[r] - sum([matrix[r][c] * solution[c] for c in range(r + 1, size)])
+            solution[r] = total / matrix[r][r]
+        for otype, cost in zip(types, solution):
+            self.costs[otype] = max(cost, 0.0)
+
+        return [(progName, measured, before[progName],
+                 sum([count * self.cost(otype) for otype, count in counts.items()]))
+                for progName, (counts, measured) in programs.items()]
+
+
+
+    def content(self):
+        return "Type,Cost\n" + "".join(["%s,%g\n" % (otype, cost) for otype, cost in sorted(self.costs.items())])
+
+
+
+# partitions the program units of the plc and sim trees across tasks, each with its own main program,
+# by packing the programs into tasks with first fit decreasing on their estimated cost, so that each
+# task's estimated cost is within the cycle budget, programs over the budget are split into groups of
+# devices, without a budget the programs are balanced across the tasks, the main program calls its
+# programs in the original order
+class TaskPartitioner:
+
+
+
+    def __init__(self, costModel, tasks=0, budget=0.0, measurements=None):
+
+        self.costModel = costModel
+        self.tasks = tasks # number of tasks, 0 for as many as needed to stay within the budget
+        self.budget = budget # estimated microseconds per task cycle, 0 for no budget
+        self.measurements = measurements # map of (tree, program) to measured microseconds, to calibrate
+        self.results = {} # tree to list of tasks, each a list of (program name, estimated cost)
+        self.crossings = {} # tree to list of dependencies across tasks, see findCrossings()
+        self.calibration = {} # tree to list of (program, measured, estimate before, after)
+
+
+
+    def enabled(self):
+        return self.tasks > 0 or self.budget > 0
+
+
+
+    # return list of (program name, document) for the program documents of tree, with the programs over
+    # the budget split into groups, and pack them into tasks
+    def partition(self, tree, programs, sectionOrder):
+
+        if self.measurements:
+            measured = dict([(progName, (CostModel.typeCounts(document), self.measurements[(tree, progName)]))
+                             for progName, document in programs if (tree, progName) in self.measurements])
+            self.calibration[tree] = self.costModel.calibrate(measured)
+
+        if not self.enabled():
+            self.results[tree] = [[(progName, self.costModel.documentCost(document))
+                                   for progName, document in programs]]
+            return programs
+
+        items = []
+        for progName, document in programs:
+            cost = self.costModel.documentCost(document)
+            if self.budget and cost > self.budget:
+                items.extend(self.splitProgram(progName, document, sectionOrder))
+            else:
+                items.append((progName, document, cost))
+
+        bins = [] # list of [load, list of item indices]
+        for ind in sorted(range(len(items)), key=lambda i: -items[i][2]):
+            cost = items[ind][2]
+            target = None
+            if self.budget:
+                for taskBin in bins:
+                    if taskBin[0] + cost <= self.budget:
+                        target = taskBin
+                        break
+            if target is None and ((not self.tasks) or len(bins) < self.tasks):
+                target = [0.0, []]
+                bins.append(target)
+            if target is None:
+                # no task has room, or balancing without a budget
+                target = min(bins, key=lambda b: b[0])
+            target[0] = target[0] + cost
+            target[1].append(ind)
+
+        self.results[tree] = [[(items[ind][0], items[ind][2]) for ind in sorted(taskBin[1])]
+                              for taskBin in bins]
+        self.crossings[tree] = self.findCrossings(items, bins)
+        return [(progName, document) for progName, document, cost in items]
+
+
+
+    # return list of (device, program, task, target device, program, task) for function block
+    # dependencies on function blocks called by another task, which may run at a different time
+    @staticmethod
+    def findCrossings(items, bins):
+
+        def functionBlocks(document):
+            for objs in document.contentMap.values():
+                for obj in objs:
+                    if isinstance(obj, (FunctionBlockArray, DecimatedGroup)):
+                        yield from obj.members
+                    else:
+                        yield obj
+
+        placement = {} # device name to (program name, task number)
+        for task, taskBin in enumerate(bins, start=1):
+            for ind in taskBin[1]:
+                progName, document, cost = items[ind]
+                for fb in functionBlocks(document):
+                    placement[fb.deviceInfo.name] = (progName, task)
+
+        crossings = []
+        for progName, document, cost in items:
+            for fb in functionBlocks(document):
+                source = placement[fb.deviceInfo.name]
+                for dep in fb.dependencies:
+                    target = fb.refs.get(dep.name)
+                    if dep.otype != Dependency.otypeFB or not target:
+                        continue
+                    targetPlacement = placement.get(target.deviceInfo.name)
+                    if targetPlacement and targetPlacement[1] != source[1]:
+                        crossings.append((fb.deviceInfo.name,) + source +
+                                         (target.deviceInfo.name,) + targetPlacement)
+        return crossings
+
+
+
+    # return list of (program name, document, cost) for groups of consecutive objects of the program
+    # document in section order, each within the budget if possible
+    def splitProgram(self, progName, document, sectionOrder):
+
+        groups = []
+        group = None
+        for orderSpec in sectionOrder:
+            for obj in document.contentMap.get(orderSpec["type"], []):
+                cost = self.costModel.objectCost(obj)
+                if group is None or (group[2] > 0 and group[2] + cost > self.budget):
+                    group = [progName + "_%d" % (len(groups) + 1), ProgramDocument(document.name), 0.0]
+                    groups.append(group)
+                group[1].addContent(orderSpec["type"], [obj])
+                group[2] = group[2] + cost
+        return [tuple(group) for group in groups]
+
+
+
+    # write the main program of each task for tree, or the single main program if not partitioned
+    # return list of program names of each task of tree
+    def taskPrograms(self, tree):
+        return [[progName for progName, cost in task] for task in self.results[tree]]
+
+
+
+    # write the main program of each task for tree, or the single main program if not partitioned,
+    # taskLines is an optional list of lines for each task, called before its programs
+    def writeMains(self, tree, output, firstLines, timers, taskLines=None):
+
+        tasks = self.results[tree]
+        taskLines = taskLines or [[] for task in tasks]
+        if not self.enabled():
+            output.write('gen.' + tree + '.PRG_MAIN',
+                         "".join(firstLines + taskLines[0] + [line for progName, cost in tasks[0]
+                                                              for line in timers.callLines(progName)]))
+            return
+        for ind, task in enumerate(tasks, start=1):
+            lines = list(firstLines) if ind == 1 else []
+            output.write('gen.' + tree + '.PRG_MAIN_%d' % ind,
+                         "".join(lines + taskLines[ind - 1] +
+                                 [line for progName, cost in task for line in timers.callLines(progName)]))
+
+
+
+    def printResult(self):
+
+        if not (self.enabled() or self.measurements):
+            return
+        print()
+        print("==================================================")
+        print("TASKS")
+        print("==================================================")
+
+        for tree, rows in self.calibration.items():
+            print()
+            print("%s cost calibration, %d measured program(s):" % (tree, len(rows)))
+            for progName, measured, before, after in rows:
+                print("   %s measured: %.1f us estimated before: %.1f us after: %.1f us" %
+                      (progName, measured, before, after))
+        if self.measurements:
+            print()
+            print("calibrated costs written to gen.costs")
+
+        if not self.enabled():
+            return
+        for tree, tasks in self.results.items():
+            print()
+            for ind, task in enumerate(tasks, start=1):
+                load = sum([cost for progName, cost in task])
+                budgetText = ""
+                if self.budget:
+                    budgetText = ", %.0f%% of budget%s" % (100.0 * load / self.budget,
+                                                           " (over budget)" if load > self.budget else "")
+                print("%s task %d: PRG_MAIN_%d %d program(s), estimated %.1f us%s" %
+                      (tree, ind, ind, len(task), load, budgetText))
+                for progName, cost in task:
+                    print("   %s %.1f us" % (progName, cost))
+            crossings = self.crossings.get(tree, [])
+            if len(crossings):
+                print("WARNING: %s dependencies on function blocks called by another task: %d" %
+                      (tree, len(crossings)))
+                for crossing in crossings:
+                    print("   %s (%s, task %d) -> %s (%s, task %d)" % crossing)
+
+
+
+# cycle time instrumentation of the generated code, each program unit call in the main program, and
+# optionally each function block type section of the programs, is wrapped in calls to a cycle timer
+# function block that measures the elapsed cpu counter time (GETCPUCOUNTER from Tc2_Utilities) and
+# accumulates min/max/avg, the timers are declared in GVL_DIAGNOSTIC with pytmc pragmas, the programs
+# are also recorded when not instrumented, to rank them by measured times from a timing file
+class CycleTimers:
+
+
+
+    fbType = "FB_CycleTimer"
+    pvPrefix = "timing:"
+
+
+
+    def __init__(self, costModel, enabled=False, sections=False):
+
+        self.costModel = costModel
+        self.enabled = enabled
+        self.sections = sections # also time the function block type sections of the programs
+        self.timers = {} # tree to list of (timer name, variable name, estimated cost)
+
+
+
+    @staticmethod
+    def variableName(timerName):
+        return "fbTime_" + timerName.replace(":", "_")
+
+
+
+    # record program of tree, and set the timers of its sections, timer names are the program name and
+    # program name:type, e.g., "PRG_GMD" and "PRG_GMD:VGC"
+    def addProgram(self, tree, progName, document):
+
+        timers = self.timers.setdefault(tree, [])
+        timers.append((progName, self.variableName(progName), self.costModel.documentCost(document)))
+        if not (self.enabled and self.sections):
+            return
+        for otype, objs in document.contentMap.items():
+            timerName = progName + ":" + otype.replace("FB_", "", 1)
+            timers.append((timerName, self.variableName(timerName),
+                           sum([self.costModel.objectCost(obj) for obj in objs])))
+            document.timers[otype] = self.variableName(timerName)
+
+
+
+    # return lines of main program to call program, wrapped in its timer if instrumented
+    def callLines(self, progName):
+        if not self.enabled:
+            return [progName + '();\n']
+        varName = self.variableName(progName)
+        return [varName + '(bStart := TRUE);\n', progName + '();\n', varName + '(bStart := FALSE);\n']
+
+
+
+    # return variable declarations added to PRG_DIAGNOSTIC
+    def diagnosticVariables(self, tree):
+        if not self.enabled:
+            return ""
+        return ("   {attribute 'pytmc' := ' pv: timingReset '}\n" +
+                "   timingReset : BOOL;\n")
+
+
+
+    # return code added to PRG_DIAGNOSTIC, sets the reset input of each timer when timingReset is written
+    def diagnosticCode(self, tree):
+        if not self.enabled:
+            return ""
+        return ("\n// reset cycle time statistics\n" +
+                "IF timingReset THEN\n" +
+                "   timingReset := FALSE;\n" +
+                "".join(["   %s.bReset := TRUE;\n" % varName for timerName, varName, cost in self.timers[tree]]) +
+                "END_IF\n")
+
+
+
+    # write the timer function block and the diagnostics variables for tree
+    def writeFiles(self, tree, output):
+
+        if not self.enabled:
+            return
+
+        output.write('gen.' + tree + '.' + self.fbType + '.var',
+                     "VAR_INPUT\n" +
+                     "   bStart : BOOL; // TRUE before the timed code, FALSE after it\n" +
+                     "   bReset : BOOL; // clear the statistics at the next measurement\n" +
+                     "END_VAR\n" +
+                     "VAR_OUTPUT\n" +
+                     "   {attribute 'pytmc' := ' pv: LAST_US '}\n" +
+                     "   fLast : LREAL;\n" +
+                     "   {attribute 'pytmc' := ' pv: MIN_US '}\n" +
+                     "   fMin : LREAL;\n" +
+                     "   {attribute 'pytmc' := ' pv: MAX_US '}\n" +
+                     "   fMax : LREAL;\n" +
+                     "   {attribute 'pytmc' := ' pv: AVG_US '}\n" +
+                     "   fAvg : LREAL;\n" +
+                     "   {attribute 'pytmc' := ' pv: COUNT '}\n" +
+                     "   nCount : UDINT;\n" +
+                     "END_VAR\n" +
+                     "VAR\n" +
+                     "   fbCpuCounter : GETCPUCOUNTER; // 100 ns ticks\n" +
+                     "   nStart : ULINT;\n" +
+                     "   nTicks : ULINT;\n" +
+                     "END_VAR\n")
+
+        output.write('gen.' + tree + '.' + self.fbType,
+                     "fbCpuCounter();\n" +
+                     "nTicks := SHL(DWORD_TO_ULINT(fbCpuCounter.cpuCntHiDW), 32) OR " +
+                     "DWORD_TO_ULINT(fbCpuCounter.cpuCntLoDW);\n" +
+                     "IF bStart THEN\n" +
+                     "   nStart := nTicks;\n" +
+                     "   RETURN;\n" +
+                     "END_IF\n\n" +
+                     "IF bReset THEN\n" +
+                     "   bReset := FALSE;\n" +
+                     "   nCount := 0;\n" +
+                     "END_IF\n\n" +
+                     "// elapsed time in microseconds\n" +
+                     "fLast := ULINT_TO_LREAL(nTicks - nStart) / 10.0;\n" +
+                     "nCount := nCount + 1;\n" +
+                     "IF nCount = 1 THEN\n" +
+                     "   fMin := fLast;\n" +
+                     "   fMax := fLast;\n" +
+                     "   fAvg := fLast;\n" +
+                     "ELSE\n" +
+                     "   fMin := MIN(fMin, fLast);\n" +
+                     "   fMax := MAX(fMax, fLast);\n" +
+                     "   // mean of the first 1000 cycles, then moving average\n" +
+                     "   fAvg := fAvg + (fLast - fAvg) / UDINT_TO_LREAL(MIN(nCount, 1000));\n" +
+                     "END_IF\n")
+
+        lines = ["VAR_GLOBAL\n\n"]
+        for timerName, varName, cost in self.timers[tree]:
+            lines.append("{attribute 'pytmc' := ' pv: %s%s '}\n" % (self.pvPrefix, timerName))
+            lines.append("%s : %s;\n" % (varName, self.fbType))
+        lines.append("\nEND_VAR\n")
+        output.write('gen.' + tree + '.GVL_DIAGNOSTIC', "".join(lines))
+
+
+
+    # write the table of timers, to collect the measured times, e.g. the AVG_US of each timer, in a
+    # timing file for printReport() and CostModel.calibrate()
+    def writeIndex(self, output):
+
+        if not self.enabled:
+            return
+        lines = ["Tree,Name,Variable,PV\n"]
+        for tree, timers in self.timers.items():
+            for timerName, varName, cost in timers:
+                lines.append("%s,%s,%s,%s%s\n" % (tree, timerName, varName, self.pvPrefix, timerName))
+        output.write('gen.timers', "".join(lines))
+
+
+
+    # print programs ranked by measured time, with the times of their sections, measurements is map of
+    # (tree, timer name) to microseconds, the ranking is also written to gen.timingReport
+    def printReport(self, measurements, output):
+
+        print()
+        print("==================================================")
+        print("MEASURED COST")
+        print("==================================================")
+
+        rows = ["Tree,Rank,Name,Measured,Share,Estimated\n"]
+        for tree, timers in self.timers.items():
+            programs = [(timerName, cost) for timerName, varName, cost in timers if not ":" in timerName]
+            measured = sorted([(measurements[(tree, progName)], progName, cost) for progName, cost in programs
+                               if (tree, progName) in measurements], key=lambda m: -m[0])
+            total = sum([m[0] for m in measured])
+            print()
+            print("%s programs by measured time, %d of %d measured, total %.1f us:" %
+                  (tree, len(measured), len(programs), total))
+            for rank, (time, progName, cost) in enumerate(measured, start=1):
+                share = 100.0 * time / total if total else 0.0
+                print("%3d %s %.1f us %.0f%% estimated %.1f us" % (rank, progName, time, share, cost))
+                rows.append("%s,%d,%s,%g,%.1f,%g\n" % (tree, rank, progName, time, share, cost))
+
+                # sections of the program, share of the program time
+                sections = sorted([(measurements[(tree, timerName)], timerName, sectionCost)
+                                   for timerName, varName, sectionCost in timers
+                                   if timerName.startswith(progName + ":") and (tree, timerName) in measurements],
+                                  key=lambda m: -m[0])
+                for sectionTime, timerName, sectionCost in sections:
+                    share = 100.0 * sectionTime / time if time else 0.0
+                    print("       %s %.1f us %.0f%% estimated %.1f us" % (timerName, sectionTime, share, sectionCost))
+                    rows.append("%s,,%s,%g,%.1f,%g\n" % (tree, timerName, sectionTime, share, sectionCost))
+            for progName, cost in programs:
+                if not (tree, progName) in measurements:
+                    print("    %s not measured" % progName)
+
+        output.write('gen.timingReport', "".join(rows))
+
+
+
+# update divisors of the sim function blocks, a function block with divisor n is called every n'th
+# sim cycle, the divisor is taken from the first volume rule matching one of the device's volumes (the
+# smallest if its volumes match different rules), otherwise from its function block type, the devices
+# of each divisor are assigned to the phases of the cycle counter to balance their estimated cost
+class SimRates:
+
+
+
+    def __init__(self, costModel):
+
+        self.costModel = costModel
+        self.typeDivisors = {} # sim function block type to divisor
+        self.volumeRules = [] # list of (ScopeSelector, divisor) for volume name entries
+        self.phaseLoads = {} # divisor to list of estimated cost of each phase, across all program units
+        self.devices = {} # divisor to device count
+
+
+
+    def enabled(self):
+        return len(self.typeDivisors) > 0 or len(self.volumeRules) > 0
+
+
+
+    # read a csv file with lines of kind ("type" or "volume"), sim function block type or volume name
+    # (exact, glob, or regex like --deviceFile), and divisor
+    def load(self, fileName):
+
+        try:
+            with open(fileName, newline='') as f:
+                for lineCount, row in enumerate(csv.reader(f), start=1):
+                    if not len(row) or row[0].startswith("#") or (lineCount == 1 and row[0] == "Kind"):
+                        continue
+                    try:
+                        kind, name, divisor = row[0].strip(), row[1].strip(), int(row[2])
+                        if divisor < 1 or not name or not kind in ("type", "volume"):
+                            raise ValueError()
+                    except (IndexError, ValueError):
+                        sys.exit("sim rates file %s line %d: expected 'type' or 'volume', name, and divisor" %
+                                 (fileName, lineCount))
+                    if kind == "type":
+                        self.typeDivisors[name] = divisor
+                    else:
+                        selector = ScopeSelector("sim rates volume")
+                        selector.addEntry(name)
+                        self.volumeRules.append((selector, divisor))
+        except OSError as ex:
+            sys.exit("error reading sim rates file: %s" % ex)
+
+
+
+    def divisor(self, fb):
+
+        info = fb.deviceInfo
+        divisors = []
+        for volume in [info.volume, info.depVol1, info.depVol2]:
+            if not volume:
+                continue
+            for selector, divisor in self.volumeRules:
+                if selector.matches(volume):
+                    divisors.append(divisor)
+                    break
+        if len(divisors):
+            return min(divisors)
+        return self.typeDivisors.get(fb.oType(), 1)
+
+
+
+    # return list of function blocks for each phase, each function block is assigned to the phase with
+    # the least estimated cost so far, so the groups of the program units are staggered
+    def phases(self, fbs, divisor):
+
+        loads = self.phaseLoads.setdefault(divisor, [0.0] * divisor)
+        phases = [[] for ind in range(divisor)]
+        for fb in fbs:
+            ind = loads.index(min(loads))
+            loads[ind] = loads[ind] + self.costModel.cost(fb.oType())
+            phases[ind].append(fb)
+        self.devices[divisor] = self.devices.get(divisor, 0) + len(fbs)
+        return phases
+
+
+
+    # each task main program increments its own cycle counter, since the tasks may have different cycle
+    # times, set the counter of the decimated groups of the programs of each task, tasks is list of
+    # program names for each task, programs is map of program name to document, returns the counter
+    # name of each task
+    def assignCounters(self, tasks, programs):
+
+        if not self.enabled():
+            return [None] * len(tasks)
+        counters = []
+        for ind, task in enumerate(tasks, start=1):
+            counter = DecimatedGroup.cycleCounter if len(tasks) == 1 else DecimatedGroup.cycleCounter + "_%d" % ind
+            counters.append(counter)
+            for progName in task:
+                for objs in programs[progName].contentMap.values():
+                    for obj in objs:
+                        if isinstance(obj, DecimatedGroup):
+                            obj.counter = counter
+        return counters
+
+
+
+    def printResult(self):
+
+        if not self.enabled():
+            return
+        print()
+        print("==================================================")
+        print("SIM RATES")
+        print("==================================================")
+        print()
+        print("NOTE: decimated function blocks aren't passed a scaled time step, their dynamics are slowed " +
+              "by their divisor")
+        for divisor in sorted(self.devices.keys()):
+            loads = self.phaseLoads[divisor]
+            print("divisor %d: %d sim function block(s), estimated %.1f us every %d cycle(s), " %
+                  (divisor, self.devices[divisor], sum(loads), divisor) +
+                  "busiest phase %.1f us" % max(loads))
+        for selector, divisor in self.volumeRules:
+            for entry in selector.unmatchedEntries():
+                print("volume entry %s didn't match any device volume" % entry)
+
+
+
+class PlcGenerator:
+
+
+    
+    openParen = "("
+    closeParen = ")"
+    terminator = ";"
+
+
+
+    # return section ordering for the documents of a generator run, the specified ordering followed by
+    # the object types it doesn't contain, in order of first appearance in the documents
+    @classmethod
+    def sectionOrder(cls, deviceOrdering, documents):
+
+        order = list(deviceOrdering)
+        specifiedKeys = set([s["type"] for s in order])
+        for document in documents:
+            for k in document.contentMap.keys():
+                if not k in specifiedKeys:
+                    specifiedKeys.add(k)
+                    order.append({"type":k, "label":k})
+        return order
+
+
+
+    # add an array of the function blocks of each type in each program unit to the documents, in place of
+    # the function blocks, and write the table of device name to array element
+    @classmethod
+    def addFunctionBlockArrays(cls, deviceContainer, container, output):
+
+        groups = {} # (document name, fb type) to list of function blocks, in device order
+        for device in deviceContainer:
+            plcFB = container.getFB(device.name())
+            groups.setdefault((device.progUnit(), plcFB.oType()), []).append(plcFB)
+
+        rows = []
+        for (docName, otype), members in groups.items():
+            fbArray = FunctionBlockArray(docName, otype, members)
+            container.addToVariablesDocument(docName, otype, [fbArray])
+            container.addToProgramDocument(docName, otype, [fbArray])
+            rows.extend(fbArray.indexRows('GVL_' + docName.upper().replace("-", "_")))
+
+        lines = ["Device Name,PV,PLC Variable,Array PV,Index\n"]
+        for row in rows:
+            lines.append("%s,%s,%s,%s,%d\n" % row)
+        output.write('gen.fbIndex', "".join(lines))
+
+
+
+    @classmethod
+    def generatePlc(cls, deviceContainer, container, output, fbArrays=False, partitioner=None, timers=None):
+
+        # iterate through devices and add plc objects to documents, code is generated when the
+        # documents are rendered
+        if fbArrays:
+            cls.addFunctionBlockArrays(deviceContainer, container, output)
+        else:
+            for device in deviceContainer:
+                devName = device.name()
+                docName = device.progUnit()
 
-        with open('gen.sim.PRG_DIAGNOSTIC', 'w') as f:
-            f.write("heartbeat := heartbeat + 1;\n" +
+                plcFB = container.getFB(devName)
+                container.addToVariablesDocument(docName, plcFB.oType(), [plcFB])
+                container.addToProgramDocument(docName, plcFB.oType(), [plcFB])
+
+        # set up ordering of devices by type
+        deviceOrdering = []
+        deviceOrdering.append({"type":"FB_MKS275", "label":"MKS275 Gauges"})
+        deviceOrdering.append({"type":"FB_MKS500", "label":"MKS500 Gauges"})
+        deviceOrdering.append({"type":"FB_MKS500_EP", "label":"MKS500_EP Gauges"})
+        deviceOrdering.append({"type":"FB_VGC", "label":"VGC Valves"})
+        deviceOrdering.append({"type":"FB_PIP_GAMMA", "label":"PIP_Gamma Pumps"})
+        
+        # compute section order once for all documents
+        sectionOrder = cls.sectionOrder(deviceOrdering, list(container.varDocs.values()) +
+                                        list(container.progDocs.values()))
+
+        # list of (file name, document, section order) for the program unit documents, these are
+        # rendered and written by writeDocuments()
+        documents = []
+
+        # variables documents
+        for docName, document in container.varDocs.items():
+            documents.append(('gen.plc.GVL_' + docName.upper().replace("-", "_"), document, sectionOrder))
+
+        # program documents, called from the main program of their task
+        partitioner = partitioner or TaskPartitioner(CostModel())
+        timers = timers or CycleTimers(partitioner.costModel)
+        programs = [('PRG_' + docName.upper().replace("-", "_"), document)
+                    for docName, document in container.progDocs.items()]
+        for progName, document in partitioner.partition('plc', programs, sectionOrder):
+            documents.append(('gen.plc.' + progName, document, sectionOrder))
+            timers.addProgram('plc', progName, document)
+
+            # the loop variables of the function block arrays are local to the program
+            indexNames = [obj.indexName for objs in document.contentMap.values() for obj in objs
+                          if isinstance(obj, FunctionBlockArray)]
+            if len(indexNames):
+                output.write('gen.plc.' + progName + '.var',
+                             "VAR\n\n" + "".join(["   %s : INT;\n" % indexName for indexName in indexNames]) +
+                             "\nEND_VAR\n")
+        partitioner.writeMains('plc', output, ["PRG_DIAGNOSTIC();\n"], timers)
+
+        # write non-PLC variables that are used in the PLC code created by the generator
+        output.write('gen.plc.GVL_VARIABLES',
+                     "VAR_GLOBAL\n\n" +
+                     "xSystemOverrideMode : BOOL; (* Global system override for the prototype section*)\n\n" +
+                     "END_VAR\n")
+
+        # write files for diagnostic code
+        timers.writeFiles('plc', output)
+        output.write('gen.plc.PRG_DIAGNOSTIC.var',
+                     "VAR\n\n" +
+                     "   fbTime : FB_LocalSystemTime := ( bEnable := TRUE, dwCycle := 1 );\n" +
+	            "   logTimer : TON := ( IN := TRUE, PT := T#1000ms );\n\n" +
+	            "   plcName : STRING[15];\n\n" +	
+	            "   {attribute 'pytmc' := ' pv: simHeartbeat '}\n" +
+	            "   simHeartbeat AT %I* : UINT := 0;\n" +
+	            "   {attribute 'pytmc' := ' pv: plcHeartbeat '}\n" +
+	            "   plcHeartbeat : UDINT := 0;\n" +
+	            "   {attribute 'pytmc' := ' pv: plcInfo '}\n" +
+	            "   plcInfo : STRING[40];\n" +
+	            "   {attribute 'pytmc' := ' pv: plcLocalTime '}\n" +
+	            "   plcLocalTime : STRING[25];\n" +
+                     timers.diagnosticVariables('plc') + "\n" +
+                     "END_VAR\n")
+
+        output.write('gen.plc.PRG_DIAGNOSTIC',
+                     "plcHeartbeat := plcHeartbeat + 1;\n" +
+                    "IF plcHeartbeat > 4294967000\n" +
+	            "   THEN plcHeartbeat := 0;\n" +
+                    "END_IF\n\n" +
+                    "// get timestamp as string every second\n" +
+                    "fbTime();\n" +
+                    "logTimer( IN := fbTime.bValid );\n" +
+                    "IF logTimer.Q THEN\n" +
+                    "   logTimer( IN := FALSE ); logTimer( IN := fbTime.bValid );\n" +
+                    "   plcLocalTime := SYSTEMTIME_TO_STRING(fbTime.systemTime);\n" +
+                    "END_IF\n\n" +
+                    "// make an info string\n" +
+                    "plcName := 'Prototype PLC: ';\n" +
+                    "plcInfo := CONCAT(plcName, plcLocalTime);\n" +
+                    timers.diagnosticCode('plc'))
+
+        return documents
+
+
+                
+    @classmethod
+    def generateSim(cls, deviceContainer, container, output, partitioner=None, timers=None, rates=None):
+
+        # iterate through volumes and add volume structs to variables documents
+        for volInfo in container.volumes:
+
+            volName = volInfo.name
+            volStruct = container.getVolumeStruct(volName)
+            progUnit = volInfo.progUnit
+            container.addToVariablesDocument(progUnit, volStruct.oType(), [volStruct])
+
+        # iterate through devices and add sim objects to documents, code is generated when the
+        # documents are rendered, function blocks with an update divisor are grouped by program unit,
+        # type, and divisor
+        rates = rates or SimRates(CostModel())
+        groups = {} # (document name, fb type, divisor) to list of function blocks, in device order
+        for device in deviceContainer:
+            
+            devName = device.name()
+            docName = device.progUnit()
+
+            # add declarations for structs
+            struct = container.getStruct(devName)
+            container.addToVariablesDocument(docName, struct.oType(), [struct])
+
+            # add declarations and code for function blocks, except for always open devices inside merged
+            # volumes, whose structs are only linked to the plc i/o
+            if devName in container.staticDevices:
+                continue
+            fb = container.getFB(devName)
+            container.addToVariablesDocument(docName, fb.oType(), [fb])
+            divisor = rates.divisor(fb)
+            if divisor > 1:
+                groups.setdefault((docName, fb.oType(), divisor), []).append(fb)
+            else:
+                container.addToProgramDocument(docName, fb.oType(), [fb])
+
+        for (docName, otype, divisor), fbs in groups.items():
+            container.addToProgramDocument(docName, otype,
+                                           [DecimatedGroup(docName, otype, divisor, rates.phases(fbs, divisor))])
+
+        # # set up ordering of devices by type
+        deviceOrdering = []
+        # deviceOrdering.append({"type":"FB_MKS275", "label":"MKS275 Gauges"})
+        # deviceOrdering.append({"type":"FB_MKS500", "label":"MKS500 Gauges"})
+        # deviceOrdering.append({"type":"FB_MKS500_EP", "label":"MKS500_EP Gauges"})
+        # deviceOrdering.append({"type":"FB_VGC", "label":"VGC Valves"})
+        # deviceOrdering.append({"type":"FB_PIP_GAMMA", "label":"PIP_Gamma Pumps"})
+        
+        # compute section order once for all documents
+        sectionOrder = cls.sectionOrder(deviceOrdering, list(container.varDocs.values()) +
+                                        list(container.progDocs.values()))
+
+        # list of (file name, document, section order) for the program unit documents, these are
+        # rendered and written by writeDocuments()
+        documents = []
+
+        # variables documents
+        for docName, document in container.varDocs.items():
+            documents.append(('gen.sim.GVL_' + docName.upper().replace("-", "_"), document, sectionOrder))
+
+        # program documents, called from the main program of their task
+        partitioner = partitioner or TaskPartitioner(CostModel())
+        timers = timers or CycleTimers(partitioner.costModel)
+        programs = [('PRG_' + docName.upper().replace("-", "_"), document)
+                    for docName, document in container.progDocs.items()]
+        programs = partitioner.partition('sim', programs, sectionOrder)
+        for progName, document in programs:
+            documents.append(('gen.sim.' + progName, document, sectionOrder))
+            timers.addProgram('sim', progName, document)
+
+        # the main program of each task increments the cycle counter of its decimated groups
+        counters = rates.assignCounters(partitioner.taskPrograms('sim'), dict(programs))
+        partitioner.writeMains('sim', output, ["PRG_DIAGNOSTIC();\n"], timers,
+                               [["%s := %s + 1;\n" % (counter, counter)] if counter else [] for counter in counters])
+
+        # write non-PLC variables that are used in the PLC code created by the generator
+        output.write('gen.sim.GVL_VARIABLES',
+                     "{attribute 'global_init_slot' := '40500'} // make sure variables are initialized before other GVLs\n" +
+                     "VAR_GLOBAL\n\n" +
+                     "Global_Leak : REAL := 0;\n" +
+                     "Global_Pressure : REAL := 0.0079;\n" +
+                     "New_Pressure : REAL := 22.0; //Torr\n" +
+                     "Global_OverridePressure : BOOL := FALSE;\n" +
+                     "".join(["%s : UDINT := 0; // cycle counter for decimated function blocks\n" % counter
+                              for counter in counters if counter]) + "\n" +
+                     "END_VAR\n")
+
+        # write files for diagnostic code
+        timers.writeFiles('sim', output)
+        output.write('gen.sim.PRG_DIAGNOSTIC.var',
+                     "   heartbeat AT %Q* : UINT := 0;\n" +
+                     timers.diagnosticVariables('sim'))
+
+        output.write('gen.sim.PRG_DIAGNOSTIC',
+                     "heartbeat := heartbeat + 1;\n" +
                     "IF heartbeat > 65000\n" +
 	            "   THEN heartbeat := 0;\n" +
-                    "END_IF\n")
+                    "END_IF\n" +
+                    timers.diagnosticCode('sim'))
+
+        return documents
+
+
+
+    # documents being written by forked worker processes, which inherit them instead of unpickling
+    # each document and the plc objects it references
+    forkedDocuments = []
+    forkedOutput = None
+
+
+
+    # render and write a single document, runs in a worker process for parallel generation,
+    # returns the OutputWriter.writeFile() result which is recorded by the parent process
+    @staticmethod
+    def writeDocument(output, task):
+        fileName, document, sectionOrder = task
+        return output.writeFile(fileName, document.render(sectionOrder))
+
+
+
+    @classmethod
+    def writeForkedDocument(cls, ind):
+        return cls.writeDocument(cls.forkedOutput, cls.forkedDocuments[ind])
+
+
+
+    # render and write the program unit documents of the plc and sim trees, in parallel worker
+    # processes when jobs is greater than 1, each file is written by exactly one task and its content
+    # doesn't depend on the order in which tasks run, so output is identical for any number of jobs
+    @classmethod
+    def writeDocuments(cls, documents, jobs, output):
+
+        if jobs <= 1 or len(documents) <= 1:
+            for task in documents:
+                output.record(cls.writeDocument(output, task))
+            return
+
+        jobs = min(jobs, len(documents))
+        chunkSize = max(1, len(documents) // (jobs * 4))
+
+        if "fork" in multiprocessing.get_all_start_methods():
+            # workers inherit the documents, tasks are just indexes
+            cls.forkedDocuments = documents
+            cls.forkedOutput = output
+            try:
+                context = multiprocessing.get_context("fork")
+                with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                            mp_context=context) as executor:
+                    for result in executor.map(cls.writeForkedDocument, range(len(documents)),
+                                               chunksize=chunkSize):
+                        output.record(result)
+            finally:
+                cls.forkedDocuments = []
+                cls.forkedOutput = None
+
+        else:
+            # documents are pickled and sent to the workers, e.g., on windows
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                for result in executor.map(functools.partial(cls.writeDocument, output), documents,
+                                           chunksize=chunkSize):
+                    output.record(result)
 
 
                 
+    # return map of plc variable name to {'type': fb type, 'simVar': sim variable}, and map of fb type to
+    # signal map for the types of the devices, as written to gen.varMap for mapSimIO.py
     @classmethod
-    def generateVarMap(cls, plcContainer, simContainer):
+    def variableMap(cls, deviceContainer, plcContainer, simContainer):
 
-        # iterate through devices, adding a map entry for each
+        # iterate through devices, adding a map entry for each, and the signal map for its type
         simVarMap = {}
-        for devName in DeviceContainer.deviceList:
-            device = DeviceContainer.deviceMap[devName]
+        signalMaps = {}
+        for device in deviceContainer:
+            devName = device.name()
             plcFB = plcContainer.getFB(devName)
             simStruct = simContainer.getStruct(devName)          
             variableData = {}
             variableData['type'] = plcFB.oType()
             variableData['simVar'] = simStruct.objectName()
             simVarMap[plcFB.objectName()] = variableData
-        
-        with open('gen.varMap', 'wb') as f:
-            pickle.dump(simVarMap, f, pickle.HIGHEST_PROTOCOL)
+            if variableData['type'] in PlcDevice.signalMaps:
+                signalMaps[variableData['type']] = PlcDevice.signalMaps[variableData['type']]
+        return simVarMap, signalMaps
+
+
+
+    @classmethod
+    def generateVarMap(cls, deviceContainer, plcContainer, simContainer, output):
+        simVarMap, signalMaps = cls.variableMap(deviceContainer, plcContainer, simContainer)
+        output.write('gen.varMap', varMap.VarMap.encode(simVarMap, signalMaps))
 
         
 
+class ScopeSelector:
+
+
+
+    # characters that make a selector entry a glob pattern e.g., EM1K0-*, entries starting
+    # with this prefix are regular expressions e.g., ^TV[0-9]K0, anything else is an exact name
+    globChars = "*?["
+    regexPrefix = "^"
+
+
+
+    def __init__(self, label):
+        self.label = label
+        self.entries = [] # entries as encountered in input, for reporting
+        self.names = set() # exact names for constant time lookup
+        self.patterns = [] # list of (entry, compiled pattern) for glob and regex entries
+        self.matchedEntries = set() # entries that have selected at least one row
+        self.matchedValues = set() # values selected by a pattern, checked against the other entries for reporting
+
+
+
+    def addEntry(self, entry):
+
+        if not entry:
+            return
+        self.entries.append(entry)
+
+        if entry.startswith(self.regexPrefix):
+            try:
+                pattern = re.compile(entry)
+            except re.error as ex:
+                sys.exit("invalid %s regex pattern: %s (%s)" % (self.label, entry, ex))
+            self.patterns.append((entry, pattern))
+        elif any(c in entry for c in self.globChars):
+            self.patterns.append((entry, re.compile(fnmatch.translate(entry))))
+        else:
+            self.names.add(entry)
+
+
+
+    def isEmpty(self):
+        return (not len(self.names)) and (not len(self.patterns))
+
+
+
+    # check if value is selected, exact names are checked with a single hash lookup and patterns
+    # are only tried for values that aren't an exact match
+    def matches(self, value):
+
+        if value in self.names:
+            self.matchedEntries.add(value)
+            return True
+
+        for entry, pattern in self.patterns:
+            if pattern.match(value):
+                self.matchedEntries.add(entry)
+                self.matchedValues.add(value)
+                return True
+
+        return False
+
+
+
+    # return entries that didn't select any row
+    # matches() stops at the first matching entry, so the entries that weren't recorded are checked
+    # against the selected values here, an entry is only reported if it doesn't match any of them
+    def unmatchedEntries(self):
+
+        selected = [value for value in self.names if value in self.matchedEntries] + list(self.matchedValues)
+        for entry, pattern in self.patterns:
+            if (not entry in self.matchedEntries) and any([pattern.match(value) for value in selected]):
+                self.matchedEntries.add(entry)
+        return [entry for entry in self.entries if entry not in self.matchedEntries]
+
+
+
+class DeviceInfoReader:
+
+
+
+    # device info columns used by the generator, in DeviceInfo constructor argument order
+    columns = ["Device Name", "PLC Tag", "PLC dep gauge1", "PLC dep gauge2", "PLC dep pump1",
+               "PLC dep valve1", "Volume", "sim dep vol1", "sim dep vol2", "PLC prog unit"]
+
+
+
+    # return map of column name to value for projected row, for diagnostic messages
+    @classmethod
+    def describe(cls, info):
+        return dict(zip(cls.columns, info))
+
+
+
+    def __init__(self, fobj):
+
+        self.reader = csv.reader(fobj)
+        self.rowCount = 0
+
+        # read the header once and resolve the index of each column used by the generator,
+        # the last occurrence of a duplicated column name wins as it does for csv.DictReader
+        header = next(self.reader, None)
+        if not header:
+            sys.exit("device info file is empty")
+        headerMap = {name: ind for ind, name in enumerate(header)}
+        missing = [name for name in self.columns if name not in headerMap]
+        if len(missing):
+            sys.exit("device info file is missing column(s): %s" % missing)
+        self.indexes = [headerMap[name] for name in self.columns]
+        self.nameIndex = headerMap["Device Name"]
+        self.progUnitIndex = headerMap["PLC prog unit"]
+        self.rowWidth = max(self.indexes) + 1
+        self.project = operator.itemgetter(*self.indexes)
+
+
+
+    # generator returning (row number, projected row tuple) for each row in scope, rows for which
+    # inScope(deviceName, progUnit) is false are dropped before any per-row object is created
+    # unless an outOfScope(rowCount, info) callback is specified
+    def rows(self, inScope, outOfScope=None):
+
+        nameIndex = self.nameIndex
+        progUnitIndex = self.progUnitIndex
+        rowWidth = self.rowWidth
+        project = self.project
+
+        for row in self.reader:
+
+            # blank lines are skipped without counting them, as csv.DictReader does
+            if not row:
+                continue
+            self.rowCount = self.rowCount + 1
+
+            # pad short rows so that missing trailing cells read as empty
+            if len(row) < rowWidth:
+                row.extend([""] * (rowWidth - len(row)))
+
+            if not inScope(row[nameIndex], row[progUnitIndex]):
+                if outOfScope:
+                    outOfScope(self.rowCount, project(row))
+                continue
+
+            yield self.rowCount, project(row)
+
+
+
 class DeviceHandler:
 
 
 
-    progUnits = []
-    devices = []
-    supportedDevices = set()
-    unsupportedDevices = set()
+    def __init__(self):
+        self.progUnits = ScopeSelector("program unit")
+        self.devices = ScopeSelector("device")
+        self.supportedDevices = set()
+        self.unsupportedDevices = set()
 
 
     
-    @classmethod
-    def handleDevice(cls, rowCount, info, plcContainer, simContainer, options):
-
-        iProgUnit = info["PLC prog unit"]
-        iName = info["Device Name"]
-        iTag = info["PLC Tag"].upper()
-        iDepGauge1 = info["PLC dep gauge1"]
-        iDepGauge2 = info["PLC dep gauge2"]
-        iDepPump1 = info["PLC dep pump1"]
-        iDepValve1 = info["PLC dep valve1"]
-        iVolume = info["Volume"]
-        iDepVol1 = info["sim dep vol1"]
-        iDepVol2 = info["sim dep vol2"]
-
-        # if we have a non-empty device list, only create the devices it contains
-        if (((not len(cls.devices)) and (not len(cls.progUnits))) or
-            ((len(cls.devices)) and (iName in cls.devices)) or
-            ((len(cls.progUnits)) and (iProgUnit in cls.progUnits))):
-
-            # we are ignoring rows that don't have a tag, this allows the device info table to
-            # contain devices that are out of scope of the plc, but generate a warning just in case:
-            if ((not iTag) or (len(iTag) == 0)):
-                print("skipping row with missing plc tag, row %d: %s" % (rowCount, info))
-                return
-
-            if ((not iName) or (len(iName) == 0)):
-                sys.exit("no iName provided for row %d: %s" % (rowCount, info))
-
-            if options.listTagsOnly:
-                if PlcDevice.isSupported(iTag):
-                    cls.supportedDevices.add(iTag)
-                else:
-                    cls.unsupportedDevices.add(iTag)
+    def inScope(self, iName, iProgUnit):
+
+        # with no device or program unit selection, all devices are in scope
+        if self.devices.isEmpty() and self.progUnits.isEmpty():
+            return True
+
+        # otherwise only create the selected devices, both selectors are checked so that
+        # unmatched entries are reported accurately
+        deviceMatch = self.devices.matches(iName)
+        progUnitMatch = self.progUnits.matches(iProgUnit)
+        return deviceMatch or progUnitMatch
+
 
+    
+    def handleDevice(self, rowCount, info, deviceContainer, plcContainer, simContainer, options):
+
+        # info contains the projected device info columns, see DeviceInfoReader.columns
+        (iName, iTag, iDepGauge1, iDepGauge2, iDepPump1, iDepValve1,
+         iVolume, iDepVol1, iDepVol2, iProgUnit) = info
+        iTag = iTag.upper()
+
+        # we are ignoring rows that don't have a tag, this allows the device info table to
+        # contain devices that are out of scope of the plc, but generate a warning just in case:
+        if ((not iTag) or (len(iTag) == 0)):
+            print("skipping row with missing plc tag, row %d: %s" %
+                  (rowCount, DeviceInfoReader.describe(info)))
+            return
+
+        if ((not iName) or (len(iName) == 0)):
+            sys.exit("no iName provided for row %d: %s" %
+                     (rowCount, DeviceInfoReader.describe(info)))
+
+        if options.listTagsOnly:
+            if PlcDevice.isSupported(iTag):
+                self.supportedDevices.add(iTag)
             else:
+                self.unsupportedDevices.add(iTag)
+
+        else:
 
-                devInfo = DeviceInfo(iName, iTag, iDepGauge1, iDepGauge2, iDepPump1,
-                                     iDepValve1, iVolume, iDepVol1, iDepVol2, iProgUnit)
+            devInfo = DeviceInfo(iName, iTag, iDepGauge1, iDepGauge2, iDepPump1,
+                                 iDepValve1, iVolume, iDepVol1, iDepVol2, iProgUnit)
 
-                device = PlcDevice.createDevice(iTag, devInfo)
+            device = PlcDevice.createDevice(iTag, devInfo)
 
-                if (not device):
-                    sys.exit("no device created for row %d: %s" % (rowCount, info))
-                else:
+            if (not device):
+                sys.exit("no device created for row %d: %s" %
+                         (rowCount, DeviceInfoReader.describe(info)))
+            else:
+
+                # store device
+                deviceContainer.addDevice(iName, device)
 
-                    # store device
-                    DeviceContainer.addDevice(iName, device)
+                # store plc objects
+                if not options.simOnly:
+                    plcContainer.addDevice(iName, device)
 
-                    # store plc objects
-                    if not options.simOnly:
-                        plcContainer.addDevice(iName, device)
+                # store sim objects
+                if not options.plcOnly:
+                    simContainer.addDevice(iName, device)
+       
+
+    
+    def printScopeReport(self):
+
+        # report selector entries that didn't select any device, typically typos
+        for selector in [self.progUnits, self.devices]:
+            unmatched = selector.unmatchedEntries()
+            if len(unmatched):
+                print()
+                print("%s selection entries that matched nothing: %s" % (selector.label, unmatched))
 
-                    # store sim objects
-                    if not options.plcOnly:
-                        simContainer.addDevice(iName, device)
-           
 
         
-    @classmethod
-    def printResult(cls, options):
+    def printResult(self, deviceContainer, options):
+
+        self.printScopeReport()
 
         if options.listTagsOnly:
             
             # print all unique devices
-            if len(cls.supportedDevices):
+            if len(self.supportedDevices):
                 print()
                 print("supported devices:")
-                for dtype in sorted(cls.supportedDevices):
+                for dtype in sorted(self.supportedDevices):
                     print(dtype)
-            if len(cls.unsupportedDevices):
+            if len(self.unsupportedDevices):
                 print()
                 print("unsupported devices:")
-                for dtype in sorted(cls.unsupportedDevices):
+                for dtype in sorted(self.unsupportedDevices):
                     print(dtype)
 
         else:
             print("==================================================")
             print("SUMMARY")
             print("==================================================")
-            print("devices created: %d" % len(DeviceContainer.deviceList))
+            print("devices created: %d" % len(deviceContainer))
         
 
 
@@ -2095,13 +4345,24 @@ class Options:
         self.listTagsOnly = False
         self.plcOnly = False
         self.simOnly = False
+        self.closure = None
+        self.jobs = 1
+        self.fbArrays = False
+        self.tasks = 0
+        self.cycleBudget = 0.0
+        self.costFile = None
+        self.calibrate = None
+        self.instrument = False
+        self.instrumentSections = False
+        self.timingReport = None
+        self.simRates = None
+        self.coarsenVolumes = None
  
 
         
-def main():
+# command line arguments for the generator stages, also used by pipeline.py
+def addArguments(parser):
 
-    # process command line
-    parser = argparse.ArgumentParser()
     parser.add_argument("deviceInfoFile", help="csv file with device info, expected format is first " +
                         "line with column names %s" % ("Device Name, PLC Tag, PLC dep gauge1, " +
                                                        "PLC dep gauge2, PLC dep pump1, PLC dep valve1, " +
@@ -2109,11 +4370,60 @@ def main():
     parser.add_argument("--tags", help="list unique tag types for specified devices", action="store_true")
     parser.add_argument("--plc", help="generate plc artifacts only", action="store_true")
     parser.add_argument("--sim", help="generate sim artifacts only", action="store_true")
-    parser.add_argument("--deviceFile", help="file containing devices to generate")
-    parser.add_argument("--progUnitsFile", help="file containing program units to generate")
-    args = parser.parse_args()
+    parser.add_argument("--deviceFile", help="file containing devices to generate, " +
+                        "entries may be glob (e.g., EM1K0-*) or regex (e.g., ^TV[0-9]K0) patterns")
+    parser.add_argument("--progUnitsFile", help="file containing program units to generate, " +
+                        "entries may be glob or regex patterns")
+    parser.add_argument("--jobs", help="number of worker processes for rendering and writing documents",
+                        type=int, default=1)
+    parser.add_argument("--closure", help="handle dependencies on devices outside the selected devices " +
+                        "or program units, 'include' adds the devices needed to satisfy them, " +
+                        "'blank' replaces them with ?blank placeholders where the dependency allows one, and " +
+                        "includes the devices otherwise",
+                        choices=[DependencyClosure.modeInclude, DependencyClosure.modeBlank])
+    parser.add_argument("--fbArrays", help="declare the plc function blocks of each type in a program unit as " +
+                        "an array, called in FOR loops, and write the device to array element table gen.fbIndex, " +
+                        "NOTE: this renames the device PVs, each device's PV is replaced by the array element PV " +
+                        "<unit>:<type> of pytmc, e.g. GMD:VGC, see gen.fbIndex",
+                        action="store_true")
+    parser.add_argument("--tasks", help="partition the program units of each tree across up to N tasks, each with " +
+                        "its own main program gen.plc.PRG_MAIN_<n>", type=int, default=0)
+    parser.add_argument("--cycleBudget", help="estimated execution time budget of a task cycle in microseconds, " +
+                        "program units are packed into tasks within the budget, and split if over it",
+                        type=float, default=0.0)
+    parser.add_argument("--costFile", help="csv file with function block type and estimated cost in " +
+                        "microseconds, replacing the default costs, e.g. gen.costs written by --calibrate")
+    parser.add_argument("--calibrate", help="csv file with tree (plc or sim), program name, and measured " +
+                        "time in microseconds, to calibrate the function block type costs, which are " +
+                        "written to gen.costs")
+    parser.add_argument("--instrument", help="wrap each program unit call in the main program with a cycle " +
+                        "timer, with min/max/avg times in GVL_DIAGNOSTIC, and write the table of timers gen.timers",
+                        action="store_true")
+    parser.add_argument("--instrumentSections", help="also time each function block type section of the " +
+                        "programs, implies --instrument", action="store_true")
+    parser.add_argument("--timingReport", help="csv file with tree (plc or sim), timer name, and measured " +
+                        "time in microseconds, to rank the programs and their sections by measured time, " +
+                        "the ranking is written to gen.timingReport")
+    parser.add_argument("--simRates", help="csv file with lines of 'type' or 'volume', sim function block " +
+                        "type or volume name, and update divisor, the sim function blocks with a divisor n " +
+                        "are called every n'th cycle, in staggered groups, NOTE: the call's time step isn't " +
+                        "scaled, so sim function blocks integrating per call (e.g. pressures, pump speeds) " +
+                        "evolve n times slower than real time")
+    parser.add_argument("--coarsenVolumes", help="csv file with lines of 'open' and device name for devices " +
+                        "always open in the sim, and 'join' and two volume names for volumes joined without " +
+                        "a device, volumes joined only by these are merged into one sim volume")
+
+
+
+# process parsed command line arguments, returns Options and DeviceHandler with the selected devices
+# and program units
+def readOptions(args):
+
+    # validate device class registry before reading any input
+    PlcDevice.compileRegistry()
 
     options = Options()
+    handler = DeviceHandler()
 
     # make sure devInfo input file is specified
     if not args.deviceInfoFile:
@@ -2131,9 +4441,10 @@ def main():
             with open(progUnitsFile, newline='') as f:
                 reader = csv.reader(f)
                 for row in reader:
-                    DeviceHandler.progUnits.append(row[0])
+                    if len(row):
+                        handler.progUnits.addEntry(row[0])
                 print("program units file contains %d unit(s): %s" %
-                      (len(DeviceHandler.progUnits), DeviceHandler.progUnits))
+                      (len(handler.progUnits.entries), handler.progUnits.entries))
         except Exception as ex:
             print(ex)
 
@@ -2146,9 +4457,10 @@ def main():
             with open(devFile, newline='') as f:
                 reader = csv.reader(f)
                 for row in reader:
-                    DeviceHandler.devices.append(row[0])
-                print("devices file contains %d device(s): %s" % (len(DeviceHandler.devices),
-                                                                  DeviceHandler.devices))
+                    if len(row):
+                        handler.devices.addEntry(row[0])
+                print("devices file contains %d device(s): %s" % (len(handler.devices.entries),
+                                                                  handler.devices.entries))
         except Exception as ex:
             print(ex)
 
@@ -2171,31 +4483,182 @@ def main():
         print("generating sim artifacts only")
         print()
 
-    # create PLC and sim containers
+    # render and write program unit documents in parallel
+    if args.jobs > 1:
+        options.jobs = args.jobs
+        print()
+        print("using %d worker processes" % options.jobs)
+
+    # resolve dependencies across the boundary of the selected devices or program units
+    if args.closure:
+        options.closure = args.closure
+        print()
+        print("using dependency closure mode: %s" % args.closure)
+
+    # declare plc function blocks as arrays of each type
+    if args.fbArrays:
+        options.fbArrays = True
+        print()
+        print("generating plc function block arrays")
+
+    # partition program units across tasks
+    if args.tasks < 0 or args.cycleBudget < 0:
+        sys.exit("--tasks and --cycleBudget must not be negative")
+    options.tasks = args.tasks
+    options.cycleBudget = args.cycleBudget
+    options.costFile = args.costFile
+    options.calibrate = args.calibrate
+    options.timingReport = args.timingReport
+    options.simRates = args.simRates
+    options.coarsenVolumes = args.coarsenVolumes
+    if options.tasks or options.cycleBudget:
+        print()
+        print("partitioning program units across %s task(s)%s" %
+              (options.tasks or "the needed", ", cycle budget %g us" % options.cycleBudget
+               if options.cycleBudget else ""))
+
+    # cycle time instrumentation
+    if args.instrument or args.instrumentSections:
+        options.instrument = True
+        options.instrumentSections = args.instrumentSections
+        print()
+        print("instrumenting program units%s with cycle timers" %
+              (" and function block sections" if options.instrumentSections else ""))
+
+    return options, handler
+
+
+
+# ingest stage, create devices, plc objects, and sim objects for the in scope rows of the device info
+# file, and resolve dependencies across the scope boundary if requested
+def readDevices(deviceInfoFile, handler, options):
+
+    # create device, PLC and sim containers
+    deviceContainer = DeviceContainer()
     plcContainer = PlcContainer()
     simContainer = SimContainer()
 
-    with open(args.deviceInfoFile, newline='') as f:
+    with open(deviceInfoFile, newline='') as f:
+
+        reader = DeviceInfoReader(f)
 
-        rowCount = 0
-        reader = csv.DictReader(f)
+        # index out of scope rows for dependency closure
+        closure = None
+        outOfScope = None
+        if options.closure:
+            closure = DependencyClosure(options.closure)
+            outOfScope = closure.addOutOfScopeRow
 
         # generate devices, plc objects, and sim objects
-        for row in reader:
-            rowCount = rowCount + 1
-            DeviceHandler.handleDevice(rowCount, row, plcContainer, simContainer, options)
+        for rowCount, info in reader.rows(handler.inScope, outOfScope):
+            handler.handleDevice(rowCount, info, deviceContainer, plcContainer, simContainer, options)
+
+        if closure:
+            closure.apply(handler, deviceContainer, plcContainer, simContainer, options)
+            closure.printResult()
+
+    # merge sim volumes before their dependencies are resolved
+    if options.coarsenVolumes and not options.plcOnly:
+        coarsening = VolumeCoarsening()
+        coarsening.load(options.coarsenVolumes)
+        coarsening.apply(deviceContainer, simContainer)
+        coarsening.printResult(simContainer)
+
+    return deviceContainer, plcContainer, simContainer
+
+
+
+# resolve stage, resolve and validate dependencies between devices and volumes for the generated trees
+def resolveDependencies(deviceContainer, plcContainer, simContainer, options):
+
+    containers = {}
+    if not options.simOnly:
+        containers[DependencyGraph.treePlc] = plcContainer
+    if not options.plcOnly:
+        containers[DependencyGraph.treeSim] = simContainer
+    graph = DependencyGraph(deviceContainer)
+    graph.resolve(containers)
+    graph.printResult()
+    return graph
+
+
+
+# generate stage, generate plc and sim code, only files whose content changed since the previous run
+# are written, and only documents whose devices or dependency targets changed are rendered, returns
+# OutputWriter and RowCache, their state is saved by finishOutput()
+def generateCode(deviceContainer, plcContainer, simContainer, graph, options):
+
+    # program units are partitioned across tasks by estimated cost
+    costModel = CostModel()
+    if options.costFile:
+        costModel.load(options.costFile)
+    measurements = None
+    if options.calibrate:
+        measurements = CostModel.loadMeasurements(options.calibrate)
+    partitioner = TaskPartitioner(costModel, options.tasks, options.cycleBudget, measurements)
+    timers = CycleTimers(costModel, options.instrument, options.instrumentSections)
+    rates = SimRates(costModel)
+    if options.simRates:
+        rates.load(options.simRates)
+
+    output = OutputWriter()
+    output.loadManifest()
+    documents = []
+    if not options.simOnly:
+        output.trees.add("plc")
+    if not options.plcOnly:
+        output.trees.add("sim")
+    if not options.simOnly:
+        documents.extend(PlcGenerator.generatePlc(deviceContainer, plcContainer, output, options.fbArrays,
+                                                  partitioner, timers))
+    if not options.plcOnly:
+        documents.extend(PlcGenerator.generateSim(deviceContainer, simContainer, output, partitioner, timers,
+                                                  rates))
+        rates.printResult()
+    if measurements:
+        output.write('gen.costs', costModel.content())
+    partitioner.printResult()
+    timers.writeIndex(output)
+    if options.timingReport:
+        timers.printReport(CostModel.loadMeasurements(options.timingReport), output)
+
+    rowCache = RowCache()
+    rowCache.load()
+    rowCache.update(deviceContainer, graph)
+    documents = rowCache.selectDocuments(documents, output)
+    PlcGenerator.writeDocuments(documents, options.jobs, output)
+    return output, rowCache
+
+
+
+def finishOutput(output, rowCache):
+
+    output.removeStaleFiles()
+    output.saveManifest()
+    rowCache.save()
+    output.printResult()
+    rowCache.printResult()
+
+
+
+def main():
+
+    # process command line
+    parser = argparse.ArgumentParser()
+    addArguments(parser)
+    args = parser.parse_args()
 
-        # generate plc and sim code
-        if not options.simOnly:
-            PlcGenerator.generatePlc(plcContainer)
-        if not options.plcOnly:
-            PlcGenerator.generateSim(simContainer)
+    options, handler = readOptions(args)
 
-        if not options.simOnly and not options.plcOnly:
-            PlcGenerator.generateVarMap(plcContainer, simContainer)
+    deviceContainer, plcContainer, simContainer = readDevices(args.deviceInfoFile, handler, options)
+    graph = resolveDependencies(deviceContainer, plcContainer, simContainer, options)
+    output, rowCache = generateCode(deviceContainer, plcContainer, simContainer, graph, options)
+    if not options.simOnly and not options.plcOnly:
+        PlcGenerator.generateVarMap(deviceContainer, plcContainer, simContainer, output)
+    finishOutput(output, rowCache)
 
-        # print summary
-        DeviceHandler.printResult(options)
+    # print summary
+    handler.printResult(deviceContainer, options)
 
 
 
@@ -1,17 +1,31 @@
 import sys
-from abc import ABC, abstractmethod
 import csv
 import re
 import argparse
 import xml.etree.ElementTree as ET
-import pickle
+import xml.parsers.expat
+from varMap import VarMap, VarMapError
 import datetime
 import shutil
+import mmap
+import os
+import gzip
+import time
+import json
+try:
+    import fcntl
+except ImportError: # not available on windows, backups are compressed copies
+    fcntl = None
 
 class Options:
 
 
 
+    # columns of a batch file line, one line for each plc and sim pair
+    pairingColumns = ["plcName", "simName", "simTaskPrefix", "simDevicePrefix", "variableMapFile"]
+
+
+
     def __init__(self):
         
         self.projFile = ""
@@ -20,7 +34,44 @@ class Options:
         self.simTaskPrefix = ""
         self.simDevicePrefix = ""
         self.variableMapFile = ""
- 
+        self.variableMap = None # variable map in memory, used instead of variableMapFile by pipeline.py
+
+
+
+    # return list of options for the plc and sim pairs in a batch file, blank lines, lines starting
+    # with '#', and a header line with the column names are skipped
+    @classmethod
+    def readBatchFile(cls, fileName, projFile):
+
+        print()
+        print("using batch file: %s" % fileName)
+        pairings = []
+        simNames = set()
+        try:
+            with open(fileName, newline='') as f:
+                for lineCount, row in enumerate(csv.reader(f), start=1):
+                    row = [value.strip() for value in row]
+                    if not len(row) or not any(row) or row[0].startswith("#") or row == cls.pairingColumns:
+                        continue
+                    if len(row) != len(cls.pairingColumns) or not all(row):
+                        sys.exit("batch file line %d should contain %s: %s" %
+                                 (lineCount, ", ".join(cls.pairingColumns), row))
+                    options = Options()
+                    options.projFile = projFile
+                    (options.plcName, options.simName, options.simTaskPrefix,
+                     options.simDevicePrefix, options.variableMapFile) = row
+                    if options.simName in simNames:
+                        sys.exit("batch file line %d: sim %s is mapped more than once" %
+                                 (lineCount, options.simName))
+                    simNames.add(options.simName)
+                    pairings.append(options)
+        except OSError as ex:
+            sys.exit("error reading batch file: %s" % ex)
+
+        if not len(pairings):
+            sys.exit("batch file %s doesn't contain any plc and sim pairs" % fileName)
+        print("batch file contains %d plc and sim pair(s)" % len(pairings))
+        return pairings
 
         
 def indent(elem, level=0):
@@ -42,191 +93,733 @@ def indent(elem, level=0):
 
 
 
-def main():
+# tsproj project file, the top level Mappings section is located by byte offset with a streaming parse
+# and only that section is parsed into elements, new mappings are spliced into the original bytes so
+# the rest of the file (e.g., embedded EtherCAT device descriptions) is copied through untouched
+class ProjectFile:
 
-    # process command line
-    parser = argparse.ArgumentParser()
-    parser.add_argument("projFile", help="twincat tsproj xml input file")
-    parser.add_argument("plcName",
-                        help="twincat name of plc e.g. 'TIPC^XtesSxrPlc^XtesSxrPlc Instance'")
-    parser.add_argument("simName",
-                        help="twincat name of sim plc e.g. 'TIPC^ProtoSimPLC^ProtoSimPLC Instance'")
-    parser.add_argument("simTaskPrefix",
-                        help="twincat task name for sim e.g. 'SimTask'")
-    parser.add_argument("simDevicePrefix",
-                        help="twincat device prefix for sim e.g. 'TIID^Device 2 (EtherCAT Simulation)^'")
-    parser.add_argument("variableMapFile",
-                        help="csv file from generator with plc variable, data type, and sim variable")
-    args = parser.parse_args()
 
-    options = Options()
 
-    # make sure tsproj project file file is specified
-    if not args.projFile:
-        sys.exit("no input project file specified")
-    else:
+    chunkSize = 1024 * 1024
+    mappingsTag = "Mappings"
+
+
+
+    def __init__(self, fileName):
+
+        self.fileName = fileName
+        self.mappingsStart = -1 # offset of '<Mappings'
+        self.mappingsEnd = -1 # offset just past '</Mappings>' or '<Mappings/>'
+        self.closeStart = -1 # offset of '</Mappings>', -1 if element is self closing
+        self.newline = b"\n"
+        self.insertions = [] # list of (start, end, bytes), replaces original bytes from start to end
+
+        self.fobj = open(fileName, 'rb')
+        try:
+            self.data = mmap.mmap(self.fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty file
+            self.data = b""
+
+
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.fobj.close()
+
+
+
+    # stream bytes from start to end through expat, without building elements, to find the first
+    # element with tag (and Name attribute, if specified) at depth below the first element in the range,
+    # returns (start offset, closing tag offset or -1 if self closing, end offset) or None
+    def locateElement(self, start, end, depth, tag, name=None):
+
+        class Found(Exception):
+            pass
+
+        parser = xml.parsers.expat.ParserCreate()
+        level = [0]
+        found = []
+        def startElement(elemName, attrs):
+            if level[0] == depth and elemName == tag and not found:
+                if name is None or attrs.get("Name") == name:
+                    found.append(start + parser.CurrentByteIndex)
+            level[0] = level[0] + 1
+        def endElement(elemName):
+            level[0] = level[0] - 1
+            if level[0] == depth and elemName == tag and len(found) == 1:
+                index = start + parser.CurrentByteIndex
+                if self.data[index:index + 2] != b"</":
+                    # self closing element, end event isn't reported at a closing tag
+                    found.extend([-1, self.data.find(b"/>", found[0]) + 2])
+                else:
+                    found.extend([index, self.data.find(b">", index) + 1])
+                raise Found()
+        parser.StartElementHandler = startElement
+        parser.EndElementHandler = endElement
+
+        try:
+            for offset in range(start, end, self.chunkSize):
+                parser.Parse(self.data[offset:min(offset + self.chunkSize, end)], False)
+            parser.Parse(b"", True)
+        except Found:
+            return tuple(found)
+        except xml.parsers.expat.ExpatError as ex:
+            sys.exit("exception parsing project file: %s" % ex)
+        return None
+
+
+
+    # locate the Mappings element that is a child of the root element
+    def locateMappings(self):
+
+        location = self.locateElement(0, len(self.data), 1, self.mappingsTag)
+        if not location:
+            return False
+        self.mappingsStart, self.closeStart, self.mappingsEnd = location
+        if self.data.find(b"\r\n", 0, self.mappingsEnd) != -1:
+            self.newline = b"\r\n"
+        return True
+
+
+
+    # parse just the Mappings section into an element
+    def readMappings(self):
+        try:
+            return ET.fromstring(self.data[self.mappingsStart:self.mappingsEnd])
+        except ET.ParseError as ex:
+            sys.exit("exception parsing project file Mappings section: %s" % ex)
+
+
+
+    # whitespace at the start of the line containing offset, if only whitespace precedes offset
+    def lineIndent(self, offset):
+        lineStart = self.data.rfind(b"\n", 0, offset) + 1
+        prefix = self.data[lineStart:offset]
+        if prefix.strip():
+            return None, lineStart
+        return prefix, lineStart
+
+
+
+    # serialized element, each line prefixed with lineIndent and terminated with the file's newline
+    def elementText(self, elem, lineIndent):
+        indent(elem)
+        elem.tail = None
+        lines = ET.tostring(elem, encoding="unicode").encode("utf-8").split(b"\n")
+        return b"".join([lineIndent + line + self.newline for line in lines])
+
+
+
+    # add a new child element as the last child of the Mappings section, indented to match the file
+    def appendToMappings(self, elem):
+
+        mappingsIndent, lineStart = self.lineIndent(self.mappingsStart)
+        if mappingsIndent is None:
+            mappingsIndent = b""
+
+        childIndent = mappingsIndent + b"\t"
+        text = self.elementText(elem, childIndent)
+
+        if self.closeStart == -1:
+            # expand self closing element
+            text = (b"<" + self.mappingsTag.encode("utf-8") + b">" + self.newline + text + mappingsIndent +
+                    b"</" + self.mappingsTag.encode("utf-8") + b">")
+            self.insertions.append((self.mappingsStart, self.mappingsEnd, text))
+            return
+
+        closeIndent, lineStart = self.lineIndent(self.closeStart)
+        if closeIndent is None:
+            # closing tag follows other content on the same line
+            self.insertions.append((self.closeStart, self.closeStart, self.newline + text + mappingsIndent))
+        else:
+            self.insertions.append((lineStart, lineStart, text))
+
+
+
+    # replace the child of the Mappings section with tag and Name attribute with elem
+    def replaceInMappings(self, tag, name, elem):
+
+        location = self.locateElement(self.mappingsStart, self.mappingsEnd, 1, tag, name)
+        if not location:
+            sys.exit("unable to locate %s '%s' in project file" % (tag, name))
+        start, closeStart, end = location
+
+        elemIndent, lineStart = self.lineIndent(start)
+        if elemIndent is None:
+            elemIndent = b""
+        text = self.elementText(elem, elemIndent)
+        self.insertions.append((start, end, text[len(elemIndent):-len(self.newline)]))
+
+
+
+    # write the original bytes with the insertions spliced in, to a temporary file which replaces the
+    # project file
+    def write(self):
+
+        tmpName = self.fileName + ".tmp"
+        with open(tmpName, 'wb') as f:
+            offset = 0
+            for start, end, text in sorted(self.insertions, key=lambda i: i[0]):
+                self.copyTo(f, offset, start)
+                f.write(text)
+                offset = end
+            self.copyTo(f, offset, len(self.data))
+        self.close()
+        os.replace(tmpName, self.fileName)
+
+
+
+    def copyTo(self, fobj, start, end):
+        for offset in range(start, end, self.chunkSize):
+            fobj.write(self.data[offset:min(offset + self.chunkSize, end)])
+
+
+# backs up the project file before it is written, as a copy on write clone of the file where the file
+# system supports it, otherwise as a gzip compressed copy, and removes old backups beyond the retention
+# limits, backups are named <projFile>.bak.<timestamp>, with a .gz suffix if compressed
+class ProjectBackup:
+
+
+
+    ficlone = 0x40049409 # linux FICLONE ioctl, clones the extents of the source file
+    compressLevel = 1 # fastest, large project files compress well anyway
+    compressSuffix = ".gz"
+
+
+
+    def __init__(self, fileName, keep, budget):
+
+        self.fileName = fileName
+        self.keep = keep # number of backups to keep, 0 for no limit
+        self.budget = budget # total bytes of backups to keep, 0 for no limit
+        self.backupFile = None
+        self.method = None
+        self.size = 0
+        self.seconds = 0.0
+        self.removed = [] # old backups removed by retention
+        self.retained = 0
+        self.retainedSize = 0
+
+
+
+    def backup(self):
+
+        startTime = time.perf_counter()
+        backupFile = self.fileName + '.bak.' + str(datetime.datetime.timestamp(datetime.datetime.now()))
+        if self.clone(backupFile):
+            self.method = "clone"
+        else:
+            backupFile = backupFile + self.compressSuffix
+            with open(self.fileName, 'rb') as src:
+                with gzip.open(backupFile, 'wb', compresslevel=self.compressLevel) as dst:
+                    shutil.copyfileobj(src, dst, ProjectFile.chunkSize)
+            self.method = "gzip"
+        shutil.copymode(self.fileName, backupFile)
+        self.backupFile = backupFile
+        self.size = os.path.getsize(backupFile)
+        self.seconds = time.perf_counter() - startTime
+
+        self.applyRetention()
+
+
+
+    # returns False if the file system or platform doesn't support cloning
+    def clone(self, backupFile):
+
+        if fcntl is None:
+            return False
+        try:
+            with open(self.fileName, 'rb') as src:
+                with open(backupFile, 'wb') as dst:
+                    fcntl.ioctl(dst.fileno(), self.ficlone, src.fileno())
+            return True
+        except OSError:
+            if os.path.exists(backupFile):
+                os.remove(backupFile)
+            return False
+
+
+
+    # return list of (timestamp, file name) for existing backups of the project file, oldest first
+    def existingBackups(self):
+
+        dirName = os.path.dirname(self.fileName) or "."
+        prefix = os.path.basename(self.fileName) + ".bak."
+        backups = []
+        for name in os.listdir(dirName):
+            if not name.startswith(prefix):
+                continue
+            stamp = name[len(prefix):]
+            if stamp.endswith(self.compressSuffix):
+                stamp = stamp[:-len(self.compressSuffix)]
+            try:
+                backups.append((float(stamp), os.path.join(os.path.dirname(self.fileName), name)))
+            except ValueError: # not created by the mapper
+                continue
+        return sorted(backups)
+
+
+
+    # remove the oldest backups until both limits are met, the newest backup is always kept
+    def applyRetention(self):
+
+        backups = [(name, os.path.getsize(name)) for stamp, name in self.existingBackups()]
+        totalSize = sum([size for name, size in backups])
+        while len(backups) > 1:
+            overCount = self.keep and len(backups) > self.keep
+            overBudget = self.budget and totalSize > self.budget
+            if not (overCount or overBudget):
+                break
+            name, size = backups.pop(0)
+            os.remove(name)
+            self.removed.append(name)
+            totalSize = totalSize - size
+        self.retained = len(backups)
+        self.retainedSize = totalSize
+
+
+
+    def printResult(self):
+
         print()
-        print("using project file: %s" % args.projFile)
-        options.projFile = args.projFile
+        print("==================================================")
+        print("BACKUP")
+        print("==================================================")
+        print("backup file: %s" % self.backupFile)
+        print("method: %s size: %d bytes time: %.3f sec" % (self.method, self.size, self.seconds))
+        print("old backups removed: %d kept: %d total size: %d bytes" %
+              (len(self.removed), self.retained, self.retainedSize))
+        for name in self.removed:
+            print("removed: %s" % name)
 
-        # back up file before proceeding
-        backupFile = options.projFile + '.bak.' + str(datetime.datetime.timestamp(datetime.datetime.now()))
-        shutil.copy(options.projFile, backupFile)
 
-    # make sure plcName is specified
-    if not args.plcName:
-        sys.exit("no plcName specified")
-    else:
+
+# updates existing sim mappings to match the links derived from the plc mappings, links are indexed
+# by sim device (OwnerB) name, VarA and VarB, since VarB is relative to the device
+class MappingUpdate:
+
+
+
+    def __init__(self):
+        self.added = 0
+        self.removed = 0
+        self.unchanged = 0
+        self.devicesAdded = 0
+        self.devicesRemoved = 0
+
+
+
+    def changed(self):
+        return self.added + self.removed + self.devicesAdded + self.devicesRemoved > 0
+
+
+
+    # count the links of new sim mappings
+    def addAll(self, simMap):
+        for deviceNode in simMap.findall("OwnerB"):
+            self.devicesAdded = self.devicesAdded + 1
+            self.added = self.added + len(deviceNode.findall("Link"))
+
+
+
+    # update existing sim mappings in place to contain the links of the derived mappings, devices and
+    # links are then ordered as derived, so the result is the same as creating the sim mappings again
+    def apply(self, simMap, derivedMap):
+
+        derivedDevices = {}
+        derivedKeys = {} # insertion ordered
+        for deviceNode in derivedMap.findall("OwnerB"):
+            deviceName = deviceNode.get("Name")
+            links = derivedDevices.setdefault(deviceName, [])
+            for linkNode in deviceNode.findall("Link"):
+                key = (deviceName, linkNode.get("VarA"), linkNode.get("VarB"))
+                if not key in derivedKeys:
+                    derivedKeys[key] = True
+                    links.append(key)
+
+        # remove existing links that aren't derived, and duplicates
+        existingDevices = {}
+        existingKeys = set()
+        for deviceNode in simMap.findall("OwnerB"):
+            deviceName = deviceNode.get("Name")
+            for linkNode in deviceNode.findall("Link"):
+                key = (deviceName, linkNode.get("VarA"), linkNode.get("VarB"))
+                if key in derivedKeys and not key in existingKeys:
+                    existingKeys.add(key)
+                    self.unchanged = self.unchanged + 1
+                else:
+                    deviceNode.remove(linkNode)
+                    self.removed = self.removed + 1
+            if not deviceName in derivedDevices and not len(deviceNode):
+                simMap.remove(deviceNode)
+                self.devicesRemoved = self.devicesRemoved + 1
+            else:
+                existingDevices.setdefault(deviceName, deviceNode)
+
+        # add derived links that don't exist
+        for deviceName, links in derivedDevices.items():
+            deviceNode = existingDevices.get(deviceName)
+            if deviceNode is None:
+                deviceNode = ET.SubElement(simMap, 'OwnerB')
+                deviceNode.set("Name", deviceName)
+                self.devicesAdded = self.devicesAdded + 1
+            for key in links:
+                if not key in existingKeys:
+                    linkNode = ET.SubElement(deviceNode, 'Link')
+                    linkNode.set("VarA", key[1])
+                    linkNode.set("VarB", key[2])
+                    self.added = self.added + 1
+
+        # order devices and links as derived, other elements are kept at the end
+        simMap.tail = None
+        deviceOrder = dict([(deviceName, ind) for ind, deviceName in enumerate(derivedDevices.keys())])
+        linkOrder = dict([(key, ind) for ind, key in enumerate(derivedKeys)])
+        def sortChildren(elem, order):
+            children = list(elem)
+            for child in children:
+                elem.remove(child)
+                # whitespace is re-indented when the mappings are written
+                if child.tail and not child.tail.strip():
+                    child.tail = None
+            children.sort(key=lambda child: order(child) if order(child) is not None else len(children))
+            elem.extend(children)
+            if elem.text and not elem.text.strip():
+                elem.text = None
+        sortChildren(simMap, lambda child: deviceOrder.get(child.get("Name")) if child.tag == 'OwnerB' else None)
+        for deviceNode in simMap.findall("OwnerB"):
+            deviceName = deviceNode.get("Name")
+            sortChildren(deviceNode, lambda child: linkOrder.get((deviceName, child.get("VarA"), child.get("VarB")))
+                         if child.tag == 'Link' else None)
+
+
+
+    def printResult(self):
         print()
-        print("using plcName: %s" % args.plcName)
-        options.plcName = args.plcName
+        print("sim links added: %d removed: %d unchanged: %d" % (self.added, self.removed, self.unchanged))
+        print("sim devices added: %d removed: %d" % (self.devicesAdded, self.devicesRemoved))
+
+
+
+class LinkPathError(Exception):
+    pass
+
+
+
+# problems found while mapping the plc links, classified and counted, so that all of them are
+# reported in a single run
+class ValidationReport:
+
+
+
+    malformedName = "malformed name"
+    unknownVar = "unknown variable"
+    unknownType = "unknown type"
+    unmappedSignal = "unmapped signal"
+
+    categories = [malformedName, unknownVar, unknownType, unmappedSignal]
+
+
+
+    def __init__(self):
+        self.problems = {} # category to map of problem description to number of links
+        self.links = 0
+        self.prefix = "" # prepended to descriptions, identifies the plc in batch mode
+
+
+
+    def add(self, category, description):
+        descriptions = self.problems.setdefault(category, {})
+        description = self.prefix + description
+        descriptions[description] = descriptions.get(description, 0) + 1
+
+
+
+    def problemCount(self):
+        return sum([sum(descriptions.values()) for descriptions in self.problems.values()])
+
+
+
+    def printResult(self):
 
-    # make sure simName is specified
-    if not args.simName:
-        sys.exit("no simName specified")
-    else:
         print()
-        print("using simName: %s" % args.simName)
-        options.simName = args.simName
+        print("==================================================")
+        print("VALIDATION")
+        print("==================================================")
+        print("links checked: %d" % self.links)
+        if not self.problemCount():
+            print("no problems found")
+            return
+        for category in self.categories:
+            descriptions = self.problems.get(category)
+            if not descriptions:
+                continue
+            print()
+            print("%s: %d problem(s), %d distinct" % (category, sum(descriptions.values()), len(descriptions)))
+            for description, count in descriptions.items():
+                if count > 1:
+                    print("   %s (%d links)" % (description, count))
+                else:
+                    print("   %s" % description)
+
+
+
+# parses plc link variable paths, e.g., "PlcTask Inputs^GVL_GMD.fb_EM1K0_GMD_GCC_10.i_iPRESS_R", into the
+# sim task prefix with the opposite direction, doc name, variable name, and signal name, the path up to
+# the signal name is shared by the links of a device and direction, so it is parsed once and cached,
+# as is each unique plc task prefix, and repeated tokens are interned
+class LinkPathParser:
+
+
+
+    # task prefix up to the first '^', then exactly three '.' separated tokens
+    pattern = re.compile(r"([^^]*)\^([^.]*)\.([^.]*)\.([^.]*)$")
+
+
+
+    def __init__(self, simTaskPrefix):
+        self.simTaskPrefix = simTaskPrefix
+        self.taskPrefixes = {} # plc task prefix to sim task prefix
+        self.heads = {} # path up to signal name to (sim task prefix, doc name, variable name)
+        self.tokens = {}
+
+
+
+    def intern(self, token):
+        return self.tokens.setdefault(token, token)
+
+
+
+    # sim task prefix with "Inputs" or "Outputs" appended, the opposite of the plc task prefix
+    def simTaskInoutPrefix(self, inoutSpec):
+        simPrefix = self.taskPrefixes.get(inoutSpec)
+        if simPrefix is None:
+            if "Inputs" in inoutSpec:
+                simPrefix = self.simTaskPrefix + " Outputs"
+            elif "Outputs" in inoutSpec:
+                simPrefix = self.simTaskPrefix + " Inputs"
+            else:
+                raise LinkPathError("unexpected plc task prefix format: %s" % inoutSpec)
+            self.taskPrefixes[inoutSpec] = simPrefix
+        return simPrefix
+
+
+
+    def parseHead(self, plcVar, head):
+        match = self.pattern.match(plcVar)
+        if not match:
+            if plcVar.find('^') != -1:
+                # report task prefix errors first, as parsing separately would
+                self.simTaskInoutPrefix(plcVar[0:plcVar.find('^')])
+            raise LinkPathError("unexpected plc variable format: %s" % plcVar)
+        inoutSpec, docName, varName, sigName = match.groups()
+        parsed = (self.simTaskInoutPrefix(inoutSpec), self.intern(docName), self.intern(varName))
+        self.heads[head] = parsed
+        return parsed
+
+
+
+    # return (sim task prefix, doc name, variable name, signal name) for plc variable path, raises
+    # LinkPathError for a malformed path
+    def parse(self, plcVar):
+        head, sep, sigName = plcVar.rpartition('.')
+        parsed = self.heads.get(head)
+        if parsed is None:
+            parsed = self.parseHead(plcVar, head)
+        return parsed + (self.tokens.setdefault(sigName, sigName),)
+
+
+
+
+# links derived for one plc and sim pair, for the run summary
+class SimSummary:
+
+
+
+    def __init__(self, options):
+
+        self.plcName = options.plcName
+        self.simName = options.simName
+        self.deviceLinks = {} # sim device name to number of sim links
+        self.typeLinks = {} # plc function block type to number of sim links
+        self.typeUnmapped = {} # plc function block type to number of "?unmapped" signals not linked
+        self.update = None
+
+
+
+    def addLink(self, plcType):
+        self.typeLinks[plcType] = self.typeLinks.get(plcType, 0) + 1
+
+
+
+    def addUnmapped(self, plcType):
+        self.typeUnmapped[plcType] = self.typeUnmapped.get(plcType, 0) + 1
+
+
+
+    def addDevice(self, deviceName, links):
+        self.deviceLinks[deviceName] = self.deviceLinks.get(deviceName, 0) + links
+
+
+
+    def linkCount(self):
+        return sum(self.typeLinks.values())
+
+
+
+    def printResult(self):
 
-    # make sure simTaskPrefix is specified
-    if not args.simTaskPrefix:
-        sys.exit("no simTaskPrefix specified")
-    else:
         print()
-        print("using simTaskPrefix: %s" % args.simTaskPrefix)
-        options.simTaskPrefix = args.simTaskPrefix
+        print("sim: %s" % self.simName)
+        print("sim links: %d" % self.linkCount())
+        counts = list(self.deviceLinks.values())
+        if len(counts):
+            print("sim devices: %d, links per device min: %d avg: %.1f max: %d" %
+                  (len(counts), min(counts), float(sum(counts)) / len(counts), max(counts)))
+        unlinked = [name for name, count in self.deviceLinks.items() if count == 0]
+        if len(unlinked):
+            print("sim devices without links: %d" % len(unlinked))
+            for name in unlinked:
+                print("   %s" % name)
+        for plcType in sorted(set(self.typeLinks.keys()) | set(self.typeUnmapped.keys())):
+            print("   %s: %d links, %d unmapped signals" %
+                  (plcType, self.typeLinks.get(plcType, 0), self.typeUnmapped.get(plcType, 0)))
+
+
+
+    def reportData(self):
+
+        data = {'plcName': self.plcName, 'simName': self.simName, 'links': self.linkCount(),
+                'linksPerDevice': self.deviceLinks, 'linksPerType': self.typeLinks,
+                'unmappedPerType': self.typeUnmapped, 'update': None}
+        if self.update:
+            data['update'] = {'added': self.update.added, 'removed': self.update.removed,
+                              'unchanged': self.update.unchanged, 'devicesAdded': self.update.devicesAdded,
+                              'devicesRemoved': self.update.devicesRemoved}
+        return data
+
+
+
+# summary of a mapper run, with the elapsed time of each phase, printed at the end of the run and
+# optionally written to a json report file
+class RunSummary:
+
+
+
+    def __init__(self, projFile):
+
+        self.projFile = projFile
+        self.phases = {} # phase name to elapsed seconds, in order of first start
+        self.phaseName = None
+        self.phaseStart = 0.0
+        self.sims = [] # SimSummary for each plc and sim pair
+        self.report = None # ValidationReport
+        self.backup = None # ProjectBackup, if the project file was written
+        self.result = None
+
+
+
+    def startPhase(self, name):
+        self.stopPhase()
+        self.phaseName = name
+        self.phaseStart = time.perf_counter()
+
+
+
+    def stopPhase(self):
+        if self.phaseName:
+            self.phases[self.phaseName] = (self.phases.get(self.phaseName, 0.0) +
+                                           time.perf_counter() - self.phaseStart)
+            self.phaseName = None
+
+
+
+    # print the summary and write the report file, if specified, result describes the outcome of the run
+    def finish(self, result, reportFile):
+
+        self.stopPhase()
+        self.result = result
+        self.printResult()
+        if reportFile:
+            self.writeReport(reportFile)
+
+
+
+    def printResult(self):
 
-    # make sure simDevicePrefix is specified
-    if not args.simDevicePrefix:
-        sys.exit("no simDevicePrefix specified")
-    else:
         print()
-        print("using simDevicePrefix: %s" % args.simDevicePrefix)
-        options.simDevicePrefix = args.simDevicePrefix
+        print("==================================================")
+        print("SUMMARY")
+        print("==================================================")
+        for sim in self.sims:
+            sim.printResult()
+        print()
+        print("elapsed time per phase:")
+        for name, seconds in self.phases.items():
+            print("   %s: %.3f sec" % (name, seconds))
+
+
+
+    def writeReport(self, fileName):
 
-    # make sure variableMapFile is specified
-    if not args.variableMapFile:
-        sys.exit("no variableMapFile specified")
+        data = {'projFile': self.projFile, 'result': self.result,
+                'sims': [sim.reportData() for sim in self.sims],
+                'validation': {'links': self.report.links, 'problemCount': self.report.problemCount(),
+                               'problems': self.report.problems} if self.report else None,
+                'backup': None, 'phases': self.phases}
+        if self.backup:
+            data['backup'] = {'file': self.backup.backupFile, 'method': self.backup.method,
+                              'size': self.backup.size, 'seconds': self.backup.seconds,
+                              'removed': self.backup.removed}
+        try:
+            with open(fileName, 'w') as f:
+                json.dump(data, f, indent=2)
+                f.write("\n")
+        except OSError as ex:
+            sys.exit("error writing report file: %s" % ex)
+
+
+
+# add or update the sim variable mappings in the project for the plc and sim of options, problems are
+# added to the validation report, and the project is only updated if there are none, the derived links
+# are counted in summary, and the new or updated mappings are printed if dump is set
+def mapSimulation(options, project, mappingRoot, report, summary, dump):
+
+    print()
+    print("mapping plc: %s to sim: %s" % (options.plcName, options.simName))
+
+    # open variable map, variables are looked up in the memory mapped file as needed
+    if options.variableMap is not None:
+        variableMap = options.variableMap
+        print("variable map contains %d variable(s)" % (len(variableMap)))
     else:
-        print()
-        print("using variableMapFile: %s" % args.variableMapFile)
-        options.variableMapFile = args.variableMapFile
-
-    # read variable map
-    variableMap = {}
-    try:
-        with open(options.variableMapFile, 'rb') as f:
-            variableMap = pickle.load(f)
+        try:
+            variableMap = VarMap.open(options.variableMapFile)
             print("variable map file contains %d variable(s)" % (len(variableMap)))
-    except Exception as ex:
-        sys.exit("error opening variable map file: %s" % ex)
-
-    signalMap = {
-        "FB_VGC" : { # ST_VacuumValve
-            "q_xOPN_DO" : "i_xSol",
-            "i_xOpnLS" : "q_xOpnLS",
-            "i_xClsLS" : "q_xClsLS"},
-        "FB_VRC" : { # ST_VacuumValve
-            "q_xOPN_DO" : "i_xSol",
-            "i_xOpnLS" : "q_xOpnLS",
-            "i_xClsLS" : "q_xClsLS"},
-        "FB_MKS500" : { # ST_MKS_500
-            "i_iPRESS_R" : "q_iRawPress",
-            "i_xHV_ON" : "q_xHVOn",
-            "i_xDisc_Active" : "q_DisActive",
-            "q_xHV_DIS" : "i_xHvOn"},
-        "FB_MKS500_EP" : { # ST_MKS_500
-            "i_iPRESS_R" : "q_iRawPress",
-            "i_xHV_ON" : "q_xHVOn",
-            "i_xDisc_Active" : "q_DisActive",
-            "q_xHV_DIS" : "i_xHvOn"},
-        "FB_MKS422" : { # ST_MKS_422
-            "i_iPRESS_R" : "q_iRawPress",
-            "q_xHV_DIS" : "i_xHvOn"},
-        "FB_MKS275" : { # ST_MKS_275
-            "i_iPRESS_R" : "q_iRawPress"},
-        "FB_MKS317" : { # we are mapping this to ST_MKS_275 since there is not a sim function block for 317
-            "i_iPRESS_R" : "q_iRawPress"},
-        "FB_PIP_GAMMA" : { # ST_GAM_PIP
-            "q_xHVEna_DO" : "xOn",
-            "i_iPRESS" : "?unmapped",
-            "i_xSP_DI" : "?unmapped"},
-        "FB_EbaraEVA" : { # ST_MechPump
-            "q_xRunDo" : "i_xRun",
-            "q_xRemote" : "?unmapped",
-            "i_xAlarmOK" : "?unmapped",
-            "i_xIsRun" : "?unmapped"},
-        "FB_EbaraDryPump" : { # ST_MechPump
-            "q_xMPStart" : "i_xRun",
-            "q_xBPStart" : "?unmapped",
-            "i_xMPStatus" : "?unmapped",
-            "i_xBPStatus" : "?unmapped",
-            "i_xWarning" : "?unmapped",
-            "i_xAlarm" : "?unmapped",
-            "i_xRemote" : "?unmapped"},
-        "FB_PTM_Ebara_010M" : { # ST_MechPump
-            "q_xStart" : "i_xRun",
-            "q_xStop" : "?unmapped",
-            "q_xReset" : "?unmapped",
-            "q_xProtection" : "?unmapped",
-            "q_xSetSpeed" : "?unmapped",
-            "q_iSpeedSet" : "?unmapped",
-            "i_xDecel" : "?unmapped",
-            "i_xAccel" : "?unmapped",
-            "i_xRotate" : "?unmapped",
-            "i_xNCFault" : "?unmapped",
-            "i_xAtSpd" : "?unmapped",
-            "i_iRawSpeed" : "?unmapped",
-            "i_xAlarm" : "?unmapped",
-            "i_iTempMon" : "?unmapped",
-            "i_iCurrentMon" : "?unmapped"},
-        "FB_PTM_Ebara_011M" : { # ST_MechPump
-            "q_xStart" : "i_xRun",
-            "q_xStop" : "?unmapped",
-            "q_xReset" : "?unmapped",
-            "q_xProtection" : "?unmapped",
-            "q_xSetSpeed" : "?unmapped",
-            "q_iSpeedSet" : "?unmapped",
-            "i_xDecel" : "?unmapped",
-            "i_xAccel" : "?unmapped",
-            "i_xRotate" : "?unmapped",
-            "i_xFaultNC" : "?unmapped",
-            "i_xAtSpd" : "?unmapped",
-            "i_iRawSpeed" : "?unmapped"},
-        "FB_PTM_TwisTorr" : { # ST_MechPump
-            "q_RunDO" : "i_xRun",
-            "i_xAtSpd" : "q_xAtSpd",
-            "i_xFault" : "q_xErr"},
-    }
-
-    # parse xml project file
-    try:
-        tree = ET.parse(options.projFile)
-    except Exception as ex:
-        sys.exit("exception parsing project file: " + ex)
-
-    root = tree.getroot()
-    mappingRoot = root.find("./Mappings")
-    if not mappingRoot:
-        sys.exit("project file doesn't contain a 'Mappings' section")
+        except VarMapError as ex:
+            sys.exit(str(ex))
+        except Exception as ex:
+            sys.exit("error opening variable map file: %s" % ex)
+
+    linkParser = LinkPathParser(options.simTaskPrefix)
+    variables = {}
 
     # find the plc variable mappings
-    plcMap = root.findall("./Mappings/OwnerA[@Name='%s']" % options.plcName)
+    plcMap = mappingRoot.findall("./OwnerA[@Name='%s']" % options.plcName)
     if len(plcMap) != 1:
         sys.exit("found %d matches in project file for plc: %s" %
                  (len(plcMap), options.plcName))
     plcMap = plcMap[0]
 
-    # exit if there are already sim variable mappings,
-    #otherwise create a new section for the mappings
-    simMap = root.findall("./Mappings/OwnerA[@Name='%s']" % options.simName)
-    if len(simMap) != 0:
-        sys.exit("found existing variable mappings for sim: %s" %
-                 (options.simName))
-    else:
-        simMap = ET.SubElement(mappingRoot, 'OwnerA')
-        simMap.set("Name", options.simName)
+    # existing sim variable mappings are updated incrementally, otherwise a new section is created
+    existingMap = mappingRoot.findall("./OwnerA[@Name='%s']" % options.simName)
+    if len(existingMap) > 1:
+        sys.exit("found %d matches in project file for sim: %s" %
+                 (len(existingMap), options.simName))
+
+    # sim variable mappings derived from the plc variable mappings
+    simMap = ET.Element('OwnerA')
+    simMap.set("Name", options.simName)
     
     for deviceMap in plcMap.findall("OwnerB"):
         
@@ -234,7 +827,8 @@ def main():
         
         ind = deviceName.rfind('^')
         if ind == -1:
-            sys.exit("unexpected device name format: %s" % deviceName)
+            report.add(report.malformedName, "unexpected device name format: %s" % deviceName)
+            continue
         deviceName = deviceName[ind+1:]
 
         # create name for io device node and add it to the simMap container
@@ -243,51 +837,41 @@ def main():
         deviceNode.set("Name", simDeviceName)
 
         for varLink in deviceMap.findall("Link"):
-            plcVar = varLink.attrib['VarA']
             ioLink = varLink.attrib['VarB']
+            report.links = report.links + 1
 
-            # strip off task name / and "Inputs" or "Outputs", but first use to determine
-            # whether to link to the sim's inputs or output (opposite of the plc value)
-            ind = plcVar.find('^')
-            if ind == -1:
-                sys.exit("unexpected plc variable format: %s" % plcVar)
-            inoutSpec = plcVar[0:ind]
-            if "Inputs" in inoutSpec:
-                inoutSpec = "Outputs"
-            elif "Outputs" in inoutSpec:
-                inoutSpec = "Inputs"
-            else:
-                sys.exit("unexpected plc task prefix format: %s" % inoutSpec)
-            plcVar = plcVar[ind+1:]
-
-            # create sim task prefix with "Inputs" or "Outputs" appended as appropriate
-            simTaskInoutPrefix = options.simTaskPrefix + " " + inoutSpec
-
-            # get plc var name tokens (doc name, variable name, and usually signal name)
-            varTokens = plcVar.split('.')
-            if len(varTokens) == 3:
-                docName = varTokens[0]
-                varName = varTokens[1]
-                sigName = varTokens[2]
-            else:
-                sys.exit("unexpected plc variable format: %s" % plcVar)
+            # get sim task prefix, linking to the sim's inputs or outputs (opposite of the plc value),
+            # and plc var name tokens (doc name, variable name, and usually signal name)
+            try:
+                simTaskInoutPrefix, docName, varName, sigName = linkParser.parse(varLink.attrib['VarA'])
+            except LinkPathError as ex:
+                report.add(report.malformedName, str(ex))
+                continue
 
-            # get plc data type and sim variable for plc variable
-            if not varName in variableMap:
-                sys.exit("no variable mapping found for %s" % varName)
+            # get plc data type and sim variable for plc variable, variables are looked up once
+            variableData = variables.get(varName)
+            if variableData is None:
+                variableData = variableMap.get(varName) or False
+                variables[varName] = variableData
+            if not variableData:
+                report.add(report.unknownVar, "no variable mapping found for %s" % varName)
+                continue
                 
-            variableData = variableMap[varName]
             plcType = variableData['type']
             simVar = variableData['simVar']
 
             # get sim signal name for plc signal name
-            if not plcType in signalMap:
-                sys.exit("no type mapping found for type: %s" % (plcType))
-            signalData = signalMap[plcType]
+            signalData = variableMap.signalMap(plcType)
+            if signalData is None:
+                report.add(report.unknownType, "no type mapping found for type: %s" % (plcType))
+                continue
             if sigName not in signalData:
-                sys.exit("no signal mapping found for type: %s signal: %s" % (plcType, sigName))
+                report.add(report.unmappedSignal,
+                           "no signal mapping found for type: %s signal: %s" % (plcType, sigName))
+                continue
             simSignal = signalData[sigName]
             if simSignal == "?unmapped": # don't map this signal to the sim
+                summary.addUnmapped(plcType)
                 continue
 
             varASim = simTaskInoutPrefix + "^" + docName + "." + simVar + "." + simSignal
@@ -295,10 +879,195 @@ def main():
             linkNode = ET.SubElement(deviceNode, 'Link')
             linkNode.set("VarA", varASim)
             linkNode.set("VarB", ioLink)
+            summary.addLink(plcType)
+
+        summary.addDevice(simDeviceName, len(deviceNode))
+
+    variableMap.close()
+
+    # mappings aren't updated if there are problems, since they would be incomplete
+    update = MappingUpdate()
+    if report.problemCount():
+        return update
+
+    if len(existingMap) == 0:
+        update.addAll(simMap)
+        update.printResult()
+        if dump:
+            ET.dump(simMap)
+        project.appendToMappings(simMap)
+    else:
+        print()
+        print("updating existing variable mappings for sim: %s" % options.simName)
+        update.apply(existingMap[0], simMap)
+        update.printResult()
+        if update.changed():
+            if dump:
+                ET.dump(existingMap[0])
+            project.replaceInMappings('OwnerA', options.simName, existingMap[0])
+
+    return update
+
+
+
+# command line options for the mapping, also used by pipeline.py
+def addArguments(parser):
+
+    parser.add_argument("--check", help="validate the plc links and report problems, without writing or " +
+                        "backing up the project file", action="store_true")
+    parser.add_argument("--backupKeep", help="number of project file backups to keep, 0 for no limit " +
+                        "(default 10)", type=int, default=10)
+    parser.add_argument("--backupBudget", help="total size in MB of project file backups to keep, 0 for " +
+                        "no limit (default 0)", type=float, default=0)
+    parser.add_argument("--dump", help="print the new or updated sim variable mappings xml", action="store_true")
+    parser.add_argument("--report", help="write a json report of the run summary to the specified file")
+
+
+
+# map each plc to its sim in the project file, the project file is written once for all of them, args
+# has the options added by addArguments(), and the phases of the run are added to summary
+def mapProject(projFile, pairings, args, summary):
+
+    if args.backupKeep < 0 or args.backupBudget < 0:
+        sys.exit("--backupKeep and --backupBudget must not be negative")
+
+    # locate and parse the mappings section of the xml project file
+    summary.startPhase("read project")
+    project = ProjectFile(projFile)
+    if not project.locateMappings():
+        sys.exit("project file doesn't contain a 'Mappings' section")
+    mappingRoot = project.readMappings()
+
+    summary.startPhase("map")
+    report = ValidationReport()
+    summary.report = report
+    changed = False
+    for pairing in pairings:
+        if len(pairings) > 1:
+            report.prefix = "plc %s: " % pairing.plcName
+        sim = SimSummary(pairing)
+        summary.sims.append(sim)
+        sim.update = mapSimulation(pairing, project, mappingRoot, report, sim, args.dump)
+        changed = changed or sim.update.changed()
+    summary.stopPhase()
+
+    # all problems are reported before exiting, and the project file isn't modified
+    report.printResult()
+    if report.problemCount():
+        project.close()
+        summary.finish("problems found", args.report)
+        sys.exit("found %d problem(s) in plc links, project file not modified" % report.problemCount())
+
+    if args.check:
+        project.close()
+        summary.finish("check only", args.report)
+        print()
+        print("check only, project file not modified")
+        return
+
+    if not changed:
+        project.close()
+        summary.finish("up to date", args.report)
+        print()
+        print("sim variable mappings are up to date, project file not modified")
+        return
+
+    # back up file before writing
+    summary.startPhase("backup")
+    backup = ProjectBackup(projFile, args.backupKeep, int(args.backupBudget * 1024 * 1024))
+    backup.backup()
+    summary.backup = backup
+
+    summary.startPhase("write")
+    project.write()
+    backup.printResult()
+    summary.finish("written", args.report)
+
+
+
+def main():
+
+    # process command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument("projFile", help="twincat tsproj xml input file")
+    parser.add_argument("plcName", nargs="?",
+                        help="twincat name of plc e.g. 'TIPC^XtesSxrPlc^XtesSxrPlc Instance'")
+    parser.add_argument("simName", nargs="?",
+                        help="twincat name of sim plc e.g. 'TIPC^ProtoSimPLC^ProtoSimPLC Instance'")
+    parser.add_argument("simTaskPrefix", nargs="?",
+                        help="twincat task name for sim e.g. 'SimTask'")
+    parser.add_argument("simDevicePrefix", nargs="?",
+                        help="twincat device prefix for sim e.g. 'TIID^Device 2 (EtherCAT Simulation)^'")
+    parser.add_argument("variableMapFile", nargs="?",
+                        help="variable map file from generator with plc variable, data type, and sim variable")
+    parser.add_argument("--batch", help="csv file with a line for each plc and sim pair in the project, " +
+                        "containing %s, instead of the plc and sim arguments" % ", ".join(Options.pairingColumns))
+    addArguments(parser)
+    args = parser.parse_args()
+
+    options = Options()
+
+    # make sure tsproj project file file is specified
+    if not args.projFile:
+        sys.exit("no input project file specified")
+    else:
+        print()
+        print("using project file: %s" % args.projFile)
+        options.projFile = args.projFile
+
+    # plc and sim pairs to map, from batch file or command line
+    pairings = []
+    if args.batch:
+        if args.plcName:
+            sys.exit("plc and sim arguments can't be used with --batch")
+        pairings = Options.readBatchFile(args.batch, options.projFile)
+    else:
+        # make sure plcName is specified
+        if not args.plcName:
+            sys.exit("no plcName specified")
+        else:
+            print()
+            print("using plcName: %s" % args.plcName)
+            options.plcName = args.plcName
+
+        # make sure simName is specified
+        if not args.simName:
+            sys.exit("no simName specified")
+        else:
+            print()
+            print("using simName: %s" % args.simName)
+            options.simName = args.simName
+
+        # make sure simTaskPrefix is specified
+        if not args.simTaskPrefix:
+            sys.exit("no simTaskPrefix specified")
+        else:
+            print()
+            print("using simTaskPrefix: %s" % args.simTaskPrefix)
+            options.simTaskPrefix = args.simTaskPrefix
+
+        # make sure simDevicePrefix is specified
+        if not args.simDevicePrefix:
+            sys.exit("no simDevicePrefix specified")
+        else:
+            print()
+            print("using simDevicePrefix: %s" % args.simDevicePrefix)
+            options.simDevicePrefix = args.simDevicePrefix
+
+        # make sure variableMapFile is specified
+        if not args.variableMapFile:
+            sys.exit("no variableMapFile specified")
+        else:
+            print()
+            print("using variableMapFile: %s" % args.variableMapFile)
+            options.variableMapFile = args.variableMapFile
+
+        pairings.append(options)
+
+    # map each plc to its sim, the project file is written once for all of them
+    mapProject(options.projFile, pairings, args, RunSummary(options.projFile))
+
 
-    ET.dump(simMap)
-    indent(root)
-    tree.write(options.projFile)
 
 if __name__ == '__main__':
     main()
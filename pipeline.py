@@ -0,0 +1,68 @@
+import sys
+import argparse
+
+import genPLC
+import mapSimIO
+from varMap import MemoryVarMap
+
+# runs the genPLC.py stages and the mapSimIO.py mapping in one process, the variable map built by the
+# generator is handed to the mapper in memory instead of through gen.varMap, the elapsed time of each
+# stage is printed in the mapper's summary and written to its json report
+
+
+
+def main():
+
+    # process command line, generator arguments followed by the mapper arguments
+    parser = argparse.ArgumentParser()
+    genPLC.addArguments(parser)
+    parser.add_argument("projFile", help="twincat tsproj xml input file")
+    parser.add_argument("plcName", help="twincat name of plc e.g. 'TIPC^XtesSxrPlc^XtesSxrPlc Instance'")
+    parser.add_argument("simName", help="twincat name of sim plc e.g. 'TIPC^ProtoSimPLC^ProtoSimPLC Instance'")
+    parser.add_argument("simTaskPrefix", help="twincat task name for sim e.g. 'SimTask'")
+    parser.add_argument("simDevicePrefix",
+                        help="twincat device prefix for sim e.g. 'TIID^Device 2 (EtherCAT Simulation)^'")
+    mapSimIO.addArguments(parser)
+    args = parser.parse_args()
+
+    # the mapper needs both the plc and sim trees
+    if args.tags or args.plc or args.sim:
+        sys.exit("--tags, --plc, and --sim can't be used with the pipeline")
+
+    summary = mapSimIO.RunSummary(args.projFile)
+
+    # generator stages
+    summary.startPhase("ingest")
+    options, handler = genPLC.readOptions(args)
+    deviceContainer, plcContainer, simContainer = genPLC.readDevices(args.deviceInfoFile, handler, options)
+
+    summary.startPhase("resolve")
+    graph = genPLC.resolveDependencies(deviceContainer, plcContainer, simContainer, options)
+
+    summary.startPhase("generate")
+    output, rowCache = genPLC.generateCode(deviceContainer, plcContainer, simContainer, graph, options)
+    genPLC.finishOutput(output, rowCache)
+
+    summary.startPhase("variable map")
+    variableMap, signalMaps = genPLC.PlcGenerator.variableMap(deviceContainer, plcContainer, simContainer)
+    summary.stopPhase()
+
+    handler.printResult(deviceContainer, options)
+
+    # mapper stages, with the variable map from the generator
+    pairing = mapSimIO.Options()
+    pairing.projFile = args.projFile
+    pairing.plcName = args.plcName
+    pairing.simName = args.simName
+    pairing.simTaskPrefix = args.simTaskPrefix
+    pairing.simDevicePrefix = args.simDevicePrefix
+    pairing.variableMap = MemoryVarMap(variableMap, signalMaps)
+
+    print()
+    print("using project file: %s" % args.projFile)
+    mapSimIO.mapProject(args.projFile, [pairing], args, summary)
+
+
+
+if __name__ == '__main__':
+    main()
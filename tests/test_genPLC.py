@@ -0,0 +1,123 @@
+import os
+import re
+import sys
+import json
+import subprocess
+import benchmark
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# documents rendered from the row cache, the main, diagnostic and variables files are always rendered
+unitDocuments = ["gen.plc.GVL_UNIT0", "gen.plc.PRG_UNIT0", "gen.plc.GVL_UNIT1", "gen.plc.PRG_UNIT1",
+                 "gen.sim.GVL_UNIT0", "gen.sim.PRG_UNIT0", "gen.sim.GVL_UNIT1", "gen.sim.PRG_UNIT1"]
+
+
+
+# run the generator in directory, return counts of rebuilt and reused documents, and the printed output
+def generate(directory, *args):
+
+    result = subprocess.run([sys.executable, os.path.join(repoDir, "genPLC.py"), "dev.csv"] + list(args),
+                            cwd=directory, check=True, stdout=subprocess.PIPE, text=True)
+    match = re.search(r"row cache: documents rebuilt: (\d+) reused: (\d+)", result.stdout)
+    return int(match.group(1)), int(match.group(2)), result.stdout
+
+
+
+def readFiles(directory, fileNames):
+    contents = {}
+    for fileName in fileNames:
+        with open(os.path.join(directory, fileName), 'rb') as f:
+            contents[fileName] = f.read()
+    return contents
+
+
+
+def documentKeys(directory):
+    with open(os.path.join(directory, "gen.rowcache")) as f:
+        return json.load(f)["documents"]
+
+
+
+def writeSheet(directory):
+    benchmark.writeDeviceSheet(os.path.join(directory, "dev.csv"), 12, 2)
+
+
+
+# a document is only reused when its key and its file are unchanged
+def test_rowCacheReuse(tmp_path):
+
+    writeSheet(str(tmp_path))
+    assert generate(tmp_path)[0:2] == (len(unitDocuments), 0)
+    contents = readFiles(tmp_path, unitDocuments)
+
+    # nothing changed
+    rebuilt, reused, out = generate(tmp_path)
+    assert (rebuilt, reused) == (0, len(unitDocuments))
+    assert "files changed: 0" in out
+    assert readFiles(tmp_path, unitDocuments) == contents
+
+    # file modified since the previous run
+    with open(tmp_path / "gen.plc.PRG_UNIT0", 'ab') as f:
+        f.write(b"// edited\n")
+    rebuilt, reused, out = generate(tmp_path)
+    assert (rebuilt, reused) == (1, len(unitDocuments) - 1)
+    assert "changed   gen.plc.PRG_UNIT0" in out
+    assert readFiles(tmp_path, unitDocuments) == contents
+
+    # file removed since the previous run
+    os.remove(tmp_path / "gen.sim.GVL_UNIT1")
+    assert generate(tmp_path)[0:2] == (1, len(unitDocuments) - 1)
+    assert readFiles(tmp_path, unitDocuments) == contents
+
+    # device changed, only the documents whose key changed are rendered
+    keys = documentKeys(tmp_path)
+    with open(tmp_path / "dev.csv") as f:
+        sheet = f.read()
+    sheet = sheet.replace("TV3K0-UNIT1-GCC-3,?blank#X", "TV3K0-UNIT1-GCC-3,TV3K0-UNIT1-GPI-3")
+    with open(tmp_path / "dev.csv", 'w', newline='') as f:
+        f.write(sheet)
+    rebuilt, reused, out = generate(tmp_path)
+    changedKeys = [fileName for fileName, key in documentKeys(tmp_path).items() if keys[fileName] != key]
+    assert "changed TV3K0-UNIT1-VGC-3" in out
+    assert "gen.plc.PRG_UNIT1" in changedKeys
+    assert not "gen.plc.PRG_UNIT0" in changedKeys
+    assert (rebuilt, reused) == (len(changedKeys), len(unitDocuments) - len(changedKeys))
+
+    # a run with the same rows in a fresh directory renders the same files
+    freshDir = tmp_path / "fresh"
+    os.mkdir(freshDir)
+    with open(freshDir / "dev.csv", 'w', newline='') as f:
+        f.write(sheet)
+    generate(freshDir)
+    assert readFiles(tmp_path, unitDocuments) == readFiles(freshDir, unitDocuments)
+
+
+
+# unchanged files are not rewritten, files a previous run wrote that this run would have are removed
+def test_outputFiles(tmp_path):
+
+    writeSheet(str(tmp_path))
+    generate(tmp_path)
+    mtimes = dict([(fileName, os.stat(tmp_path / fileName).st_mtime_ns) for fileName in unitDocuments])
+    out = generate(tmp_path)[2]
+    assert not re.search(r"^changed ", out, re.MULTILINE)
+    assert mtimes == dict([(fileName, os.stat(tmp_path / fileName).st_mtime_ns) for fileName in unitDocuments])
+
+    mainFiles = ["gen.plc.PRG_MAIN_1", "gen.plc.PRG_MAIN_2", "gen.sim.PRG_MAIN_1", "gen.sim.PRG_MAIN_2"]
+    generate(tmp_path, "--tasks", "2")
+    assert all([os.path.exists(tmp_path / fileName) for fileName in mainFiles])
+
+    # sim files are kept when only the plc is generated, an edited file is never removed
+    with open(tmp_path / "gen.plc.PRG_MAIN_1", 'ab') as f:
+        f.write(b"// edited\n")
+    out = generate(tmp_path, "--plc")[2]
+    assert "removed   gen.plc.PRG_MAIN_2" in out
+    assert "not removed, modified since: gen.plc.PRG_MAIN_1" in out
+    assert [os.path.exists(tmp_path / fileName) for fileName in mainFiles] == [True, False, True, True]
+
+    out = generate(tmp_path)[2]
+    assert "stale files from previous run removed: 2" in out
+    assert [os.path.exists(tmp_path / fileName) for fileName in mainFiles] == [True, False, False, False]
+    with open(tmp_path / "gen.manifest") as f:
+        manifest = f.read()
+    assert not "gen.sim.PRG_MAIN_1" in manifest and not "gen.plc.PRG_MAIN_2" in manifest
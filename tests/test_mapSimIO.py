@@ -0,0 +1,183 @@
+import os
+import argparse
+import xml.etree.ElementTree as ET
+import pytest
+import genPLC
+import benchmark
+import mapSimIO
+from varMap import VarMap
+
+plcName = "TIPC^Plc^Plc Instance"
+simName = "TIPC^Sim^Sim Instance"
+
+
+
+def simMappings():
+    simMap = ET.Element('OwnerA')
+    simMap.set("Name", simName)
+    deviceNode = ET.SubElement(simMap, 'OwnerB')
+    deviceNode.set("Name", "TIID^Device 2 (EtherCAT Simulation)^Term 1")
+    linkNode = ET.SubElement(deviceNode, 'Link')
+    linkNode.set("VarA", "SimTask Outputs^GVL_SIM.DEV_SIM.q_iRawPress")
+    linkNode.set("VarB", "Channel 1^Value")
+    return simMap
+
+
+
+def writeLines(fileName, lines, newline):
+    with open(fileName, 'wb') as f:
+        f.write(newline.join(lines) + newline)
+
+
+
+# a self closing Mappings element is expanded, with the file's line ends, the rest of the file is unchanged
+@pytest.mark.parametrize("newline", [b"\n", b"\r\n"])
+def test_appendToSelfClosingMappings(tmp_path, newline):
+
+    projFile = str(tmp_path / "test.tsproj")
+    head = [b'<?xml version="1.0"?>', b'<TcSmProject TcSmVersion="1.0">', b'\t<Project/>']
+    writeLines(projFile, head + [b'\t<Mappings/>', b'</TcSmProject>'], newline)
+
+    project = mapSimIO.ProjectFile(projFile)
+    assert project.locateMappings()
+    assert project.closeStart == -1
+    assert project.newline == newline
+    assert len(project.readMappings()) == 0
+    project.appendToMappings(simMappings())
+    project.write()
+
+    with open(projFile, 'rb') as f:
+        assert f.read() == newline.join(head + [
+            b'\t<Mappings>',
+            b'\t\t<OwnerA Name="TIPC^Sim^Sim Instance">',
+            b'\t\t\t<OwnerB Name="TIID^Device 2 (EtherCAT Simulation)^Term 1">',
+            b'\t\t\t\t<Link VarA="SimTask Outputs^GVL_SIM.DEV_SIM.q_iRawPress" VarB="Channel 1^Value" />',
+            b'\t\t\t</OwnerB>',
+            b'\t\t</OwnerA>',
+            b'\t</Mappings>',
+            b'</TcSmProject>']) + newline
+
+
+
+def test_replaceInCrlfMappings(tmp_path):
+
+    projFile = str(tmp_path / "test.tsproj")
+    head = [b'<?xml version="1.0"?>', b'<TcSmProject>', b'\t<Mappings>']
+    plcMap = [b'\t\t<OwnerA Name="TIPC^Plc^Plc Instance">', b'\t\t</OwnerA>']
+    tail = [b'\t</Mappings>', b'</TcSmProject>']
+    writeLines(projFile, head + plcMap + [b'\t\t<OwnerA Name="TIPC^Sim^Sim Instance"/>'] + tail, b"\r\n")
+
+    project = mapSimIO.ProjectFile(projFile)
+    assert project.locateMappings()
+    assert project.newline == b"\r\n"
+    project.replaceInMappings('OwnerA', simName, simMappings())
+    project.write()
+
+    with open(projFile, 'rb') as f:
+        content = f.read()
+    assert not b"\n" in content.replace(b"\r\n", b"")
+    assert content.startswith(b"\r\n".join(head + plcMap) + b"\r\n")
+    assert content.endswith(b"\r\n".join(tail) + b"\r\n")
+    assert len(ET.fromstring(content).findall("./Mappings/OwnerA[@Name='%s']/OwnerB/Link" % simName)) == 1
+
+
+
+# existing sim mappings are updated in place, derived links are added, other links removed
+def test_mappingUpdateApply():
+
+    derivedMap = simMappings()
+    existingMap = ET.Element('OwnerA')
+    existingMap.set("Name", simName)
+    deviceNode = ET.SubElement(existingMap, 'OwnerB')
+    deviceNode.set("Name", "TIID^Device 2 (EtherCAT Simulation)^Term 1")
+    linkNode = ET.SubElement(deviceNode, 'Link')
+    linkNode.set("VarA", "SimTask Outputs^GVL_SIM.OLD_SIM.q_iRawPress")
+    linkNode.set("VarB", "Channel 1^Value")
+    removedNode = ET.SubElement(existingMap, 'OwnerB')
+    removedNode.set("Name", "TIID^Device 2 (EtherCAT Simulation)^Term 9")
+
+    update = mapSimIO.MappingUpdate()
+    update.apply(existingMap, derivedMap)
+    assert update.changed()
+    assert (update.added, update.removed, update.unchanged) == (1, 1, 0)
+    assert update.devicesRemoved == 1
+    assert ET.tostring(existingMap) == ET.tostring(simMappings())
+
+    update = mapSimIO.MappingUpdate()
+    update.apply(existingMap, simMappings())
+    assert not update.changed()
+    assert (update.added, update.removed, update.unchanged) == (0, 0, 1)
+    assert ET.tostring(existingMap) == ET.tostring(simMappings())
+
+
+
+def mapArgs():
+    return argparse.Namespace(check=False, backupKeep=10, backupBudget=0, dump=False, report=None)
+
+
+
+def pairing(variableMapFile):
+    options = mapSimIO.Options()
+    options.plcName = plcName
+    options.simName = simName
+    options.simTaskPrefix = "SimTask"
+    options.simDevicePrefix = "TIID^Device 2 (EtherCAT Simulation)^"
+    options.variableMapFile = variableMapFile
+    return options
+
+
+
+# mapping a project a second time finds the sim mappings up to date and doesn't write the project file
+# or back it up
+def test_mapProjectTwice(tmp_path, monkeypatch, capsys):
+
+    monkeypatch.chdir(tmp_path)
+    genPLC.PlcDevice.compileRegistry()
+    signalMaps = genPLC.PlcDevice.signalMaps
+    variableMap = {"EM1K0_GMD_GPI_10": {'type': "FB_MKS275", 'simVar': "EM1K0_GMD_GPI_10_SIM"},
+                   "TV1K0_GAS_VGC_1": {'type': "FB_VGC", 'simVar': "TV1K0_GAS_VGC_1_SIM"}}
+    VarMap.write("gen.varMap", variableMap, signalMaps)
+    benchmark.writeProject("test.tsproj", variableMap, signalMaps)
+
+    mapSimIO.mapProject("test.tsproj", [pairing("gen.varMap")], mapArgs(), mapSimIO.RunSummary("test.tsproj"))
+    with open("test.tsproj", 'rb') as f:
+        content = f.read()
+    simMap = ET.fromstring(content).findall("./Mappings/OwnerA[@Name='%s']" % simName)
+    assert len(simMap) == 1
+    linkCount = len(simMap[0].findall("OwnerB/Link"))
+    assert linkCount == len(signalMaps["FB_MKS275"]) + len(signalMaps["FB_VGC"])
+    assert not b"\n" in content.replace(b"\r\n", b"")
+    backups = sorted([fileName for fileName in os.listdir(".") if ".bak." in fileName])
+    assert len(backups) == 1
+    capsys.readouterr()
+
+    stat = os.stat("test.tsproj")
+    mapSimIO.mapProject("test.tsproj", [pairing("gen.varMap")], mapArgs(), mapSimIO.RunSummary("test.tsproj"))
+    out = capsys.readouterr().out
+    assert "sim links added: 0 removed: 0 unchanged: %d" % linkCount in out
+    assert "project file not modified" in out
+    with open("test.tsproj", 'rb') as f:
+        assert f.read() == content
+    assert os.stat("test.tsproj").st_mtime_ns == stat.st_mtime_ns
+    assert sorted([fileName for fileName in os.listdir(".") if ".bak." in fileName]) == backups
+    assert not os.path.exists("test.tsproj.tmp")
+
+
+
+# parsed like the previous string splitting implementation, including repeated heads served from the cache
+def test_linkPathParser():
+
+    parser = mapSimIO.LinkPathParser("SimTask")
+    paths = ["PlcTask Inputs^GVL_GMD.EM1K0_GMD_GPI_10.i_iPRESS_R",
+             "PlcTask Inputs^GVL_GMD.EM1K0_GMD_GPI_10.i_xHiLim",
+             "PlcTask Outputs^GVL_GATT.TV1K0_GAS_VGC_1.q_xOPN_DO",
+             "PlcTask Outputs^GVL_GATT.TV1K0_GAS_VGC_1.q_xOPN_DO"]
+    for path in paths:
+        assert parser.parse(path) == benchmark.legacyParseLink(path, "SimTask")
+    assert parser.parse(paths[0]) == ("SimTask Outputs", "GVL_GMD", "EM1K0_GMD_GPI_10", "i_iPRESS_R")
+    assert parser.parse(paths[2])[0] == "SimTask Inputs"
+
+    for path in ["PlcTask^GVL_GMD.EM1K0_GMD_GPI_10.i_iPRESS_R", "PlcTask Inputs^GVL_GMD.i_iPRESS_R",
+                 "PlcTask Inputs GVL_GMD.EM1K0_GMD_GPI_10.i_iPRESS_R"]:
+        with pytest.raises(mapSimIO.LinkPathError):
+            parser.parse(path)
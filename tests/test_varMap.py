@@ -0,0 +1,115 @@
+import os
+import sys
+import pickle
+import subprocess
+import pytest
+import genPLC
+from varMap import VarMap, VarMapError
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+def signalMaps():
+    genPLC.PlcDevice.compileRegistry()
+    return genPLC.PlcDevice.signalMaps
+
+
+
+def variableMap():
+    return {"TV1K0_GAS_VGC_1": {'type': "FB_VGC", 'simVar': "TV1K0_GAS_VGC_1_SIM"},
+            "EM1K0_GMD_GCC_20": {'type': "FB_MKS500", 'simVar': "EM1K0_GMD_GCC_20_SIM"},
+            "EM1K0_GMD_GPI_10": {'type': "FB_MKS275", 'simVar': "EM1K0_GMD_GPI_10_SIM"},
+            "TV1K0_GAS_VCN_1": {'type': "FB_VCN", 'simVar': "TV1K0_GAS_VCN_1_SIM"},
+            "PUMP_Ü": {'type': "FB_NoSignalMap", 'simVar': "PUMP_Ü_SIM"}}
+
+
+
+def checkContents(reader, expected, expectedSignalMaps):
+    assert len(reader) == len(expected)
+    for varName, variableData in expected.items():
+        assert varName in reader
+        assert reader.get(varName) == variableData
+    assert dict(reader.items()) == expected
+    for typeName, signalMap in expectedSignalMaps.items():
+        assert reader.signalMap(typeName) == signalMap
+    assert reader.get("TV1K0_GAS_VGC_") is None
+    assert reader.get("ZZZ") is None
+    assert not "" in reader
+    assert reader.signalMap("FB_NoSignalMap") is None
+
+
+
+# encode, write, and look up every variable in the memory mapped file
+def test_roundTrip(tmp_path):
+
+    maps = dict([(plcType, signalMaps()[plcType]) for plcType in ["FB_VGC", "FB_MKS500", "FB_MKS275"]])
+    fileName = str(tmp_path / "gen.varMap")
+    VarMap.write(fileName, variableMap(), maps)
+    assert not VarMap.isLegacyFile(fileName)
+    with open(fileName, 'rb') as f:
+        assert f.read() == VarMap.encode(variableMap(), maps)
+
+    with VarMap.open(fileName) as reader:
+        checkContents(reader, variableMap(), maps)
+        assert reader.signalMap("FB_VCN") is None
+
+
+
+def test_roundTripManyEntries(tmp_path):
+
+    # binary search over more entries than the handful above, in non sorted insertion order
+    variables = dict([("VAR_%05d" % ((ind * 7919) % 2000), {'type': "FB_%d" % (ind % 3), 'simVar': "SIM_%d" % ind})
+                      for ind in range(2000)])
+    fileName = str(tmp_path / "gen.varMap")
+    VarMap.write(fileName, variables)
+    with VarMap.open(fileName) as reader:
+        checkContents(reader, variables, {})
+
+
+
+def test_openLegacyFile(tmp_path):
+
+    fileName = str(tmp_path / "gen.varMap")
+    with open(fileName, 'wb') as f:
+        pickle.dump(variableMap(), f)
+    assert VarMap.isLegacyFile(fileName)
+    with pytest.raises(VarMapError, match="--migrate"):
+        VarMap.open(fileName)
+
+
+
+# legacy pickled files get the signal maps declared by the device classes
+def test_migrate(tmp_path):
+
+    legacyFile = str(tmp_path / "legacy.varMap")
+    fileName = str(tmp_path / "gen.varMap")
+    with open(legacyFile, 'wb') as f:
+        pickle.dump(variableMap(), f)
+
+    assert VarMap.migrate(legacyFile, fileName, signalMaps()) == len(variableMap())
+    expectedSignalMaps = dict([(plcType, signalMaps()[plcType])
+                               for plcType in ["FB_VGC", "FB_MKS500", "FB_MKS275"]])
+    with VarMap.open(fileName) as reader:
+        checkContents(reader, variableMap(), expectedSignalMaps)
+        assert reader.signalMap("FB_VCN") is None
+
+
+
+def test_migrateCommandLine(tmp_path):
+
+    fileName = str(tmp_path / "gen.varMap")
+    with open(fileName, 'wb') as f:
+        pickle.dump(variableMap(), f)
+
+    subprocess.run([sys.executable, os.path.join(repoDir, "varMap.py"), "--migrate", fileName],
+                   check=True, stdout=subprocess.DEVNULL)
+    assert not VarMap.isLegacyFile(fileName)
+    with VarMap.open(fileName) as reader:
+        checkContents(reader, variableMap(), {"FB_VGC": signalMaps()["FB_VGC"]})
+
+    # already migrated
+    result = subprocess.run([sys.executable, os.path.join(repoDir, "varMap.py"), "--migrate", fileName],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    assert result.returncode != 0
+    assert "already in the compact format" in result.stderr
@@ -0,0 +1,373 @@
+import sys
+import argparse
+import struct
+import mmap
+import pickle
+
+# variable map file handed from genPLC.py to mapSimIO.py, maps each plc function block variable name to
+# its function block type and the name of the sim struct variable for the same device, and contains the
+# signal map of each function block type, mapping its signals to sim struct fields
+#
+# file layout, all integers little endian:
+#   header        magic, format version, type count, entry count, signal count, offsets of the sections
+#   type table    (offset, length) into the string blob for each distinct function block type name,
+#                 and (first, count) of the type's records in the signal table
+#   entry index   (key offset, key length, sim var offset, sim var length, type index) for each
+#                 variable, sorted by the utf-8 bytes of the variable name for binary search
+#   signal table  (plc signal offset, length, sim signal offset, length) for the signals of each type
+#   string blob   utf-8 variable names, sim variable names, type names, and signal names
+#
+# readers memory map the file and look up variables without deserializing the whole map
+
+
+
+class VarMapError(Exception):
+    pass
+
+
+
+class VarMap:
+
+
+
+    magic = b"VMAP"
+    version = 2
+
+    # magic, version, reserved, types, entries, signals, type/index/signal/blob offsets
+    header = struct.Struct("<4sHHIIIIIII")
+    typeRecord = struct.Struct("<IIII") # blob offset, length, first signal, signal count
+    entryRecord = struct.Struct("<IHIHH") # key offset, key length, sim var offset, sim var length, type
+    signalRecord = struct.Struct("<IHIH") # plc signal offset, length, sim signal offset, length
+
+
+
+    # return file content for a map of plc variable name to {'type': fb type, 'simVar': sim variable},
+    # and a map of fb type to its signal map, {plc signal: sim struct field}
+    @classmethod
+    def encode(cls, variableMap, signalMaps=None):
+
+        signalMaps = signalMaps or {}
+        blob = bytearray()
+        strings = {}
+        def addString(value):
+            data = value.encode("utf-8")
+            if not data in strings:
+                strings[data] = len(blob)
+                blob.extend(data)
+            return strings[data], len(data)
+
+        # string table for the repeated function block type names, with the signals of each type
+        typeIndex = {}
+        typeRecords = []
+        signalRecords = []
+        plcTypes = [variableData['type'] for variableData in variableMap.values()] + list(signalMaps.keys())
+        for plcType in plcTypes:
+            if not plcType in typeIndex:
+                typeIndex[plcType] = len(typeRecords)
+                nameOffset, nameLength = addString(plcType)
+                signalMap = signalMaps.get(plcType, {})
+                typeRecords.append(cls.typeRecord.pack(nameOffset, nameLength,
+                                                       len(signalRecords), len(signalMap)))
+                for plcSignal, simSignal in signalMap.items():
+                    signalRecords.append(cls.signalRecord.pack(*(addString(plcSignal) +
+                                                                 addString(simSignal))))
+
+        # entries sorted by encoded name
+        entries = sorted([(varName.encode("utf-8"), variableData)
+                          for varName, variableData in variableMap.items()], key=lambda e: e[0])
+        entryRecords = []
+        for key, variableData in entries:
+            keyOffset = len(blob)
+            blob.extend(key)
+            simOffset, simLength = addString(variableData['simVar'])
+            entryRecords.append(cls.entryRecord.pack(keyOffset, len(key), simOffset, simLength,
+                                                     typeIndex[variableData['type']]))
+
+        typeOffset = cls.header.size
+        indexOffset = typeOffset + len(typeRecords) * cls.typeRecord.size
+        signalOffset = indexOffset + len(entryRecords) * cls.entryRecord.size
+        blobOffset = signalOffset + len(signalRecords) * cls.signalRecord.size
+        return b"".join([cls.header.pack(cls.magic, cls.version, 0, len(typeRecords), len(entryRecords),
+                                         len(signalRecords), typeOffset, indexOffset, signalOffset,
+                                         blobOffset)] +
+                        typeRecords + entryRecords + signalRecords + [bytes(blob)])
+
+
+
+    @classmethod
+    def write(cls, fileName, variableMap, signalMaps=None):
+        with open(fileName, 'wb') as f:
+            f.write(cls.encode(variableMap, signalMaps))
+
+
+
+    @classmethod
+    def open(cls, fileName):
+        return VarMapReader(fileName)
+
+
+
+    # files written before the compact format are pickled dicts, only load them from trusted sources
+    @classmethod
+    def isLegacyFile(cls, fileName):
+        with open(fileName, 'rb') as f:
+            return f.read(len(cls.magic)) != cls.magic
+
+
+
+    # legacy files don't contain signal maps, the signal maps of the types in the file are taken from
+    # signalMaps, the signal maps declared by the genPLC.py device classes
+    @classmethod
+    def migrate(cls, legacyFileName, fileName, signalMaps):
+        with open(legacyFileName, 'rb') as f:
+            variableMap = pickle.load(f)
+        if not isinstance(variableMap, dict):
+            raise VarMapError("legacy variable map file %s doesn't contain a dict" % legacyFileName)
+        typeSignalMaps = {}
+        for variableData in variableMap.values():
+            if variableData['type'] in signalMaps:
+                typeSignalMaps[variableData['type']] = signalMaps[variableData['type']]
+        cls.write(fileName, variableMap, typeSignalMaps)
+        return len(variableMap)
+
+
+
+class VarMapReader:
+
+
+
+    def __init__(self, fileName):
+
+        self.fileName = fileName
+        with open(fileName, 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # empty file
+                raise VarMapError("variable map file %s is empty" % fileName)
+
+        if len(self.data) < VarMap.header.size or self.data[0:len(VarMap.magic)] != VarMap.magic:
+            self.close()
+            raise VarMapError("variable map file %s is not in the compact format, " % fileName +
+                              "a legacy file can be converted with 'python varMap.py --migrate %s'" %
+                              fileName)
+
+        version = struct.unpack_from("<H", self.data, len(VarMap.magic))[0]
+        if version != VarMap.version:
+            self.close()
+            raise VarMapError("variable map file %s has unsupported format version %d, " % (fileName, version) +
+                              "run genPLC.py again to create it")
+        (magic, version, reserved, self.typeCount, self.entryCount, self.signalCount, self.typeOffset,
+         self.indexOffset, self.signalOffset, self.blobOffset) = VarMap.header.unpack_from(self.data, 0)
+
+        # type names are few, decode them once, signal maps are decoded when first used
+        self.typeNames = []
+        self.typeSignals = {} # type name to (first signal, signal count)
+        self.signalMaps = {}
+        for ind in range(self.typeCount):
+            offset, length, first, count = VarMap.typeRecord.unpack_from(
+                self.data, self.typeOffset + ind * VarMap.typeRecord.size)
+            typeName = self.string(offset, length)
+            self.typeNames.append(typeName)
+            if count:
+                self.typeSignals[typeName] = (first, count)
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+
+    def close(self):
+        if self.data:
+            self.data.close()
+            self.data = None
+
+
+
+    def __len__(self):
+        return self.entryCount
+
+
+
+    def __contains__(self, varName):
+        return self.find(varName) != -1
+
+
+
+    def string(self, offset, length):
+        start = self.blobOffset + offset
+        return self.data[start:start + length].decode("utf-8")
+
+
+
+    def entry(self, ind):
+        return VarMap.entryRecord.unpack_from(self.data, self.indexOffset + ind * VarMap.entryRecord.size)
+
+
+
+    def key(self, ind):
+        keyOffset, keyLength, simOffset, simLength, typeInd = self.entry(ind)
+        start = self.blobOffset + keyOffset
+        return self.data[start:start + keyLength]
+
+
+
+    # binary search of the sorted index, returns entry index or -1
+    def find(self, varName):
+        key = varName.encode("utf-8")
+        lo = 0
+        hi = self.entryCount
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.entryCount and self.key(lo) == key:
+            return lo
+        return -1
+
+
+
+    def variableData(self, ind):
+        keyOffset, keyLength, simOffset, simLength, typeInd = self.entry(ind)
+        return {'type': self.typeNames[typeInd], 'simVar': self.string(simOffset, simLength)}
+
+
+
+    # return {'type': fb type, 'simVar': sim variable} for plc variable name, or None
+    def get(self, varName):
+        ind = self.find(varName)
+        if ind == -1:
+            return None
+        return self.variableData(ind)
+
+
+
+    # return signal map {plc signal: sim struct field} for function block type, or None if the file
+    # doesn't contain a signal map for the type
+    def signalMap(self, typeName):
+        signalMap = self.signalMaps.get(typeName)
+        if signalMap is None and typeName in self.typeSignals:
+            first, count = self.typeSignals[typeName]
+            signalMap = {}
+            for ind in range(first, first + count):
+                plcOffset, plcLength, simOffset, simLength = VarMap.signalRecord.unpack_from(
+                    self.data, self.signalOffset + ind * VarMap.signalRecord.size)
+                signalMap[self.string(plcOffset, plcLength)] = self.string(simOffset, simLength)
+            self.signalMaps[typeName] = signalMap
+        return signalMap
+
+
+
+    def items(self):
+        for ind in range(self.entryCount):
+            keyOffset, keyLength, simOffset, simLength, typeInd = self.entry(ind)
+            yield self.string(keyOffset, keyLength), self.variableData(ind)
+
+
+
+# variable map held in memory, with the VarMapReader interface, used by pipeline.py to hand the maps
+# built by the generator to the mapper without writing and reading the file
+class MemoryVarMap:
+
+
+
+    def __init__(self, variableMap, signalMaps):
+        self.variableMap = variableMap
+        self.signalMaps = signalMaps
+        self.typeNames = list(dict.fromkeys([variableData['type'] for variableData in variableMap.values()]))
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+
+    def close(self):
+        pass
+
+
+
+    def __len__(self):
+        return len(self.variableMap)
+
+
+
+    def __contains__(self, varName):
+        return varName in self.variableMap
+
+
+
+    def get(self, varName):
+        return self.variableMap.get(varName)
+
+
+
+    def signalMap(self, typeName):
+        return self.signalMaps.get(typeName)
+
+
+
+    def items(self):
+        return self.variableMap.items()
+
+
+
+def main():
+
+    # process command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument("variableMapFile", help="variable map file created by genPLC.py")
+    parser.add_argument("--migrate", help="convert legacy pickled variable map file to the compact format, " +
+                        "only use with files created by genPLC.py", action="store_true")
+    parser.add_argument("--output", help="output file for --migrate, default is to replace the input file")
+    args = parser.parse_args()
+
+    if args.migrate:
+        if not VarMap.isLegacyFile(args.variableMapFile):
+            sys.exit("variable map file %s is already in the compact format" % args.variableMapFile)
+        outputFile = args.output or args.variableMapFile
+        try:
+            # signal maps are declared with the device classes of the generator
+            import genPLC
+            genPLC.PlcDevice.compileRegistry()
+            count = VarMap.migrate(args.variableMapFile, outputFile, genPLC.PlcDevice.signalMaps)
+        except Exception as ex:
+            sys.exit("error migrating variable map file: %s" % ex)
+        print("migrated %d variable(s) to %s" % (count, outputFile))
+        return
+
+    # print contents
+    try:
+        with VarMap.open(args.variableMapFile) as varMap:
+            print("variable map file %s format version %d: %d variable(s), %d type(s)" %
+                  (args.variableMapFile, VarMap.version, len(varMap), len(varMap.typeNames)))
+            for varName, variableData in varMap.items():
+                print("%s %s %s" % (varName, variableData['type'], variableData['simVar']))
+            for typeName in varMap.typeNames:
+                signalMap = varMap.signalMap(typeName)
+                if signalMap is None:
+                    print("%s: no signal map" % typeName)
+                    continue
+                print("%s: %s" % (typeName, ", ".join(["%s -> %s" % (plcSignal, simSignal)
+                                                        for plcSignal, simSignal in signalMap.items()])))
+    except VarMapError as ex:
+        sys.exit(str(ex))
+
+
+
+if __name__ == '__main__':
+    main()